@@ -1,2 +1,5 @@
 from .parser import Parser
 from .formulas import error
+from .context import EvaluationContext
+from .arena import BufferArena
+from .dictionary import DictionaryArray
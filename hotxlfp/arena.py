@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Buffer arenas keep the intermediate tensors of arithmetic in buffers that are
+reused between evaluations instead of allocating new ones every time:
+
+    with BufferArena() as arena:
+        for batch in batches:
+            results.append(formula(batch))
+    arena.peak_bytes
+
+Buffer lifetimes are planned from the structure of the formula when it is
+parsed. plan_buffers walks the closure tree in evaluation order and gives every
+arithmetic operator a slot: the value of a node lives from the moment it is
+computed until the node that takes it runs, its last use, and from then on its
+slot can hold another value. An operator writes its result over the slot of one
+of its operands, and a function call frees the slots of its arguments once it
+returns. An arena keeps a buffer per slot and shape, so evaluations of the same
+shape write into the same buffers. Values the plan can't follow, like the
+results of the formula, subexpressions a FormulaSet shares and arguments a
+function returns, stop using their buffer and it is allocated again.
+"""
+import torch
+from .context import EvaluationContext
+
+
+class BufferPlan(object):
+    """ The slots of the intermediate values of a formula, see plan_buffers """
+
+    def __init__(self):
+        self.slots = 0
+
+
+class BufferSite(object):
+    """
+    An operator or a function call in a formula, plan_buffers assigns it the
+    slot its result is written into (operators) or may be returned in (function
+    calls returning one of their arguments), None when it has none.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.plan = None
+        self.slot = None
+
+
+def plan_buffers(root):
+    """
+    Assigns slots to the sites of the closure tree under root, whose nodes
+    have the closures of their parts and their site, see grammarparser's
+    Parser.node. Children are visited in the order closures evaluate them, left
+    to right.
+    """
+    plan = BufferPlan()
+    free = []
+
+    def take():
+        if free:
+            return free.pop()
+        plan.slots += 1
+        return plan.slots - 1
+
+    def visit(node):
+        """ The slots of the values node evaluates to that are still to be used """
+        held = [slot for child in _children(node) for slot in visit(child)]
+        site = getattr(node, 'site', None)
+        if site is None:
+            # lists of arguments hold their values, any other node holds on to
+            # the slots of its parts to the end
+            return held if getattr(node, 'holds_parts', False) else []
+        site.plan = plan
+        if site.kind == 'operator':
+            # the result is written over the slot of an operand, the other one dies here
+            site.slot = held[0] if held else take()
+        else:
+            # a function may return an argument, its result keeps the slot of the first one
+            site.slot = held[0] if held else None
+        free.extend(reversed(held[1:]))
+        if site.slot is None or getattr(node, 'shared', False):
+            # other expressions read a shared value, it is never overwritten in the same evaluation
+            return []
+        return [site.slot]
+
+    if callable(root):
+        visit(root)
+    return plan
+
+
+def _children(node):
+    for part in getattr(node, 'parts', ()):
+        if isinstance(part, list):
+            for item in part:
+                if callable(item):
+                    yield item
+        elif callable(part):
+            yield part
+
+
+class BufferArena(EvaluationContext):
+    """
+    An evaluation context whose arithmetic writes into the arena's buffers, one
+    for each slot of the plan of a formula and shape. allocations counts the
+    buffers it allocated, reserved_bytes is the memory of the buffers it holds
+    and peak_bytes the most memory the buffers an evaluation wrote into took.
+    """
+
+    def __init__(self, precision=None):
+        super(BufferArena, self).__init__(precision)
+        self.arena = self
+        self._buffers = {}
+        # the keys of the buffers, by the id of their storage
+        self._keys = {}
+        self._written = {}
+        self.allocations = 0
+        self.reserved_bytes = 0
+        self.peak_bytes = 0
+
+    def _buffer(self, site, shape, dtype):
+        key = (id(site.plan), site.slot, shape, dtype)
+        entry = self._buffers.get(key)
+        if entry is None:
+            buffer = torch.empty(shape, dtype=dtype)
+            # the plan is kept with its buffers so its id isn't reused while they are
+            self._buffers[key] = (site.plan, buffer)
+            self._keys[_storage(buffer)] = key
+            self.allocations += 1
+            self.reserved_bytes += _nbytes(buffer)
+        else:
+            buffer = entry[1]
+        self._written[key] = _nbytes(buffer)
+        return buffer
+
+    def _key(self, value):
+        """ The key of the buffer value is or is a view of, None when it isn't one of the arena's """
+        if not isinstance(value, torch.Tensor):
+            return None
+        return self._keys.get(_storage(value))
+
+    def binary(self, op, a, b, site):
+        """
+        op(a, b, out=...) for an elementwise torch op, written into the buffer of
+        the slot the plan gave site. None when the site has no slot or the
+        operands aren't a column and a number of a floating point result.
+        """
+        if site is None or site.slot is None:
+            return None
+        if not any(isinstance(x, torch.Tensor) and x.ndim > 0 for x in (a, b)):
+            return None
+        if not all(isinstance(x, (torch.Tensor, int, float)) and not isinstance(x, bool) for x in (a, b)):
+            return None
+        a, b = [x if isinstance(x, torch.Tensor) else torch.tensor(x) for x in (a, b)]
+        dtype = torch.result_type(a, b)
+        if not dtype.is_floating_point:
+            return None
+        shape = tuple(torch.broadcast_shapes(a.shape, b.shape))
+        if 0 in shape:
+            # empty tensors share no storage to tell their buffers apart by
+            return None
+        out = self._buffer(site, shape, dtype)
+        for operand in (a, b):
+            if operand is not out and operand.ndim > 0 and _storage(operand) == _storage(out):
+                # only the very buffer can be written over elementwise, not other views of it
+                return None
+        return op(a, b, out=out)
+
+    def returned(self, args, result, site):
+        """
+        Ends a function call of site, the slots of its arguments are free unless
+        the result is one of them. Arguments the result is made of, other than
+        the one in the slot the plan keeps for the result, stop using their buffer.
+        """
+        kept = None if site is None or site.slot is None else (id(site.plan), site.slot)
+        held = _storages(result)
+        for value in _values(args):
+            key = self._key(value)
+            if key is not None and _storage(value) in held and key[:2] != kept:
+                self._forget(key)
+
+    def escape(self, values):
+        """ Stops reusing the buffers among values, they are held on to by whatever they were given to """
+        for value in _values(values):
+            key = self._key(value)
+            if key is not None:
+                self._forget(key)
+
+    def _forget(self, key):
+        plan, buffer = self._buffers.pop(key)
+        del self._keys[_storage(buffer)]
+        self.reserved_bytes -= _nbytes(buffer)
+
+    def finish(self, result):
+        """ Ends an evaluation, the buffers go back to the arena except the result's """
+        self.escape([result])
+        self.peak_bytes = max(self.peak_bytes, sum(self._written.values()))
+        self._written = {}
+        return result
+
+
+def _values(values):
+    for value in values:
+        if isinstance(value, dict):
+            for item in _values(list(value.values())):
+                yield item
+        elif isinstance(value, (list, tuple)):
+            for item in _values(value):
+                yield item
+        else:
+            yield value
+
+
+def _storages(value):
+    """ The storages of the tensors in value """
+    return {_storage(item) for item in _values([value]) if isinstance(item, torch.Tensor)}
+
+
+def _storage(tensor):
+    return tensor.untyped_storage().data_ptr()
+
+
+def _nbytes(tensor):
+    return tensor.numel() * tensor.element_size()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Array backends, the array library the operators and formulas of a parser compute
+their columns with:
+
+    parser = Parser(backend='torch')
+
+Torch is the only backend. The operator and formula layers go through the
+backend of the active evaluation context, but the functions of the formula
+library are written for torch and a backend without torch needs them ported
+onto this interface first, so a numpy backend isn't offered.
+"""
+import contextlib
+import torch
+from .context import current_context
+
+
+class TorchBackend(object):
+    name = 'torch'
+
+    def is_array(self, value):
+        """ Whether value is an array of numbers of the backend, text columns are numpy arrays with every backend """
+        return isinstance(value, torch.Tensor)
+
+    def columns(self, args):
+        """ The args of a formula as the backend computes with them, numpy arrays stay as they are for the function library """
+        return args
+
+    def result(self, value):
+        """ The result of a formula as the backend returns it """
+        return value
+
+    def to_tensor(self, value):
+        """ A value as the function library takes it """
+        return value
+
+    def from_tensor(self, value):
+        """ A value the function library computed as the backend computes with it """
+        return value
+
+    def is_floating(self, array):
+        return array.is_floating_point()
+
+    def is_numeric(self, array):
+        return array.dtype != torch.bool and not array.is_complex()
+
+    def astype(self, array, dtype):
+        """ array in dtype, a torch dtype like the ones of context.PRECISIONS """
+        return array.to(dtype)
+
+    def broadcast(self, number, like, dtype=None):
+        """ number repeated in the shape of the array like """
+        if dtype is not None:
+            return torch.full_like(like, number, dtype=dtype)
+        return torch.ones_like(like) * number
+
+    def power(self, base, exponent, dtype):
+        """ base ** exponent, tensors of the function library, computed in dtype """
+        return torch.pow(base.to(dtype), exponent.to(dtype))
+
+    def logical_not(self, value):
+        """ not value, for columns and single values alike """
+        if not isinstance(value, torch.Tensor):
+            return not value
+        return torch.logical_not(value)
+
+    def logical_or(self, a, b):
+        if not (isinstance(a, torch.Tensor) or isinstance(b, torch.Tensor)):
+            return bool(a or b)
+        return torch.logical_or(torch.as_tensor(a), torch.as_tensor(b))
+
+    def errstate(self):
+        """ The context computations run in, torch doesn't warn about dividing by zero """
+        return contextlib.nullcontext()
+
+
+BACKENDS = {
+    'torch': TorchBackend(),
+}
+
+
+def check_backend(backend):
+    if backend is not None and backend not in BACKENDS:
+        raise ValueError('unknown backend %r, expected one of %s' % (backend, ', '.join(sorted(BACKENDS))))
+    return backend
+
+
+def current_backend():
+    """ The backend of the innermost active evaluation context, torch when there is none """
+    context = current_context()
+    return BACKENDS[context.backend if context is not None and context.backend is not None else 'torch']
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of column data to the columns formulas evaluate. numpy arrays, pandas
+Series and DataFrames and Arrow arrays, chunked arrays, tables and record batches
+are wrapped without copying their buffers where the engine can use them as they
+are:
+
+    formula.evaluate(dataframe)
+
+Missing values follow the engine's representation, numeric rows that are missing
+are NaN like rows in error and missing text is blank. pandas and pyarrow are
+optional, data of either one is only recognized when it is installed.
+"""
+import warnings
+import numpy as np
+import torch
+from .dictionary import DictionaryArray
+from .formulas import utils
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def _from_numpy(array):
+    """ A numpy array as a column, numeric arrays share their memory with the tensor """
+    if array.dtype.kind in 'biuf':
+        if array.dtype.kind == 'u' and array.dtype.itemsize > 1:
+            # torch barely computes with the wider unsigned dtypes
+            array = array.astype(np.int64)
+        if any(stride < 0 for stride in array.strides):
+            array = np.ascontiguousarray(array)
+        with warnings.catch_warnings():
+            # read only arrays, formulas never write to their inputs
+            warnings.simplefilter('ignore', UserWarning)
+            return torch.from_numpy(array)
+    if array.dtype.kind == 'M':
+        return torch.from_numpy(utils.datetime64_to_serial(array))
+    if array.dtype.kind == 'O':
+        return _from_objects(array)
+    return array
+
+
+def _from_objects(array):
+    """ Object arrays of text become text arrays, missing values in them are blank """
+    missing = np.frompyfunc(lambda value: value is None or (isinstance(value, float) and value != value), 1, 1)(array)
+    missing = missing.astype(bool)
+    if missing.any():
+        array = array.copy()
+        array[missing] = None
+        return array
+    if all(isinstance(value, str) for value in array.flat):
+        return array.astype('U')
+    return array
+
+
+def _with_blank(codes, dictionary):
+    """ A dictionary encoded column where the missing rows, coded -1, are blank """
+    codes = np.asarray(codes, dtype=np.int64)
+    dictionary = np.asarray(dictionary)
+    missing = codes < 0
+    if missing.any():
+        dictionary = np.append(dictionary.astype('U'), '')
+        codes = np.where(missing, len(dictionary) - 1, codes)
+    return DictionaryArray(codes, dictionary)
+
+
+def _is_pandas(value):
+    return pandas is not None and isinstance(value, (pandas.Series, pandas.Index))
+
+
+def _from_pandas(series):
+    if isinstance(series.dtype, pandas.CategoricalDtype):
+        return _with_blank(series.cat.codes.to_numpy(), series.cat.categories.to_numpy())
+    if not isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biuf':
+        # nullable extension arrays, their missing rows are NaN
+        if not series.isna().any():
+            return _from_numpy(series.to_numpy(dtype=series.dtype.numpy_dtype))
+        return torch.from_numpy(series.to_numpy(dtype=np.float64, na_value=np.nan))
+    if series.dtype.kind in 'biufM':
+        return _from_numpy(series.to_numpy())
+    return _from_numpy(series.to_numpy(dtype=object))
+
+
+def _is_arrow(value):
+    return pyarrow is not None and isinstance(value, (pyarrow.Array, pyarrow.ChunkedArray))
+
+
+def _from_arrow(array):
+    if isinstance(array, pyarrow.ChunkedArray):
+        if array.num_chunks == 1:
+            return _from_arrow(array.chunk(0))
+        array = array.combine_chunks()
+    if pyarrow.types.is_dictionary(array.type):
+        codes = array.indices.to_numpy(zero_copy_only=False)
+        if array.null_count:
+            codes = np.where(array.is_null().to_numpy(zero_copy_only=False), -1, codes)
+        return _with_blank(codes, array.dictionary.to_numpy(zero_copy_only=False))
+    is_number = pyarrow.types.is_integer(array.type) or pyarrow.types.is_floating(array.type)
+    if is_number and not array.null_count:
+        if hasattr(array, '__dlpack__'):
+            try:
+                return torch.from_dlpack(array)
+            except (BufferError, RuntimeError, TypeError):
+                pass
+        return _from_numpy(array.to_numpy(zero_copy_only=True))
+    if is_number:
+        # the null bitmap becomes NaN, which needs a copy of the values
+        return torch.from_numpy(array.to_numpy(zero_copy_only=False).astype(np.float64))
+    return _from_numpy(array.to_numpy(zero_copy_only=False))
+
+
+def to_column(value):
+    """ value as a column formulas evaluate, anything that isn't column data is returned as it is """
+    if isinstance(value, np.ndarray):
+        return _from_numpy(value)
+    if _is_pandas(value):
+        return _from_pandas(value)
+    if _is_arrow(value):
+        return _from_arrow(value)
+    return value
+
+
+def to_args(data):
+    """
+    The args of a formula for data, a mapping of names to columns, a pandas
+    DataFrame or an Arrow table or record batch.
+    """
+    if pandas is not None and isinstance(data, pandas.DataFrame):
+        items = data.items()
+    elif pyarrow is not None and isinstance(data, (pyarrow.Table, pyarrow.RecordBatch)):
+        items = zip(data.column_names, data.columns)
+    else:
+        items = data.items()
+    return {str(name): to_column(value) for name, value in items}
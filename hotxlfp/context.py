@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluation contexts hold the state formula functions share while compiled
+formulas run. Every formula evaluated inside the same context shares its caches:
+
+    with EvaluationContext():
+        total = sum_formula(args)
+        average = average_formula(args)
+
+The context also carries the precision policy of the evaluation, the name of
+one of PRECISIONS or None to keep the dtypes the inputs come in with.
+"""
+import threading
+import torch
+
+_local = threading.local()
+
+# the floating point dtype of each precision policy, int64 computes in float64
+# but keeps integer columns as integers where excel gives whole numbers
+PRECISIONS = {
+    'float64': torch.double,
+    'float32': torch.float32,
+    'int64': torch.double,
+}
+
+
+def check_precision(precision):
+    if precision is not None and precision not in PRECISIONS:
+        raise ValueError('unknown precision %r, expected one of %s' % (precision, ', '.join(sorted(PRECISIONS))))
+    return precision
+
+
+class EvaluationContext(object):
+
+    def __init__(self, precision=None):
+        self.cache = {}
+        self.precision = check_precision(precision)
+        # the RowSampler RAND and RANDBETWEEN draw from while a formula runs
+        self.sampler = None
+        # the ChunkReducer the functions that reduce rows aggregate into while a formula streams
+        self.reducer = None
+        # the BufferArena arithmetic writes its results into, see arena.py
+        self.arena = None
+        # the name of the backend of backends.BACKENDS operators compute with, None is torch
+        self.backend = None
+        # the values of the subexpressions a FormulaSet evaluates by key, see grammarparser.parser.FormulaParser.node
+        self.shared = None
+        # the excel error codes of the rows of numeric columns in error by id of the column, see formulas.utils.mask_errors
+        self.row_errors = {}
+        self._parent = None
+
+    def cached(self, key, anchors, compute):
+        """
+        Returns the value cached under key, calling compute when it is missing.
+        anchors are the objects the value is derived from, the cached value is
+        only reused while they are still the very same objects, and the same
+        tensors haven't been written over since, like arena buffers are.
+        """
+        entry = self.cache.get(key)
+        if entry is not None and all(a is b for a, b in zip(entry[0], anchors)) and entry[1] == _versions(anchors):
+            return entry[2]
+        return self.remember(key, anchors, compute())
+
+    def remember(self, key, anchors, value):
+        """ Caches value under key for cached, derived from anchors """
+        self.cache[key] = (anchors, _versions(anchors), value)
+        return value
+
+    def __enter__(self):
+        self._parent = current_context()
+        _local.context = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.context = self._parent
+        self._parent = None
+
+
+def _versions(anchors):
+    return tuple(a._version if isinstance(a, torch.Tensor) else None for a in anchors)
+
+
+def current_context():
+    """ The innermost active evaluation context or None """
+    return getattr(_local, 'context', None)
+
+
+def current_precision():
+    """ The precision policy of the innermost active evaluation context """
+    context = current_context()
+    return None if context is None else context.precision
+
+
+def float_dtype():
+    """ The dtype floating point results are computed in """
+    return PRECISIONS.get(current_precision(), torch.double)
+
+
+def number_dtype(*values):
+    """
+    The dtype of a result computed from values, int64 when the precision policy
+    keeps integers and values are all integers, otherwise float_dtype().
+    """
+    if current_precision() == 'int64' and all(_is_integral(value) for value in values):
+        return torch.int64
+    return float_dtype()
+
+
+def _is_integral(value):
+    if isinstance(value, torch.Tensor):
+        return not value.is_floating_point() and not value.is_complex()
+    return isinstance(value, int)
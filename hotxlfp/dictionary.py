@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Dictionary encoded text columns. A column with few distinct values is stored as
+the sorted distinct values and an integer code per row:
+
+    regions = DictionaryArray.encode(np.array(['north', 'south', 'north']))
+
+Text functions, criteria and & run once per distinct value and keep the result
+encoded, anything else materializes the column with np.asarray.
+"""
+import operator
+import numpy as np
+import torch
+
+
+class DictionaryArray(object):
+
+    def __init__(self, codes, dictionary):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.dictionary = np.asarray(dictionary)
+
+    @classmethod
+    def encode(cls, values):
+        """ Encodes an array of values by its distinct values """
+        values = np.asarray(values)
+        dictionary, codes = np.unique(values, return_inverse=True)
+        return cls(codes.reshape(values.shape), dictionary)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return self.codes.ndim
+
+    @property
+    def dtype(self):
+        return self.dictionary.dtype
+
+    def __len__(self):
+        return len(self.codes)
+
+    def reshape(self, *shape):
+        return DictionaryArray(self.codes.reshape(*shape), self.dictionary)
+
+    def take(self, values):
+        """ Gathers values computed for each dictionary entry back to one per row """
+        if isinstance(values, torch.Tensor):
+            return values[torch.from_numpy(self.codes)]
+        if isinstance(values, np.ndarray) and values.shape[:1] == self.dictionary.shape:
+            if values.dtype.kind in 'US':
+                return DictionaryArray(self.codes, values)
+            return values[self.codes]
+        # results that are not per entry, like a single excel error
+        return values
+
+    def map(self, fn):
+        """ Applies fn to the dictionary and gathers the result back by code """
+        return self.take(fn(self.dictionary))
+
+    def decode(self):
+        return self.dictionary[self.codes]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.decode()
+        return values if dtype is None else values.astype(dtype)
+
+    def tolist(self):
+        return self.decode().tolist()
+
+    def _compare(self, other, op):
+        if isinstance(other, DictionaryArray):
+            return op(self.decode(), other.decode())
+        if isinstance(other, (np.ndarray, torch.Tensor)) and other.ndim > 0:
+            return op(self.decode(), other)
+        return self.map(lambda dictionary: op(dictionary, other))
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return 'DictionaryArray(%d rows, %d distinct)' % (self.codes.size, len(self.dictionary))
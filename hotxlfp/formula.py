@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+import random
+import numpy as np
+import torch
+from .backends import BACKENDS, check_backend, current_backend
+from .columns import to_args
+from .context import EvaluationContext, check_precision, current_context, current_precision, float_dtype
+from .dictionary import DictionaryArray
+from .formulas import error
+from .formulas import reduces_rows
+from .sampling import BLOCK_SIZE, RowSampler
+from .streaming import ChunkReducer
+
+# batches smaller than this are never deduplicated automatically
+DEDUPLICATE_MIN_ROWS = 16384
+# rows sampled to estimate how many distinct rows a batch has
+DEDUPLICATE_SAMPLE_SIZE = 2048
+# a batch is deduplicated automatically when its sample has at most this share of distinct rows
+DEDUPLICATE_MAX_DISTINCT = 0.25
+# results of scenarios and rows a simulation evaluates at once
+SIMULATION_MAX_CELLS = 1 << 22
+
+
+def _is_column(value):
+    return isinstance(value, (torch.Tensor, np.ndarray, DictionaryArray)) and value.ndim > 0
+
+
+def _take(values, index):
+    """ The rows of a column at index """
+    if isinstance(values, torch.Tensor):
+        return values[index]
+    if isinstance(values, DictionaryArray):
+        return DictionaryArray(values.codes[index.numpy()], values.dictionary)
+    return values[index.numpy()]
+
+
+def _row_codes(values):
+    """ Integer codes that are equal for the equal rows of a column, None when they can't be compared """
+    if isinstance(values, DictionaryArray):
+        return torch.from_numpy(values.codes)
+    if isinstance(values, torch.Tensor):
+        return torch.unique(values, return_inverse=True)[1]
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biufUS':
+        return torch.from_numpy(np.unique(values, return_inverse=True)[1].reshape(values.shape))
+    return None
+
+
+def _row_keys(columns):
+    """ Compact integer keys for the rows of columns, equal rows get the same key """
+    keys = None
+    for column in columns:
+        codes = _row_codes(column)
+        if codes is None:
+            return None
+        if keys is not None:
+            codes = keys * (int(codes.max()) + 1) + codes
+        # compacting after every column keeps the keys below the number of rows
+        keys = torch.unique(codes, return_inverse=True)[1]
+    return keys
+
+
+def _batch_rows(args):
+    """ The number of rows of the first column of args, like literals are broadcast to, None when there is none """
+    for value in args.values():
+        if _is_column(value):
+            return len(value)
+    return None
+
+
+def _simulation_rows(args, scenarios):
+    """ The number of rows of the inputs of a simulation, inputs with a leading scenario dimension are rows by scenario """
+    rows = set()
+    for value in args.values():
+        if _is_column(value) and value.ndim == 2:
+            if len(value) != scenarios:
+                raise ValueError('expected a leading dimension of %d scenarios, got %d' % (scenarios, len(value)))
+            rows.add(value.shape[1])
+        elif _is_column(value):
+            rows.add(len(value))
+    if len(rows) > 1:
+        raise ValueError('the inputs of a simulation must have the same number of rows')
+    return rows.pop() if rows else 1
+
+
+def _scenario_rows(value, scenarios, start, stop, index):
+    """ The rows from start to stop of an input for every scenario, flattened scenario by scenario """
+    if not _is_column(value):
+        return value
+    if value.ndim == 2:
+        return value[:, start:stop].reshape(-1)
+    return _take(value, index)
+
+
+def _numbers(result):
+    """ A simulated result as doubles, a result that is entirely in error is NaN """
+    if isinstance(result, error.XLError):
+        return torch.tensor(float('nan'), dtype=torch.double)
+    return torch.as_tensor(result, dtype=torch.double)
+
+
+def _with_precision(args):
+    """
+    args as columns of the backend of the evaluation, with their numeric arrays
+    converted to the dtypes of its precision policy
+    """
+    backend = current_backend()
+    args = backend.columns(args)
+    precision = current_precision()
+    if precision is None:
+        return args
+    dtype = float_dtype()
+    converted = {}
+    for name, value in args.items():
+        if backend.is_array(value) and backend.is_numeric(value):
+            if backend.is_floating(value) or precision != 'int64':
+                value = backend.astype(value, dtype)
+            else:
+                value = backend.astype(value, torch.int64)
+        converted[name] = value
+    return converted
+
+
+def _single_value(result):
+    """
+    The single value of the result of a formula that reduces rows, literals
+    broadcast to the rows of a chunk make it a column of that value.
+    """
+    if not _is_column(result):
+        return result
+    if len(result) and bool((result == result[0]).all()):
+        return result[0]
+    raise ValueError('a formula that reduces rows can only be streamed when its result is a single value')
+
+
+def _scatter(result, first, keys):
+    """ The result of the distinct rows first of a deduplicated batch on every row, for each result of a FormulaSet """
+    if isinstance(result, dict):
+        return {name: _scatter(value, first, keys) for name, value in result.items()}
+    if _is_column(result) and len(result) == len(first):
+        return _take(result, keys)
+    return result
+
+
+def _is_redundant(columns, rows):
+    """ Estimates from a sample of the rows whether columns repeat enough to deduplicate them """
+    if rows < DEDUPLICATE_MIN_ROWS:
+        return False
+    sample = torch.linspace(0, rows - 1, DEDUPLICATE_SAMPLE_SIZE).long()
+    keys = _row_keys([_take(column, sample) for column in columns])
+    return keys is not None and int(keys.max()) + 1 <= DEDUPLICATE_MAX_DISTINCT * DEDUPLICATE_SAMPLE_SIZE
+
+
+class Formula(object):
+    """
+    A compiled formula, call it with a dict of variable values to evaluate it.
+    Each call runs inside its own evaluation context unless one is already active.
+
+    variables and functions are the names the expression refers to, and row_wise
+    tells whether every row of the result only depends on the same row of the
+    variables, which is what lets a call deduplicate its rows.
+
+    precision is the precision policy the formula is evaluated with, one of
+    context.PRECISIONS, unless a call or the active context picks one. None keeps
+    the dtypes of the inputs.
+
+    backend is the name of the array backend of backends.BACKENDS the formula
+    computes with and returns the columns of, None is torch.
+    """
+
+    def __init__(self, expression, fn, variables=(), functions=(), row_wise=False, precision=None, backend=None):
+        self.expression = expression
+        self.fn = fn
+        self.variables = frozenset(variables)
+        self.functions = frozenset(functions)
+        self.row_wise = row_wise
+        self.precision = check_precision(precision)
+        self.backend = check_backend(backend)
+
+    def __call__(self, args, deduplicate=None, seed=None, row_offset=0, precision=None):
+        """
+        deduplicate evaluates each distinct combination of the variable columns
+        only once and scatters the results back to every row. None lets a sample
+        of the rows decide, it only applies to row wise formulas.
+
+        seed makes the random functions reproducible, row_offset is the position
+        of the first row of args in the whole dataset when it is evaluated in
+        chunks so that every row draws the same numbers as it would at once.
+
+        precision overrides the precision policy for this call.
+        """
+        sampler = RowSampler(seed, _batch_rows(args), row_offset)
+        return self._run(lambda: self._evaluate(_with_precision(args), deduplicate), sampler, precision)
+
+    def evaluate(self, data, **kwargs):
+        """
+        Calls the formula with the columns of data, a mapping of names to numpy
+        arrays, pandas Series or Arrow arrays, a pandas DataFrame or an Arrow
+        table. Their buffers are wrapped without copies where possible, see
+        columns.to_args, and kwargs are those of a call.
+        """
+        return self(to_args(data), **kwargs)
+
+    def stream(self, chunks, reuse=False, ranges=None, **kwargs):
+        """
+        Evaluates the formula over an iterable of chunks of consecutive rows, each
+        one args or data evaluate takes, and yields the result of each chunk.
+        Rows are numbered across chunks so the random functions draw what they
+        would over every row at once. ranges are args every chunk takes whole,
+        like the table VLOOKUP searches for the keys of each chunk.
+
+        Formulas that reduce rows, like SUMIF or COUNTIFS, fold each chunk into
+        incremental reducers instead and only yield their result over every row,
+        once the last chunk has been seen. Those can't also hold a value per row.
+
+        reuse copies the tensor results into a buffer that every chunk reuses,
+        each one only holds until the next chunk is evaluated.
+        """
+        row_offset = kwargs.pop('row_offset', 0)
+        reducing = any(reduces_rows(name) for name in self.functions)
+        context = current_context()
+        if context is None:
+            context = EvaluationContext(kwargs.get('precision'))
+            with context:
+                for result in self._stream(context, chunks, reducing, reuse, ranges, row_offset, kwargs):
+                    yield result
+            return
+        for result in self._stream(context, chunks, reducing, reuse, ranges, row_offset, kwargs):
+            yield result
+
+    def _stream(self, context, chunks, reducing, reuse, ranges, row_offset, kwargs):
+        ranges = to_args(ranges) if ranges is not None else {}
+        previous = context.reducer
+        context.reducer = ChunkReducer() if reducing else None
+        buffer = None
+        result = None
+        try:
+            for chunk in chunks:
+                args = to_args(chunk)
+                rows = _batch_rows(args)
+                # after the columns of the chunk, which the rows are counted in
+                args.update(ranges)
+                if context.reducer is not None:
+                    context.reducer.start_chunk()
+                result = self(args, row_offset=row_offset, **kwargs)
+                row_offset += rows or 0
+                if reducing:
+                    result = _single_value(result)
+                    continue
+                if reuse and isinstance(result, torch.Tensor) and result.ndim > 0:
+                    if buffer is None or buffer.dtype != result.dtype or len(buffer) < len(result):
+                        buffer = torch.empty(result.shape, dtype=result.dtype)
+                    result = buffer[:len(result)].copy_(result)
+                yield result
+        finally:
+            context.reducer = previous
+        if reducing and result is not None:
+            yield result
+
+    def simulate(self, args, scenarios, quantiles=(), seed=None, max_cells=SIMULATION_MAX_CELLS, precision=None):
+        """
+        Evaluates the formula over a number of simulated scenarios of every row
+        and reduces the results over the scenarios. Inputs with a leading
+        dimension of scenarios hold a value per scenario and row, the others are
+        the same in every scenario, and the random functions draw per scenario
+        and row. Rows are evaluated in chunks of all their scenarios, of about
+        max_cells values, so the results of every scenario and row never have to
+        be held at once.
+
+        Returns a dict with the 'mean' of every row and, when quantiles are
+        given, its 'quantiles' with a row per quantile.
+        """
+        if seed is None:
+            seed = random.getrandbits(63)
+        rows = _simulation_rows(args, scenarios)
+        chunk_rows = max(BLOCK_SIZE, max_cells // max(scenarios, 1) // BLOCK_SIZE * BLOCK_SIZE)
+        quantiles = torch.as_tensor(quantiles, dtype=torch.double)
+        means, chunk_quantiles = [], []
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            index = torch.arange(start, stop).repeat(scenarios)
+            chunk_args = {name: _scenario_rows(value, scenarios, start, stop, index) for name, value in args.items()}
+            sampler = RowSampler(seed, stop - start, start, scenarios)
+            results = _numbers(self._run(lambda: self._evaluate(_with_precision(chunk_args), None), sampler, precision))
+            results = results.expand(scenarios * (stop - start)).reshape(scenarios, stop - start)
+            means.append(results.mean(0))
+            if quantiles.numel():
+                chunk_quantiles.append(torch.quantile(results, quantiles, dim=0))
+        backend = BACKENDS[self.backend or 'torch']
+        simulation = {'mean': backend.result(torch.cat(means))}
+        if quantiles.numel():
+            simulation['quantiles'] = backend.result(torch.cat(chunk_quantiles, -1))
+        return simulation
+
+    def _run(self, evaluate, sampler, precision=None):
+        """
+        Calls evaluate inside an evaluation context where the random functions
+        draw from sampler, with the precision policy of the call, of the formula
+        or else of the context.
+        """
+        context = current_context()
+        if context is None:
+            with EvaluationContext():
+                return self._run(evaluate, sampler, precision)
+        previous = context.sampler, context.precision, context.backend
+        context.sampler = sampler
+        context.precision = check_precision(precision or self.precision or context.precision)
+        context.backend = self.backend
+        backend = current_backend()
+        try:
+            with backend.errstate():
+                result = evaluate()
+            if context.arena is not None:
+                result = context.arena.finish(result)
+            return backend.result(result)
+        finally:
+            context.sampler, context.precision, context.backend = previous
+
+    def _columns(self, args):
+        """ The names of the variable columns of args, None when they aren't one dimensional columns of the same length """
+        if not all(name in args for name in self.variables):
+            return None
+        names = [name for name in self.variables if _is_column(args[name])]
+        if not names or not len(args[names[0]]) or any(args[name].ndim != 1 or len(args[name]) != len(args[names[0]]) for name in names):
+            return None
+        return names
+
+    def _evaluate(self, args, deduplicate):
+        names = self._columns(args) if self.row_wise and deduplicate is not False else None
+        if names is None:
+            return self.fn(args)
+        columns = [args[name] for name in names]
+        if deduplicate is None and not _is_redundant(columns, len(columns[0])):
+            return self.fn(args)
+        keys = _row_keys(columns)
+        if keys is None:
+            return self.fn(args)
+        rows = torch.arange(len(keys))
+        first = torch.full((int(keys.max()) + 1,), len(keys), dtype=torch.long)
+        first = first.scatter_reduce(0, keys, rows, reduce='amin')
+        # every column of the batch is gathered, literals are sized after the first one of args
+        distinct_args = {
+            name: _take(value, first) if _is_column(value) and value.shape == (len(keys),) else value
+            for name, value in args.items()
+        }
+        return _scatter(self.fn(distinct_args), first, keys)
+
+    def __repr__(self):
+        return 'Formula(%r)' % self.expression
+
+
+class FormulaSet(Formula):
+    """
+    Named formulas evaluated together, call it with the args every formula shares
+    to get a dict of the result of each one. The formulas have to be parsed by
+    Parser.parse_set so the values of the subexpressions and variables they have
+    in common are only computed once per call, subexpressions that call volatile
+    functions like RAND excepted.
+    """
+
+    def __init__(self, formulas, precision=None, backend=None):
+        self.formulas = dict(formulas)
+        compiled = [formula for formula in self.formulas.values() if isinstance(formula, Formula)]
+        super(FormulaSet, self).__init__(
+            {name: getattr(formula, 'expression', formula) for name, formula in self.formulas.items()},
+            self._evaluate_all,
+            set().union(*[formula.variables for formula in compiled]),
+            set().union(*[formula.functions for formula in compiled]),
+            all(formula.row_wise for formula in compiled),
+            precision,
+            backend,
+        )
+
+    def _evaluate_all(self, args):
+        context = current_context()
+        previous = context.shared
+        context.shared = {}
+        try:
+            return {
+                name: formula.fn(args) if isinstance(formula, Formula) else formula
+                for name, formula in self.formulas.items()
+            }
+        finally:
+            context.shared = previous
+
+    def __repr__(self):
+        return 'FormulaSet(%r)' % self.expression
@@ -5,14 +5,56 @@ class Dispatcher(object):
 
     def __init__(self):
         self._registry_ = {}
-
-    def register_for(self, *fnames):
+        self._volatile_ = set()
+        self._reduces_rows_ = set()
+        self._takes_ranges_ = set()
+        self._scalar_ = {}
+
+    def register_for(self, *fnames, volatile=False, reduces_rows=False, takes_ranges=False):
+        """
+        volatile functions give a new result on every call, like RAND,
+        reduces_rows ones combine the rows of a column into a single result and
+        takes_ranges ones give a result per row that depends on whole ranges,
+        like the table VLOOKUP searches
+        """
         def wrap(dispatch_fn):
             for fname in fnames:
                 self._registry_[fname] = dispatch_fn
+                if volatile:
+                    self._volatile_.add(fname)
+                if reduces_rows:
+                    self._reduces_rows_.add(fname)
+                if takes_ranges:
+                    self._takes_ranges_.add(fname)
             return dispatch_fn
         return wrap
 
+    def register_scalar_for(self, *fnames):
+        """ Registers the version of functions that computes on python numbers, see scalar.py """
+        def wrap(scalar_fn):
+            for fname in fnames:
+                self._scalar_[fname] = scalar_fn
+            return scalar_fn
+        return wrap
+
+    def is_row_wise(self, fname):
+        """ Whether each row of the result of fname only depends on the same row of its arguments """
+        return (
+            fname in self._registry_
+            and fname not in self._volatile_
+            and fname not in self._reduces_rows_
+            and fname not in self._takes_ranges_
+        )
+
+    def reduces_rows(self, fname):
+        return fname in self._reduces_rows_
+
+    def is_volatile(self, fname):
+        return fname in self._volatile_
+
+    def get_scalar_for(self, fname):
+        return self._scalar_.get(fname)
+
     def get_for(self, fname):
         try:
             return self._registry_[fname]
@@ -30,6 +72,23 @@ def get_for(fname):
     return dispatcher.get_for(fname)
 
 
+def get_scalar_for(fname):
+    """ The version of fname for arguments that are all python numbers, None when it has none """
+    return dispatcher.get_scalar_for(fname)
+
+
+def is_row_wise(fname):
+    return dispatcher.is_row_wise(fname)
+
+
+def reduces_rows(fname):
+    return dispatcher.reduces_rows(fname)
+
+
+def is_volatile(fname):
+    return dispatcher.is_volatile(fname)
+
+
 def supported():
     """ Get a list of supported formulas """
     return sorted(dispatcher._registry_.keys())
@@ -49,4 +108,5 @@ def is_supported(fname):
 from . import engineering
 from . import financial
 from . import lookupandreference
+from . import scalar
 
@@ -7,6 +7,7 @@
 from . import error
 from . import utils
 import datetime
+import torch
 
 
 @dispatcher.register_for('DATE')
@@ -23,58 +24,50 @@ def DATE(year, month, day):
 
 @dispatcher.register_for('DATEVALUE')
 def DATEVALUE(date):
+    if utils.is_text_array(date):
+        return utils.parse_date_array(date)
     return utils.serialize_date(date)
 
 
-@dispatcher.register_for('YEAR')
-def YEAR(serial_number):
-    serial_number = utils.parse_date(serial_number)
+def _date_part(serial_number, split, part):
+    serial_number = utils.parse_serial(serial_number)
     if isinstance(serial_number, error.XLError):
         return serial_number
-    return serial_number.year
+    parts = split(serial_number)
+    return utils.mask_errors(parts[part].to(utils.float_dtype()), parts[-1], error.NUM)
+
+
+@dispatcher.register_for('YEAR')
+def YEAR(serial_number):
+    return _date_part(serial_number, utils.serial_to_civil, 0)
 
 
 @dispatcher.register_for('MONTH')
 def MONTH(serial_number):
-    serial_number = utils.parse_date(serial_number)
-    if isinstance(serial_number, error.XLError):
-        return serial_number
-    return serial_number.month
+    return _date_part(serial_number, utils.serial_to_civil, 1)
 
 
 @dispatcher.register_for('DAY')
 def DAY(serial_number):
-    serial_number = utils.parse_date(serial_number)
-    if isinstance(serial_number, error.XLError):
-        return serial_number
-    return serial_number.day
+    return _date_part(serial_number, utils.serial_to_civil, 2)
 
 
 @dispatcher.register_for('HOUR')
 def HOUR(serial_number):
-    serial_number = utils.parse_date(serial_number)
-    if isinstance(serial_number, error.XLError):
-        return serial_number
-    return serial_number.hour
+    return _date_part(serial_number, utils.serial_to_time, 0)
 
 
 @dispatcher.register_for('MINUTE')
 def MINUTE(serial_number):
-    serial_number = utils.parse_date(serial_number)
-    if isinstance(serial_number, error.XLError):
-        return serial_number
-    return serial_number.minute
+    return _date_part(serial_number, utils.serial_to_time, 1)
 
 
 @dispatcher.register_for('SECOND')
 def SECOND(serial_number):
-    serial_number = utils.parse_date(serial_number)
-    if isinstance(serial_number, error.XLError):
-        return serial_number
-    return serial_number.second
+    return _date_part(serial_number, utils.serial_to_time, 2)
 
 
-@dispatcher.register_for('TODAY')
+@dispatcher.register_for('TODAY', volatile=True)
 def TODAY():
     today = datetime.date.today()
     return datetime.datetime(today.year, today.month, today.day)
@@ -4,42 +4,190 @@
 from . import error
 from . import utils
 from .utils import DEFAULT
+from ..dictionary import DictionaryArray
+import numpy as np
+import torch
 
+# excel converts numbers of up to 10 digits, negative ones in two's complement
+WIDTH = 10
+DIGITS = '0123456789ABCDEF'
+_DIGIT_VALUES = np.full(128, -1, dtype=np.int64)
+for _value, _digit in enumerate(DIGITS):
+    _DIGIT_VALUES[ord(_digit)] = _DIGIT_VALUES[ord(_digit.lower())] = _value
+_DIGIT_CODES = np.array([ord(digit) for digit in DIGITS], dtype=np.uint32)
 
-@dispatcher.register_for('HEX2DEC')
-def HEX2DEC(hex):
-    try:
-        dec = int(hex, 16)
-        return (dec - 1099511627776) if (dec >= 549755813888) else dec
-    except ValueError:
-        return error.VALUE
 
+def _parse_digits(text, base):
+    """ The numbers a flat text array spells in base and the mask of the rows that aren't numbers in base """
+    too_long = np.char.str_len(text) > WIDTH
+    codes = np.ascontiguousarray(text.astype('U%d' % WIDTH)).view(np.uint32).reshape(len(text), WIDTH)
+    # shorter texts end in null characters
+    padding = codes == 0
+    digits = _DIGIT_VALUES[np.minimum(codes, len(_DIGIT_VALUES) - 1)]
+    invalid = too_long | (~padding & ((digits < 0) | (digits >= base))).any(-1)
+    numbers = np.zeros(len(text), dtype=np.int64)
+    for i in range(WIDTH):
+        numbers = np.where(padding[:, i], numbers, numbers * base + digits[:, i])
+    # only 10 digit numbers reach the upper half, those are negative
+    numbers = np.where(numbers >= base**WIDTH // 2, numbers - base**WIDTH, numbers)
+    return np.where(invalid, 0, numbers), invalid
 
-@dispatcher.register_for('DEC2HEX')
-def DEC2HEX(dec, places=DEFAULT):
-    dec = utils.parse_number(dec)
-    if isinstance(dec, error.XLError):
-        return dec
-    if places is not DEFAULT:
+
+def _format_digits(numbers, base, places):
+    """
+    Flat arrays of numbers written in base, padded with zeros to places, and the
+    mask of the rows that don't fit in places. Negative numbers are written as 10
+    digit two's complement whatever places is.
+    """
+    negative = numbers < 0
+    numbers = np.where(negative, numbers + base**WIDTH, numbers)
+    digits = np.empty((len(numbers), WIDTH), dtype=np.int64)
+    for i in range(WIDTH - 1, -1, -1):
+        numbers, digits[:, i] = np.divmod(numbers, base)
+    significant = np.where(digits.any(-1), WIDTH - (digits != 0).argmax(-1), 1)
+    too_small = ~negative & (places < significant)
+    width = np.where(negative, WIDTH, np.clip(places, significant, WIDTH))
+    # the last width digits of each row moved to its start, the rest is null padding
+    position = np.arange(WIDTH)
+    index = np.clip(WIDTH - width[:, None] + position, 0, WIDTH - 1)
+    codes = _DIGIT_CODES[np.take_along_axis(digits, index, -1)]
+    codes[position >= width[:, None]] = 0
+    return np.ascontiguousarray(codes).view('U%d' % WIDTH).reshape(len(codes)), too_small
+
+
+def _decimal_numbers(value):
+    """ The whole numbers of value, the rows that aren't numbers and the rows already in error """
+    errors = None
+    if utils.is_column(value):
+        if isinstance(value, np.ndarray) and value.dtype.kind == 'O':
+            value, errors = utils.text_column(value)
+        if utils.is_text_array(value):
+            value = utils.parse_text_array(value)
+        numbers = torch.as_tensor(value, dtype=torch.double).numpy()
+    else:
+        number = utils.parse_number(value)
+        numbers = np.asarray(np.nan if isinstance(number, (error.XLError, bool)) else float(number))
+    invalid = ~np.isfinite(numbers)
+    numbers = np.clip(np.where(invalid, 0, numbers), -2.0**62, 2.0**62)
+    return np.trunc(numbers).astype(np.int64), invalid, errors
+
+
+def _source_numbers(value, base):
+    """ The numbers value spells in base, the rows that don't spell one and the rows already in error """
+    if base == 10:
+        return _decimal_numbers(value)
+    if utils.is_column(value):
+        text, errors = utils.text_column(value)
+    else:
+        text, errors = np.asarray(utils.to_text(value)), None
+    numbers, invalid = _parse_digits(text.reshape(-1), base)
+    return numbers.reshape(text.shape), invalid.reshape(text.shape), errors
+
+
+def _convert(value, source, target, places=DEFAULT):
+    """
+    Converts value from base source to base target, row by row for columns. Rows
+    that aren't numbers in base source are #VALUE! and the ones that don't fit
+    in 10 digits of base target or in places are #NUM!.
+    """
+    if isinstance(value, error.XLError):
+        return value
+    if places is DEFAULT or places is None:
+        places = np.asarray(0)
+        check_places = False
+    else:
         places = utils.parse_number(places)
         if isinstance(places, error.XLError):
-            return places
-        if places < 0:
+            return error.VALUE
+        places = np.asarray(places, dtype=np.float64)
+        if places.ndim == 0 and not 0 <= places <= WIDTH:
             return error.NUM
-    if dec < 0:
-        places = DEFAULT
-        dec = dec + 1099511627776
-    try:
-        result = (hex(dec)[2:])
-        if result[-1] == 'L':
-            result = result[:-1]
-        if places is not DEFAULT:
-            if len(result) > places:
-                return error.NUM
-            result = result.rjust(places, '0')
-        return result.upper()
-    except ValueError:
-        return error.VALUE
+        check_places = True
+    if isinstance(value, DictionaryArray) and places.ndim == 0:
+        # once per distinct value
+        return value.map(lambda dictionary: _convert(dictionary, source, target, places if check_places else DEFAULT))
+    numbers, invalid, errors = _source_numbers(value, source)
+    if target == 10:
+        if numbers.ndim == 0:
+            return error.VALUE if invalid else int(numbers)
+        result = utils.mask_errors(torch.from_numpy(numbers.astype(np.float64)), torch.from_numpy(invalid), error.VALUE)
+        return utils.restore_errors(result, value, errors)
+    limit = target**WIDTH // 2
+    out_of_range = (numbers < -limit) | (numbers >= limit)
+    numbers, invalid, out_of_range, places = np.broadcast_arrays(numbers, invalid, out_of_range, places)
+    shape = numbers.shape
+    bad_places = np.isnan(places) | (places < 0) | (places > WIDTH)
+    text, too_small = _format_digits(
+        np.where(out_of_range, 0, numbers).reshape(-1), target, np.where(bad_places, 0, places).astype(np.int64).reshape(-1)
+    )
+    text = text.reshape(shape)
+    overflow = out_of_range | bad_places | (too_small.reshape(shape) & check_places)
+    if not shape:
+        if invalid:
+            return error.VALUE
+        return error.NUM if overflow else str(text)
+    result = utils.mask_errors(utils.mask_errors(text, invalid, error.VALUE), overflow & ~invalid, error.NUM)
+    return utils.restore_errors(result, value, errors)
+
+
+@dispatcher.register_for('BIN2OCT')
+def BIN2OCT(number, places=DEFAULT):
+    return _convert(number, 2, 8, places)
+
+
+@dispatcher.register_for('BIN2DEC')
+def BIN2DEC(number):
+    return _convert(number, 2, 10)
+
+
+@dispatcher.register_for('BIN2HEX')
+def BIN2HEX(number, places=DEFAULT):
+    return _convert(number, 2, 16, places)
+
+
+@dispatcher.register_for('OCT2BIN')
+def OCT2BIN(number, places=DEFAULT):
+    return _convert(number, 8, 2, places)
+
+
+@dispatcher.register_for('OCT2DEC')
+def OCT2DEC(number):
+    return _convert(number, 8, 10)
+
+
+@dispatcher.register_for('OCT2HEX')
+def OCT2HEX(number, places=DEFAULT):
+    return _convert(number, 8, 16, places)
+
+
+@dispatcher.register_for('DEC2BIN')
+def DEC2BIN(number, places=DEFAULT):
+    return _convert(number, 10, 2, places)
+
+
+@dispatcher.register_for('DEC2OCT')
+def DEC2OCT(number, places=DEFAULT):
+    return _convert(number, 10, 8, places)
+
+
+@dispatcher.register_for('DEC2HEX')
+def DEC2HEX(number, places=DEFAULT):
+    return _convert(number, 10, 16, places)
+
+
+@dispatcher.register_for('HEX2BIN')
+def HEX2BIN(number, places=DEFAULT):
+    return _convert(number, 16, 2, places)
+
+
+@dispatcher.register_for('HEX2OCT')
+def HEX2OCT(number, places=DEFAULT):
+    return _convert(number, 16, 8, places)
+
+
+@dispatcher.register_for('HEX2DEC')
+def HEX2DEC(number):
+    return _convert(number, 16, 10)
 
 
 @dispatcher.register_for('COMPLEX')
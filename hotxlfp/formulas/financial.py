@@ -3,24 +3,216 @@
 from . import dispatcher
 from . import error
 from . import utils
+from .._compat import string_types
+import functools
+import torch
+
+# iterations of Newton's method RATE and IRR run before bisection takes over
+NEWTON_ITERATIONS = 50
+BISECTION_ITERATIONS = 200
+# a rate has converged once Newton's step is smaller than this, relative to the rate
+RATE_TOLERANCE = 1e-12
+# the rates bisection looks for a solution between
+RATE_BOUNDS = (-1 + 1e-9, 1e3)
+
+
+def _in_double(fn):
+    """
+    Compounding over many periods needs doubles, so the financial functions
+    compute in them whatever the precision policy and only convert their results.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args):
+        result = fn(*args)
+        return result.to(utils.float_dtype()) if isinstance(result, torch.Tensor) else result
+    return wrapper
+
+
+def _tensors(*values):
+    """ The arguments as double tensors broadcast together, #VALUE! when any of them isn't a number """
+    values = [utils.parse_number(value) for value in values]
+    if utils.any_is_error(values):
+        return error.VALUE
+    return torch.broadcast_tensors(*[torch.as_tensor(value, dtype=torch.double) for value in values])
+
+
+def _annuity_factor(rate, periods):
+    """ ((1 + rate) ** periods - 1) / rate, which is periods when rate is 0 """
+    growth = torch.expm1(periods * torch.log1p(rate))
+    return torch.where(rate == 0, periods, growth / torch.where(rate == 0, 1, rate))
+
+
+def _solve(f, guess):
+    """
+    The rate where f is 0 for every row. Newton's method runs on all the rows at
+    once until each of them converges, bisection takes over the rows it didn't
+    converge on. Rows without a solution are NaN.
+    """
+    rate = guess.clone()
+    converged = torch.zeros(rate.shape, dtype=torch.bool)
+    for _ in range(NEWTON_ITERATIONS):
+        h = 1e-7 * torch.clamp(rate.abs(), min=1)
+        slope = (f(rate + h) - f(rate - h)) / (2 * h)
+        step = f(rate) / slope
+        rate = torch.where(converged, rate, rate - step)
+        converged = converged | (step.abs() <= RATE_TOLERANCE * torch.clamp(rate.abs(), min=1))
+        if bool(converged.all()):
+            break
+    failed = ~converged | ~torch.isfinite(rate) | (rate <= -1)
+    if not bool(failed.any()):
+        return rate
+    low = torch.full(rate.shape, RATE_BOUNDS[0], dtype=torch.double)
+    high = torch.full(rate.shape, RATE_BOUNDS[1], dtype=torch.double)
+    f_low = f(low)
+    bracketed = torch.sign(f_low) != torch.sign(f(high))
+    for _ in range(BISECTION_ITERATIONS):
+        middle = (low + high) / 2
+        f_middle = f(middle)
+        same_side = torch.sign(f_middle) == torch.sign(f_low)
+        low = torch.where(same_side, middle, low)
+        f_low = torch.where(same_side, f_middle, f_low)
+        high = torch.where(same_side, high, middle)
+    bisected = torch.where(bracketed, (low + high) / 2, float('nan'))
+    return torch.where(failed, bisected, rate)
+
+
+def _cash_flows(values):
+    """
+    The cash flows of the arguments with a column per period. Lists are ranges of
+    flows, where text and logical values are left out, and 2 dimensional tensors
+    have a row of flows per row of the batch.
+    """
+    flows = []
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            flows.extend(v for v in utils.iflatten(value) if v is not None and not isinstance(v, (bool,) + string_types))
+        elif isinstance(value, torch.Tensor) and value.ndim == 2:
+            flows.extend(value.unbind(-1))
+        else:
+            flows.append(value)
+    flows = [utils.parse_number(flow) for flow in flows]
+    if not flows or utils.any_is_error(flows):
+        return error.VALUE
+    return torch.stack(torch.broadcast_tensors(*[torch.as_tensor(flow, dtype=torch.double) for flow in flows]), -1)
 
 
 @dispatcher.register_for('PV')
+@_in_double
 def PV(rate, periods, payment, future=None, type=None):
     if future is None:
         future = 0
     if type is None:
         type = 0
+    values = _tensors(rate, periods, payment, future, type)
+    if isinstance(values, error.XLError):
+        return values
+    rate, periods, payment, future, type = values
+    # Return present value
+    rate_exp_periods = (1 + rate)**periods
+    present = (((1 - rate_exp_periods) / rate) * payment * (1 + rate * type) - future) / rate_exp_periods
+    return torch.where(rate == 0, -payment * periods - future, present)
+
+
+@dispatcher.register_for('FV')
+@_in_double
+def FV(rate, periods, payment, value=None, type=None):
+    if value is None:
+        value = 0
+    if type is None:
+        type = 0
+    values = _tensors(rate, periods, payment, value, type)
+    if isinstance(values, error.XLError):
+        return values
+    rate, periods, payment, value, type = values
+    return -(value * (1 + rate)**periods + payment * (1 + rate * type) * _annuity_factor(rate, periods))
+
+
+@dispatcher.register_for('PMT')
+@_in_double
+def PMT(rate, periods, present, future=None, type=None):
+    if future is None:
+        future = 0
+    if type is None:
+        type = 0
+    values = _tensors(rate, periods, present, future, type)
+    if isinstance(values, error.XLError):
+        return values
+    rate, periods, present, future, type = values
+    payment = -(present * (1 + rate)**periods + future) / ((1 + rate * type) * _annuity_factor(rate, periods))
+    return utils.mask_errors(payment, periods == 0, error.NUM)
+
+
+@dispatcher.register_for('NPER')
+@_in_double
+def NPER(rate, payment, present, future=None, type=None):
+    if future is None:
+        future = 0
+    if type is None:
+        type = 0
+    values = _tensors(rate, payment, present, future, type)
+    if isinstance(values, error.XLError):
+        return values
+    rate, payment, present, future, type = values
+    numerator = payment * (1 + rate * type) - future * rate
+    denominator = present * rate + payment * (1 + rate * type)
+    periods = torch.log(numerator / denominator) / torch.log1p(rate)
+    periods = torch.where(rate == 0, -(present + future) / payment, periods)
+    return utils.mask_errors(periods, ~torch.isfinite(periods), error.NUM)
+
+
+@dispatcher.register_for('RATE')
+@_in_double
+def RATE(periods, payment, present, future=None, type=None, guess=None):
+    if future is None:
+        future = 0
+    if type is None:
+        type = 0
+    if guess is None:
+        guess = 0.1
+    values = _tensors(periods, payment, present, future, type, guess)
+    if isinstance(values, error.XLError):
+        return values
+    periods, payment, present, future, type, guess = values
+
+    def balance(rate):
+        return present * (1 + rate)**periods + payment * (1 + rate * type) * _annuity_factor(rate, periods) + future
+
+    rate = _solve(balance, guess)
+    return utils.mask_errors(rate, torch.isnan(rate), error.NUM)
+
+
+@dispatcher.register_for('NPV')
+@_in_double
+def NPV(rate, *values):
     rate = utils.parse_number(rate)
-    periods = utils.parse_number(periods)
-    payment = utils.parse_number(payment)
-    future = utils.parse_number(future)
-    type = utils.parse_number(type)
-    if utils.any_is_error((rate, periods, payment, future, type)):
+    if isinstance(rate, error.XLError):
         return error.VALUE
-    # Return present value
-    if rate == 0:
-        return -payment * periods - future
-    else:
-        rate_exp_periods = (1 + rate)**periods
-        return (((1 - rate_exp_periods) / rate) * payment * (1 + rate * type) - future) / rate_exp_periods
+    flows = _cash_flows(values)
+    if isinstance(flows, error.XLError):
+        return flows
+    rate = torch.as_tensor(rate, dtype=torch.double).unsqueeze(-1)
+    periods = torch.arange(1, flows.shape[-1] + 1, dtype=torch.double)
+    npv = (flows / (1 + rate)**periods).sum(-1)
+    return utils.mask_errors(npv, rate.squeeze(-1) == -1, error.DIV_ZERO)
+
+
+@dispatcher.register_for('IRR')
+@_in_double
+def IRR(values, guess=None):
+    if guess is None:
+        guess = 0.1
+    guess = utils.parse_number(guess)
+    if isinstance(guess, error.XLError):
+        return error.VALUE
+    if isinstance(values, torch.Tensor) and values.ndim == 1:
+        # a single range of flows
+        values = [values.tolist()]
+    flows = _cash_flows([values])
+    if isinstance(flows, error.XLError):
+        return flows
+    periods = torch.arange(flows.shape[-1], dtype=torch.double)
+    # there is only a solution when flows go both ways
+    invalid = ~((flows > 0).any(-1) & (flows < 0).any(-1))
+    guess = torch.as_tensor(guess, dtype=torch.double).expand(invalid.shape)
+    rate = _solve(lambda rate: (flows / (1 + rate.unsqueeze(-1))**periods).sum(-1), guess)
+    return utils.mask_errors(rate, invalid | torch.isnan(rate), error.NUM)
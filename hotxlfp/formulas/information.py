@@ -9,74 +9,160 @@
 from . import utils
 from .._compat import number_types, string_types
 import datetime
+import numpy as np
+import torch
+
+
+def _is_nan(values):
+    """ The rows of a numeric column in error """
+    if values.is_floating_point():
+        return torch.isnan(values)
+    return torch.zeros(values.shape, dtype=torch.bool)
+
+
+NOT_AVAILABLE_CODE = utils.ERROR_CODES[error.NOT_AVAILABLE]
+
+
+def _from_objects(results):
+    """ A tensor of the per element results of an object array, elements that are an error are NaN """
+    codes = utils.object_error_codes(results)
+    if not codes.any():
+        return torch.from_numpy(results.astype(bool if all(isinstance(r, bool) for r in results.flat) else np.float64))
+    results[codes.numpy() != 0] = 0
+    return utils.mask_error_codes(torch.from_numpy(results.astype(np.float64)), codes)
+
+
+def _test_rows(value, scalar_fn, numeric_fn, text_fn):
+    """
+    Applies scalar_fn to a single value, numeric_fn to numeric columns and
+    text_fn to text columns. Object arrays hold a value of any kind in each row
+    so scalar_fn is applied to each of their elements.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        value = torch.from_numpy(value)
+    if not utils.is_column(value):
+        if isinstance(value, torch.Tensor):
+            value = value.item()
+        return scalar_fn(value)
+    if isinstance(value, torch.Tensor):
+        return numeric_fn(value)
+    if utils.is_text_array(value):
+        return text_fn(value)
+    return _from_objects(np.frompyfunc(scalar_fn, 1, 1)(np.asarray(value, dtype=object)))
+
+
+def _constant(result):
+    """ A numeric_fn or text_fn that gives result for every row """
+    return lambda values: torch.full(values.shape, result, dtype=torch.bool)
 
 
 @dispatcher.register_for('ERROR.TYPE')
 def ERROR_TYPE(error_val):
-    errdict = {
-        error.NULL: 1,
-        error.DIV_ZERO: 2,
-        error.VALUE: 3,
-        error.REF: 4,
-        error.NAME: 5,
-        error.NUM: 6,
-        error.NOT_AVAILABLE: 7,
-        error.DATA: 8
-    }
-    return errdict.get(error_val, error.NOT_AVAILABLE)
+    def error_rows(values):
+        codes = utils.row_error_codes(values)
+        return utils.mask_errors(codes.to(utils.float_dtype()), codes == 0, error.NOT_AVAILABLE)
+
+    return _test_rows(
+        error_val,
+        lambda value: utils.ERROR_CODES.get(value, error.NOT_AVAILABLE) if isinstance(value, error.XLError) else error.NOT_AVAILABLE,
+        error_rows,
+        lambda values: error.NOT_AVAILABLE,
+    )
 
 
 @dispatcher.register_for('ISBLANK')
 def ISBLANK(value):
-    return value is None
+    return _test_rows(value, lambda value: value is None, _constant(False), _constant(False))
+
+
+def _is_err(value):
+    return isinstance(value, error.XLError) and value != error.NOT_AVAILABLE
+
+
+def _err_rows(values):
+    codes = utils.row_error_codes(values)
+    return (codes != 0) & (codes != NOT_AVAILABLE_CODE)
 
 
 @dispatcher.register_for('ISERR')
 def ISERR(value):
-    return isinstance(value, error.XLError) and value != error.NOT_AVAILABLE
+    return _test_rows(value, _is_err, _err_rows, _constant(False))
 
 
 @dispatcher.register_for('ISERROR')
 def ISERROR(value):
-    return isinstance(value, error.XLError)
+    return _test_rows(value, lambda value: isinstance(value, error.XLError), _is_nan, _constant(False))
 
 
-@dispatcher.register_for('ISEVEN')
-def ISEVEN(number):
+def _is_odd(number):
+    number = utils.parse_number(number)
     if not isinstance(number, number_types):
         return error.VALUE
-    return (int(number) & 1) == 0
+    return bool(int(number) & 1)
+
+
+def _odd_rows(numbers):
+    codes = utils.row_error_codes(numbers)
+    odd = torch.remainder(torch.trunc(numbers.to(torch.double)), 2) == 1
+    if codes.any():
+        return utils.mask_error_codes(odd.to(utils.float_dtype()), codes)
+    return odd
+
+
+@dispatcher.register_for('ISEVEN')
+def ISEVEN(number):
+    odd = ISODD(number)
+    if isinstance(odd, error.XLError):
+        return odd
+    if isinstance(odd, torch.Tensor):
+        if odd.dtype == torch.bool:
+            return odd == 0
+        # the rows in error keep the codes ISODD gave them
+        return utils.mask_error_codes(1 - odd, utils.row_error_codes(odd))
+    return not odd
 
 
 @dispatcher.register_for('ISODD')
 def ISODD(number):
-    if not isinstance(number, number_types):
-        return error.VALUE
-    return (int(number) & 1)
+    return _test_rows(number, _is_odd, _odd_rows, lambda values: _odd_rows(utils.parse_text_array(values)))
 
 
 @dispatcher.register_for('ISTEXT')
 def ISTEXT(value):
-    return isinstance(value, string_types)
+    return _test_rows(value, lambda value: isinstance(value, string_types), _constant(False), _constant(True))
 
 
 @dispatcher.register_for('ISNUMBER')
 def ISNUMBER(value):
-    return (not isinstance(value, bool)) and isinstance(value, number_types)
+    return _test_rows(
+        value,
+        lambda value: (not isinstance(value, bool)) and isinstance(value, number_types),
+        lambda values: ~_is_nan(values) & (values.dtype != torch.bool),
+        _constant(False),
+    )
 
 
 @dispatcher.register_for('ISLOGICAL')
 def ISLOGICAL(value):
-    return isinstance(value, bool)
+    return _test_rows(
+        value,
+        lambda value: isinstance(value, bool),
+        lambda values: torch.full(values.shape, values.dtype == torch.bool),
+        _constant(False),
+    )
 
 
 @dispatcher.register_for('ISNA')
 def ISNA(value):
-    return value == error.NOT_AVAILABLE
+    return _test_rows(
+        value,
+        lambda value: value == error.NOT_AVAILABLE,
+        lambda values: utils.row_error_codes(values) == NOT_AVAILABLE_CODE,
+        _constant(False),
+    )
 
 
-@dispatcher.register_for('N')
-def N(value):
+def _n(value):
     if isinstance(value, (error.XLError, number_types)):
         return value
     if isinstance(value, datetime.datetime):
@@ -86,6 +172,16 @@ def N(value):
     return 0
 
 
+@dispatcher.register_for('N')
+def N(value):
+    return _test_rows(
+        value,
+        _n,
+        lambda values: values.to(utils.number_dtype(values)),
+        lambda values: torch.zeros(values.shape, dtype=utils.float_dtype()),
+    )
+
+
 @dispatcher.register_for('NA')
 def NA():
     return error.NOT_AVAILABLE
@@ -93,4 +189,4 @@ def NA():
 
 @dispatcher.register_for('ISNONTEXT')
 def ISNONTEXT(value):
-    return not isinstance(value, string_types)
+    return _test_rows(value, lambda value: not isinstance(value, string_types), _constant(True), _constant(False))
@@ -3,17 +3,87 @@
 inspired by:
 https://github.com/sutoiku/formula.js/blob/master/lib/logical.js
 """
+import operator
 from . import dispatcher
 from . import error
 from . import utils
+from .._compat import number_types, string_types
 import torch
 import numpy as np
 
 
+def _logical_values(args):
+    """
+    The values AND, OR and XOR combine. Lists are ranges, their elements are
+    combined too but the text and blanks in them are left out, while tensors and
+    arrays hold a value per row.
+    """
+    values = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            values.extend(v for v in utils.iflatten(arg) if v is not None and not isinstance(v, string_types))
+        elif arg is not None:
+            values.append(arg)
+    return values
+
+
+def _scalar_truth(value):
+    if isinstance(value, error.XLError):
+        return value
+    if isinstance(value, string_types):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        return error.VALUE
+    if isinstance(value, number_types):
+        return value != 0
+    return error.VALUE
+
+
+def _truth(value):
+    """ value as a bool or a boolean tensor along with the mask of its rows in error """
+    if not utils.is_column(value):
+        if isinstance(value, torch.Tensor):
+            value = value.item()
+        return _scalar_truth(value), None
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        value = torch.from_numpy(value)
+    if isinstance(value, torch.Tensor):
+        if value.dtype == torch.bool:
+            return value, None
+        errors = torch.isnan(value) if value.is_floating_point() else None
+        return value != 0, errors
+    value = np.asarray(value)
+    if value.dtype.kind in 'US':
+        upper = np.char.upper(value)
+        truth = upper == 'TRUE'
+        return torch.from_numpy(truth), torch.from_numpy(~truth & (upper != 'FALSE'))
+    truths = np.frompyfunc(_scalar_truth, 1, 1)(value)
+    errors = np.frompyfunc(lambda truth: isinstance(truth, error.XLError), 1, 1)(truths).astype(bool)
+    truths[errors] = False
+    return torch.from_numpy(truths.astype(bool)), torch.from_numpy(errors)
+
+
+def _combine(args, combine):
+    """ Combines the truth values of args row by row, rows with an error in any of them are in error """
+    result = None
+    errors = None
+    for value in _logical_values(args):
+        truth, value_errors = _truth(value)
+        if isinstance(truth, error.XLError):
+            return truth
+        result = truth if result is None else combine(result, truth)
+        if value_errors is not None:
+            errors = value_errors if errors is None else errors | value_errors
+    if result is None:
+        return error.VALUE
+    if errors is not None and errors.any():
+        return utils.mask_errors(result.to(utils.float_dtype()), errors, error.VALUE)
+    return result
+
+
 @dispatcher.register_for("AND")
 def AND(*args):
-    args = utils.iflatten(args)
-    return all(args)
+    return _combine(args, operator.and_)
 
 
 @dispatcher.register_for("IF")
@@ -35,39 +105,61 @@ def IF(test, then, otherwise):
         otherwise_str = np.array(otherwise, dtype="U")
         return np.where(np.array(test, dtype="b"), then_str, otherwise_str)
 
+    dtype = utils.number_dtype(then, otherwise)
     return torch.where(
-        torch.tensor(test, dtype=torch.bool),
-        torch.tensor(then, dtype=torch.double),
-        torch.tensor(otherwise, dtype=torch.double),
+        utils.as_tensor(test, torch.bool),
+        utils.as_tensor(then, dtype),
+        utils.as_tensor(otherwise, dtype),
     )
 
 
+def _replace_errors(value, value_if_error, is_caught):
+    """
+    value with value_if_error in place of the errors whose ERROR.TYPE codes
+    is_caught accepts, row by row for columns
+    """
+    if isinstance(value, error.XLError):
+        return value_if_error if is_caught(utils.error_code(value)) else value
+    if isinstance(value, torch.Tensor) and value.ndim > 0:
+        codes = utils.row_error_codes(value)
+    elif isinstance(value, np.ndarray) and value.dtype == object:
+        codes = utils.object_error_codes(value)
+    else:
+        return value
+    return utils.fill_rows(value, is_caught(codes), value_if_error)
+
+
 @dispatcher.register_for("IFERROR")
 def IFERROR(value, value_if_error):
-    return value if not isinstance(value, error.XLError) else value_if_error
+    return _replace_errors(value, value_if_error, lambda codes: codes != 0)
 
 
 @dispatcher.register_for("IFNA")
 def IFNA(value, value_if_na):
-    return value if value != error.NOT_AVAILABLE else value_if_na
+    return _replace_errors(value, value_if_na, lambda codes: codes == utils.ERROR_CODES[error.NOT_AVAILABLE])
 
 
 @dispatcher.register_for("NOT")
-def NOT(boolean):
-    return not boolean
+def NOT(logical):
+    truth, errors = _truth(logical)
+    if isinstance(truth, error.XLError):
+        return truth
+    if isinstance(truth, torch.Tensor):
+        truth = torch.logical_not(truth)
+        if errors is not None and errors.any():
+            return utils.mask_errors(truth.to(utils.float_dtype()), errors, error.VALUE)
+        return truth
+    return not truth
 
 
 @dispatcher.register_for("XOR")
 def XOR(*args):
-    args = utils.iflatten(args)
-    result = sum(bool(a) for a in args)
-    return bool(result & 1)
+    return _combine(args, operator.xor)
 
 
 @dispatcher.register_for("OR")
 def OR(*args):
-    args = utils.iflatten(args)
-    return any(args)
+    return _combine(args, operator.or_)
 
 
 @dispatcher.register_for("SWITCH")
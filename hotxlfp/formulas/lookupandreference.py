@@ -1,10 +1,40 @@
 # -*- coding: utf-8 -*-
-import fnmatch
+import weakref
 from . import dispatcher
 from . import error
 from . import utils
 from .utils import DEFAULT
-from .._compat import string_types
+from ..context import current_context
+from ..dictionary import DictionaryArray
+from .._compat import number_types, string_types
+import numpy as np
+import torch
+
+# lookup indexes of tensors and dictionary encoded columns, they are kept for
+# as long as the range is alive and, for tensors, hasn't been modified in place
+_lookup_indexes = {}
+
+
+def _choose_rows(index, choices, err=error.VALUE):
+    """ CHOOSE with an index per row, rows whose index is out of range are err """
+    index = torch.as_tensor(index).to(torch.double)
+    invalid = torch.isnan(index) | (index < 1) | (index >= len(choices) + 1)
+    picks = torch.where(invalid, 0, torch.trunc(index) - 1).long().unsqueeze(-1)
+    try:
+        if all(_is_number(c) or isinstance(c, error.XLError) or isinstance(c, torch.Tensor) for c in choices):
+            stacked = torch.stack([
+                torch.as_tensor(float('nan') if isinstance(c, error.XLError) else c, dtype=utils.float_dtype()).expand(index.shape)
+                for c in choices
+            ], -1)
+            return utils.mask_errors(torch.gather(stacked, -1, picks).squeeze(-1), invalid, err)
+        columns = [np.broadcast_to(np.asarray(c.numpy() if isinstance(c, torch.Tensor) else c, dtype=object), index.shape) for c in choices]
+    except (RuntimeError, ValueError):
+        # columns of a different size than the index
+        return error.VALUE
+    result = np.take_along_axis(np.stack(columns, -1), picks.numpy(), -1).squeeze(-1)
+    if all(isinstance(c, string_types) or utils.is_text_array(c) for c in choices):
+        result = result.astype('U')
+    return utils.mask_errors(result, invalid.numpy(), err)
 
 
 @dispatcher.register_for('CHOOSE')
@@ -12,7 +42,13 @@ def CHOOSE(*args):
     if (len(args) < 2):
         return error.NOT_AVAILABLE
 
-    index = args[0]
+    index = _collapse(args[0])
+    if utils.is_column(index):
+        return _choose_rows(index, args[1:])
+    index = utils.parse_number(index)
+    if isinstance(index, error.XLError):
+        return index
+    index = int(index)
     if (index < 1 or index > 254):
         return error.VALUE
 
@@ -22,49 +58,344 @@ def CHOOSE(*args):
     return args[index]
 
 
-@dispatcher.register_for('MATCH')
-def MATCH(lookup_value, lookup_array, match_type=1):
-    if not lookup_value and not lookup_array:
-        return error.NOT_AVAILABLE
+def _cached(table, key, build):
+    """
+    The value build gives for table under key. Ranges that are tensors or
+    dictionary encoded keep it across evaluations, anything else for as long as
+    the evaluation context is active.
+    """
+    if not isinstance(table, (torch.Tensor, DictionaryArray)):
+        context = current_context()
+        if context is None:
+            return build()
+        return context.cached(('lookup', id(table)) + key, (table,), build)
+    cache_key = (id(table),) + key
+    version = getattr(table, '_version', None)
+    entry = _lookup_indexes.get(cache_key)
+    if entry is not None and entry[0]() is table and entry[1] == version:
+        return entry[2]
+    value = build()
+    if entry is None:
+        weakref.finalize(table, _lookup_indexes.pop, cache_key, None)
+    _lookup_indexes[cache_key] = (weakref.ref(table), version, value)
+    return value
 
-    if not isinstance(lookup_array, list):
-        return error.NOT_AVAILABLE
 
+def _single_value(value):
+    """
+    value when it isn't a column, literals arrive broadcast to the size of the
+    batch so a column of equal values is taken as its value. #VALUE! otherwise.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        value = torch.from_numpy(value)
+    if isinstance(value, torch.Tensor):
+        if not value.numel():
+            return error.VALUE
+        first = value.reshape(-1)[0]
+        if not bool((value == first).all()):
+            return error.VALUE
+        return first.item()
+    return value
+
+
+def _collapse(value):
+    """ A column of equal values, like a broadcast literal, as that value """
+    if not isinstance(value, (torch.Tensor, np.ndarray)):
+        return value
+    single = _single_value(value)
+    return value if isinstance(single, error.XLError) else single
+
+
+def _is_number(value):
+    return isinstance(value, number_types) and not isinstance(value, (bool, torch.Tensor, np.ndarray))
+
+
+def _is_text(value):
+    return isinstance(value, string_types)
+
+
+def _range_column(values):
+    """
+    The elements of a range in order, as a double tensor when they are all
+    numbers, a text array when they are all text and an object array otherwise.
+    """
+    if isinstance(values, DictionaryArray):
+        return values.reshape(-1)
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        values = torch.from_numpy(values)
+    if isinstance(values, torch.Tensor):
+        return values.reshape(-1).to(utils.float_dtype())
+    if isinstance(values, np.ndarray):
+        return values.reshape(-1).astype('U' if values.dtype.kind in 'US' else object)
+    # array literals arrive with each element broadcast to the size of the batch
+    values = [_collapse(v) for v in utils.flatten(values)]
+    if values and all(_is_number(v) for v in values):
+        return torch.tensor(values, dtype=utils.float_dtype())
+    if values and all(_is_text(v) for v in values):
+        return np.array(values, dtype='U')
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _table_width(table, axis):
+    """ The number of columns (axis 1) or rows (axis 0) of a table """
+    if isinstance(table, (torch.Tensor, np.ndarray)) and table.ndim == 2:
+        return table.shape[axis]
+    if isinstance(table, (list, tuple)) and table and isinstance(table[0], (list, tuple)):
+        return len(table[0]) if axis == 1 else len(table)
+    return 1
+
+
+def _table_slice(table, axis, i):
+    """ Column (axis 1) or row (axis 0) i of a table as a range column """
+    def build():
+        if isinstance(table, (torch.Tensor, np.ndarray)) and table.ndim == 2:
+            return _range_column(table[:, i] if axis == 1 else table[i])
+        if isinstance(table, (list, tuple)) and table and isinstance(table[0], (list, tuple)):
+            return _range_column([row[i] for row in table] if axis == 1 else table[i])
+        # a single row or column
+        return _range_column(table)
+    return _cached(table, ('slice', axis, i), build)
+
+
+def _sorted(values, positions):
+    order = np.argsort(values, kind='stable')
+    return values[order], positions[order]
+
+
+class LookupIndex(object):
+    """
+    The numbers and the texts of a lookup range sorted along with their positions
+    in the range, so all the keys of a batch are found with one binary search.
+    """
+
+    def __init__(self, values):
+        values = _range_column(values)
+        if isinstance(values, DictionaryArray):
+            values = values.decode()
+        positions = np.arange(len(values))
+        if isinstance(values, torch.Tensor):
+            values = values.numpy()
+            is_number = ~np.isnan(values)
+            is_text = np.zeros(len(values), dtype=bool)
+        elif values.dtype.kind == 'U':
+            is_number = np.zeros(len(values), dtype=bool)
+            is_text = np.ones(len(values), dtype=bool)
+        else:
+            is_number = np.frompyfunc(_is_number, 1, 1)(values).astype(bool)
+            is_text = np.frompyfunc(_is_text, 1, 1)(values).astype(bool)
+        self.numbers, self.number_positions = _sorted(values[is_number].astype(np.float64), positions[is_number])
+        # excel compares text regardless of case
+        texts = np.char.lower(values[is_text].astype('U'))
+        self.texts, self.text_positions = _sorted(texts, positions[is_text])
+        # wildcard patterns are matched against each distinct text once
+        self.distinct_texts, self.text_inverse = np.unique(texts, return_inverse=True)
+        self.texts_in_order = positions[is_text]
+
+    @staticmethod
+    def _search(values, positions, keys, match_mode, last):
+        """ The positions of keys among sorted values, -1 where there is none """
+        size = len(values)
+        left = np.searchsorted(values, keys, 'left')
+        right = np.searchsorted(values, keys, 'right')
+        if match_mode == -1:
+            # the exact match or else the largest smaller value
+            at = right - 1
+            valid = at >= 0
+        elif match_mode == 1:
+            # the exact match or else the smallest larger value
+            at = left
+            valid = at < size
+        else:
+            at = left
+            valid = right > left
+        at = np.where(valid, at, 0)
+        if size and match_mode in (-1, 1):
+            # the first or last of the values equal to the one found
+            found = values[at]
+            at = np.searchsorted(values, found, 'right') - 1 if last else np.searchsorted(values, found, 'left')
+        elif last:
+            at = right - 1
+        if not size:
+            return np.full(np.shape(keys), -1, dtype=np.int64)
+        return np.where(valid, positions[np.clip(at, 0, size - 1)], -1)
+
+    def _search_wildcard(self, key, last):
+        pattern = utils.wildcard_to_regex(key)
+        matched = np.fromiter(
+            (pattern.fullmatch(text) is not None for text in self.distinct_texts),
+            dtype=bool, count=len(self.distinct_texts),
+        )
+        found = np.flatnonzero(matched[self.text_inverse])
+        if not len(found):
+            return -1
+        return self.texts_in_order[found[-1] if last else found[0]]
+
+    def _search_texts(self, keys, match_mode, last):
+        keys = np.char.lower(keys.astype('U'))
+        positions = self._search(self.texts, self.text_positions, keys, 0 if match_mode == 2 else match_mode, last)
+        if match_mode == 2:
+            wildcards = np.asarray(np.frompyfunc(lambda key: utils.REGEX_WILDCARD.search(key) is not None, 1, 1)(keys), dtype=bool)
+            for key in np.unique(keys[wildcards]):
+                positions[keys == key] = self._search_wildcard(key, last)
+        return positions
+
+    def find(self, keys, match_mode=0, last=False):
+        """
+        The positions of keys in the range as a long tensor, -1 where a key isn't
+        found. match_mode 0 finds equal values, -1 the equal or else the next
+        smaller value, 1 the equal or else the next larger value and 2 equal
+        values where the wildcards of text keys match anything. last finds the
+        last of the equal values instead of the first.
+        """
+        if isinstance(keys, DictionaryArray):
+            return keys.map(lambda dictionary: self.find(dictionary, match_mode, last))
+        if isinstance(keys, torch.Tensor):
+            keys = keys.numpy()
+        keys = np.asarray(keys)
+        if keys.dtype.kind in 'biuf':
+            numbers = keys.astype(np.float64)
+            positions = self._search(self.numbers, self.number_positions, numbers, match_mode, last)
+            positions = np.where(np.isnan(numbers), -1, positions)
+        elif keys.dtype.kind in 'US':
+            positions = self._search_texts(keys, match_mode, last)
+        else:
+            positions = np.full(keys.shape, -1, dtype=np.int64)
+            is_number = np.asarray(np.frompyfunc(_is_number, 1, 1)(keys), dtype=bool)
+            is_text = np.asarray(np.frompyfunc(_is_text, 1, 1)(keys), dtype=bool)
+            positions[is_number] = self._search(
+                self.numbers, self.number_positions, keys[is_number].astype(np.float64), match_mode, last
+            )
+            positions[is_text] = self._search_texts(keys[is_text], match_mode, last)
+        return torch.from_numpy(np.asarray(positions, dtype=np.int64))
+
+
+def _lookup_index(table, axis=1, i=0):
+    return _cached(table, ('index', axis, i), lambda: LookupIndex(_table_slice(table, axis, i)))
+
+
+def _gather(values, positions, err=error.NOT_AVAILABLE):
+    """ The elements of a range column at positions, err where a position is -1 """
+    missing = positions < 0
+    if positions.ndim == 0:
+        if missing or not len(values):
+            return err
+        value = values[int(positions)]
+        return value.item() if isinstance(value, (torch.Tensor, np.generic)) else value
+    if not len(values):
+        return err
+    at = positions.clamp(min=0)
+    if isinstance(values, torch.Tensor):
+        return utils.mask_errors(values[at], missing, err)
+    if isinstance(values, DictionaryArray):
+        result = DictionaryArray(values.codes[at.numpy()], values.dictionary)
+        return utils.mask_errors(result.decode(), missing.numpy(), err) if missing.any() else result
+    return utils.mask_errors(values[at.numpy()], missing.numpy(), err)
+
+
+def _positions_to_numbers(positions):
+    """ 1 based positions for MATCH, #N/A where a key wasn't found """
+    if positions.ndim == 0:
+        return int(positions) + 1 if positions >= 0 else error.NOT_AVAILABLE
+    return utils.mask_errors((positions + 1).to(utils.float_dtype()), positions < 0, error.NOT_AVAILABLE)
+
+
+@dispatcher.register_for('MATCH', takes_ranges=True)
+def MATCH(lookup_value, lookup_array, match_type=1):
+    if isinstance(lookup_value, error.XLError):
+        return lookup_value
+    match_type = _single_value(match_type)
     if match_type not in (-1, 0, 1):
         return error.NOT_AVAILABLE
+    # excel expects ascending values for 1 and descending ones for -1, where the
+    # last and the first of equal values are found
+    positions = _lookup_index(lookup_array).find(lookup_value, {1: -1, 0: 2, -1: 1}[match_type], last=match_type == 1)
+    return _positions_to_numbers(positions)
 
-    index = None
-    index_value = None
-    for idx in range(len(lookup_array)):
-        if match_type == 1:
-            if lookup_array[idx] == lookup_value:
-                return idx + 1
-            elif lookup_array[idx] < lookup_value:
-                if not index_value:
-                    index = idx + 1
-                    index_value = lookup_array[idx]
-                elif lookup_array[idx] > index_value:
-                    index = idx + 1
-                    index_value = lookup_array[idx]
-        elif match_type == 0:
-            if isinstance(lookup_value, string_types):
-                if fnmatch.fnmatch(lookup_array[idx].lower(), lookup_value.lower()):
-                    return idx + 1
-            else:
-                if lookup_array[idx] == lookup_value:
-                    return idx + 1
-        elif match_type == -1:
-            if lookup_array[idx] == lookup_value:
-                return idx + 1
-            elif lookup_array[idx] > lookup_value:
-                if not index_value:
-                    index = idx + 1
-                    index_value = lookup_array[idx]
-                elif lookup_array[idx] < index_value:
-                    index = idx + 1
-                    index_value = lookup_array[idx]
-
-    return index if index else error.NOT_AVAILABLE
+
+def _lookup(lookup_value, table_array, index_num, range_lookup, axis):
+    """ VLOOKUP looks along the first column (axis 1) and HLOOKUP along the first row (axis 0) """
+    if isinstance(lookup_value, error.XLError):
+        return lookup_value
+    index_num = utils.parse_number(_single_value(index_num))
+    if isinstance(index_num, error.XLError):
+        return index_num
+    range_lookup = _single_value(range_lookup)
+    if isinstance(range_lookup, error.XLError):
+        return range_lookup
+    if index_num < 1:
+        return error.VALUE
+    if index_num > _table_width(table_array, axis):
+        return error.REF
+    range_lookup = bool(range_lookup)
+    positions = _lookup_index(table_array, axis, 0).find(lookup_value, -1 if range_lookup else 2, last=range_lookup)
+    return _gather(_table_slice(table_array, axis, int(index_num) - 1), positions)
+
+
+@dispatcher.register_for('VLOOKUP', takes_ranges=True)
+def VLOOKUP(lookup_value, table_array, col_index_num, range_lookup=True):
+    return _lookup(lookup_value, table_array, col_index_num, range_lookup, 1)
+
+
+@dispatcher.register_for('HLOOKUP', takes_ranges=True)
+def HLOOKUP(lookup_value, table_array, row_index_num, range_lookup=True):
+    return _lookup(lookup_value, table_array, row_index_num, range_lookup, 0)
+
+
+@dispatcher.register_for('XLOOKUP', takes_ranges=True)
+def XLOOKUP(lookup_value, lookup_array, return_array, if_not_found=DEFAULT, match_mode=0, search_mode=1):
+    if isinstance(lookup_value, error.XLError):
+        return lookup_value
+    match_mode = _single_value(match_mode)
+    search_mode = _single_value(search_mode)
+    if match_mode not in (-1, 0, 1, 2) or search_mode not in (-2, -1, 1, 2):
+        return error.VALUE
+    returned = _cached(return_array, ('range',), lambda: _range_column(return_array))
+    if len(returned) != len(_table_slice(lookup_array, 1, 0)):
+        return error.VALUE
+    # binary searches (2 and -2) give the same results as the linear ones on sorted ranges
+    positions = _lookup_index(lookup_array).find(lookup_value, match_mode, last=search_mode < 0)
+    result = _gather(returned, positions)
+    if if_not_found is DEFAULT or if_not_found is None:
+        return result
+    return utils.fill_rows(result, positions < 0, if_not_found)
+
+
+def _table_shape(arr):
+    """ The rows and columns of a table, None for a single row or column """
+    if isinstance(arr, (torch.Tensor, np.ndarray)) and arr.ndim == 2:
+        return tuple(arr.shape)
+    if isinstance(arr, (list, tuple)) and arr and isinstance(arr[0], (list, tuple)):
+        return len(arr), len(arr[0])
+    return None
+
+
+def _index_rows(arr, row_num, column_num):
+    """ INDEX with a row or column number per row, rows whose numbers are out of the table are #REF! """
+    numbers = []
+    for number in (row_num, column_num):
+        if number is DEFAULT:
+            number = 1
+        number = torch.as_tensor(number.numpy() if isinstance(number, np.ndarray) else number)
+        numbers.append(torch.trunc(number.to(torch.double)))
+    row_num, column_num = torch.broadcast_tensors(*numbers)
+    values = _cached(arr, ('range',), lambda: _range_column(arr))
+    if isinstance(arr, (list, tuple)) and values.dtype == object and any(utils.is_column(v) for v in values):
+        # a range of columns, like {A, B}, has a value per row in each of its cells
+        values = list(values)
+    shape = _table_shape(arr)
+    if shape is None:
+        # a single row or column takes either number
+        positions = torch.where(row_num == 1, column_num, row_num) - 1
+        invalid = ((row_num != 1) & (column_num != 1)) | (positions < 0) | (positions >= len(values))
+    else:
+        positions = (row_num - 1) * shape[1] + column_num - 1
+        invalid = (row_num < 1) | (row_num > shape[0]) | (column_num < 1) | (column_num > shape[1])
+    invalid = invalid | torch.isnan(positions)
+    if isinstance(values, list):
+        return _choose_rows(torch.where(invalid, 0, positions + 1), values, error.REF)
+    return _gather(values, torch.where(invalid, -1, torch.nan_to_num(positions)).long(), error.REF)
 
 
 @dispatcher.register_for('INDEX')
@@ -74,6 +405,16 @@ def INDEX(arr, row_num=DEFAULT, column_num=DEFAULT, area_num=DEFAULT):
     if column_num is None:
         column_num = DEFAULT
 
+    row_num = _collapse(row_num)
+    column_num = _collapse(column_num)
+    # numbers that differ from row to row or tables that are tensors or arrays
+    if utils.is_column(row_num) or utils.is_column(column_num) or (
+        isinstance(arr, (torch.Tensor, np.ndarray, DictionaryArray)) and (row_num is not DEFAULT or column_num is not DEFAULT)
+    ):
+        if isinstance(arr, error.XLError):
+            return arr
+        return _index_rows(arr, row_num, column_num)
+
     if arr is None or (row_num is DEFAULT and column_num is DEFAULT):
         return error.VALUE
 
@@ -86,11 +427,13 @@ def INDEX(arr, row_num=DEFAULT, column_num=DEFAULT, area_num=DEFAULT):
         row_num = utils.parse_number(row_num)
         if isinstance(row_num, error.XLError):
             return row_num
+        row_num = int(row_num)
 
     if column_num is not DEFAULT:
         column_num = utils.parse_number(column_num)
         if isinstance(column_num, error.XLError):
             return column_num
+        column_num = int(column_num)
     try:
         if row_num is DEFAULT:
             if bidimensional:
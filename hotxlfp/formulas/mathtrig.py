@@ -16,6 +16,7 @@
 from . import utils
 from .utils import DEFAULT
 from ..helper.number import to_number
+from ..context import current_context
 
 
 @dispatcher.register_for("ABS")
@@ -23,7 +24,7 @@ def ABS(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.abs(torch.tensor(number))
+    return torch.abs(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ACOS")
@@ -31,7 +32,7 @@ def ACOS(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.acos(torch.tensor(number))
+    return torch.acos(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ACOSH")
@@ -39,7 +40,8 @@ def ACOSH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.log(torch.tensor(number) + torch.sqrt(torch.tensor(number) * torch.tensor(number) - 1))
+    number = utils.as_tensor(number)
+    return torch.log(number + torch.sqrt(number * number - 1))
 
 
 @dispatcher.register_for("ACOT")
@@ -47,7 +49,7 @@ def ACOT(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.atan(1 / torch.tensor(number))
+    return torch.atan(1 / utils.as_tensor(number))
 
 
 @dispatcher.register_for("ACOTH")
@@ -55,7 +57,8 @@ def ACOTH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return 0.5 * torch.log((torch.tensor(number) + 1) / torch.tensor(number) - 1)
+    number = utils.as_tensor(number)
+    return 0.5 * torch.log((number + 1) / number - 1)
 
 
 @dispatcher.register_for("SIN")
@@ -63,7 +66,7 @@ def SIN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.sin(torch.tensor(number))
+    return torch.sin(utils.as_tensor(number))
 
 
 @dispatcher.register_for("SINH")
@@ -71,7 +74,7 @@ def SINH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.sinh(torch.tensor(number))
+    return torch.sinh(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ASIN")
@@ -79,7 +82,7 @@ def ASIN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.asin(torch.tensor(number))
+    return torch.asin(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ASINH")
@@ -87,7 +90,7 @@ def ASINH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.asinh(torch.tensor(number))
+    return torch.asinh(utils.as_tensor(number))
 
 
 @dispatcher.register_for("COS")
@@ -95,7 +98,7 @@ def COS(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.cos(torch.tensor(number))
+    return torch.cos(utils.as_tensor(number))
 
 
 @dispatcher.register_for("COSH")
@@ -103,7 +106,7 @@ def COSH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.cosh(torch.tensor(number))
+    return torch.cosh(utils.as_tensor(number))
 
 
 @dispatcher.register_for("COT")
@@ -111,7 +114,8 @@ def COT(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.cos(torch.tensor(number)) / torch.sin(torch.tensor(number))
+    number = utils.as_tensor(number)
+    return torch.cos(number) / torch.sin(number)
 
 
 @dispatcher.register_for("TAN")
@@ -119,7 +123,7 @@ def TAN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.tan(torch.tensor(number))
+    return torch.tan(utils.as_tensor(number))
 
 
 @dispatcher.register_for("TANH")
@@ -127,7 +131,7 @@ def TANH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.tanh(torch.tensor(number))
+    return torch.tanh(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ATAN")
@@ -135,7 +139,7 @@ def ATAN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.atan(torch.tensor(number))
+    return torch.atan(utils.as_tensor(number))
 
 
 @dispatcher.register_for("ATAN2")
@@ -146,7 +150,7 @@ def ATAN2(x_num, y_num):
     y_num = utils.parse_number(x_num)
     if isinstance(y_num, error.XLError):
         return y_num
-    return torch.atan2(torch.tensor(x_num), torch.tensor(y_num))
+    return torch.atan2(utils.as_tensor(x_num), utils.as_tensor(y_num))
 
 
 @dispatcher.register_for("ATANH")
@@ -154,7 +158,7 @@ def ATANH(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.atanh(torch.tensor(number))
+    return torch.atanh(utils.as_tensor(number))
 
 
 @dispatcher.register_for("SQRT")
@@ -162,7 +166,7 @@ def SQRT(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.sqrt(torch.tensor(number))
+    return torch.sqrt(utils.as_tensor(number))
 
 
 @dispatcher.register_for("EXP")
@@ -170,7 +174,7 @@ def EXP(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.exp(torch.tensor(number))
+    return torch.exp(utils.as_tensor(number))
 
 
 @dispatcher.register_for("LN")
@@ -178,7 +182,7 @@ def LN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    return torch.log(torch.tensor(number))
+    return torch.log(utils.as_tensor(number))
 
 
 @dispatcher.register_for("LOG")
@@ -188,9 +192,9 @@ def LOG(number, base=None):
     if utils.any_is_error((number, base)):
         return error.VALUE
     if base is not None:
-        return torch.log(torch.tensor(number)) / torch.log(torch.tensor(base))
+        return torch.log(utils.as_tensor(number)) / torch.log(utils.as_tensor(base))
     else:
-        return torch.log(torch.tensor(number))
+        return torch.log(utils.as_tensor(number))
 
 
 @dispatcher.register_for("LOG10")
@@ -200,7 +204,26 @@ def LOG10(number):
 
 @dispatcher.register_for("PI")
 def PI():
-    return torch.tensor(math.pi)
+    return utils.as_tensor(math.pi)
+
+
+# Relative nudge, in units of the machine epsilon of the dtype rounded in, that absorbs
+# the binary representation error of values such as 1.005 so they round the way excel
+# displays them.
+ROUNDING_ULPS = 4
+
+
+def _round_to_digits(number, digits, rounder, nudge):
+    number = torch.as_tensor(number, dtype=utils.float_dtype())
+    digits = torch.trunc(torch.as_tensor(digits, dtype=utils.float_dtype()))
+    # the factor 10**|digits| is an exact power of ten >= 1, positive digits multiply by it and negative ones divide
+    factor = torch.pow(10.0, torch.abs(digits))
+    positive_digits = digits >= 0
+    magnitude = torch.abs(number)
+    scaled = torch.where(positive_digits, magnitude * factor, magnitude / factor)
+    rounded = rounder(scaled * (1 + nudge * ROUNDING_ULPS * torch.finfo(number.dtype).eps))
+    rounded = torch.where(positive_digits, rounded / factor, rounded * factor)
+    return torch.where(number < 0, -rounded, rounded)
 
 
 @dispatcher.register_for("ROUND")
@@ -209,7 +232,8 @@ def ROUND(number, digits):
     digits = utils.parse_number(digits)
     if utils.any_is_error((number, digits)):
         return error.VALUE
-    return round(number, digits)
+    # excel rounds half away from zero
+    return _round_to_digits(number, digits, lambda scaled: torch.floor(scaled + 0.5), 1)
 
 
 @dispatcher.register_for("ROUNDUP")
@@ -218,8 +242,7 @@ def ROUNDUP(number, digits):
     digits = utils.parse_number(digits)
     if utils.any_is_error((number, digits)):
         return error.VALUE
-    sign = 1 if number > 0 else -1
-    return sign * (math.ceil(abs(number) * 10**digits)) / 10**digits
+    return _round_to_digits(number, digits, torch.ceil, -1)
 
 
 @dispatcher.register_for("ROUNDDOWN")
@@ -228,8 +251,7 @@ def ROUNDDOWN(number, digits):
     digits = utils.parse_number(digits)
     if utils.any_is_error((number, digits)):
         return error.VALUE
-    sign = 1 if number > 0 else -1
-    return sign * (math.floor(abs(number) * 10**digits)) / 10**digits
+    return _round_to_digits(number, digits, torch.floor, 1)
 
 
 @dispatcher.register_for("SUM")
@@ -237,10 +259,26 @@ def SUM(*args):
     return sum(utils.inumbers(args, try_parse=True))
 
 
-@dispatcher.register_for("SUMIF")
-def SUMIF(args, criteria):
-    predicate = utils.parse_criteria(criteria)
-    return sum(a for a in utils.iflatten(args) if predicate(a))
+@dispatcher.register_for("SUMIF", reduces_rows=True)
+def SUMIF(args, criteria, sum_range=None):
+    mask = utils.criteria_mask(args, criteria)
+    if isinstance(mask, error.XLError):
+        return mask
+    values = utils.numeric_range(args if sum_range is None else sum_range)
+    if len(values) != len(mask):
+        return error.VALUE
+    return torch.where(mask, values, 0).sum()
+
+
+@dispatcher.register_for("SUMIFS", reduces_rows=True)
+def SUMIFS(sum_range, *args):
+    mask = utils.fused_criteria_mask(args)
+    if isinstance(mask, error.XLError):
+        return mask
+    values = utils.numeric_range(sum_range)
+    if len(values) != len(mask):
+        return error.VALUE
+    return torch.where(mask, values, 0).sum()
 
 
 @dispatcher.register_for("CEILING", "CEILING.MATH", "CEILING.PRECISE")
@@ -248,10 +286,10 @@ def CEILING(number, significance=1):
     number = utils.parse_number(number)
     significance = utils.parse_number(significance)
     if isinstance(number, torch.Tensor) and (not isinstance(significance, torch.Tensor) or significance.dim() == 0 or significance.size(dim=0) == 1):
-        significance = torch.broadcast_to(torch.tensor(significance), number.size())
+        significance = torch.broadcast_to(utils.as_tensor(significance), number.size())
 
-    number = torch.tensor(number)
-    significance = torch.tensor(significance)
+    number = utils.as_tensor(number)
+    significance = utils.as_tensor(significance)
     if utils.any_is_error((number, significance)):
         return error.VALUE
     if number.size() != significance.size():
@@ -316,9 +354,9 @@ def QUOTIENT(numerator, denominator):
     denominator = utils.parse_number(denominator)
     if utils.any_is_error((numerator, denominator)):
         return error.VALUE
-    if denominator == 0:
-        return error.DIV_ZERO
-    return int(numerator / denominator)
+    numerator = torch.as_tensor(numerator, dtype=utils.float_dtype())
+    denominator = torch.as_tensor(denominator, dtype=utils.float_dtype())
+    return utils.mask_errors(torch.trunc(numerator / denominator), denominator == 0, error.DIV_ZERO)
 
 
 @dispatcher.register_for("MOD")
@@ -329,10 +367,10 @@ def MOD(numerator, denominator):
         return numerator
     if isinstance(denominator, error.XLError):
         return denominator
-    if denominator == 0:
-        return error.DIV_ZERO
-    modulus = abs(numerator % denominator)
-    return modulus if denominator > 0 else -modulus
+    numerator = torch.as_tensor(numerator, dtype=utils.float_dtype())
+    denominator = torch.as_tensor(denominator, dtype=utils.float_dtype())
+    # like excel, remainder gives the result the sign of the divisor
+    return utils.mask_errors(torch.remainder(numerator, denominator), denominator == 0, error.DIV_ZERO)
 
 
 @dispatcher.register_for("RADIANS")
@@ -361,9 +399,10 @@ def ODD(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    tmp = math.ceil(abs(number))
-    tmp = tmp if (tmp % 2) == 1 else tmp + 1
-    return tmp if number > 0 else -tmp
+    number = torch.as_tensor(number, dtype=utils.float_dtype())
+    tmp = torch.ceil(torch.abs(number))
+    tmp = torch.where(torch.remainder(tmp, 2) == 1, tmp, tmp + 1)
+    return torch.where(number < 0, -tmp, tmp)
 
 
 @dispatcher.register_for("EVEN")
@@ -371,9 +410,10 @@ def EVEN(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    tmp = math.ceil(abs(number))
-    tmp = tmp if (tmp % 2) == 0 else tmp + 1
-    return tmp if number > 0 else -tmp
+    number = torch.as_tensor(number, dtype=utils.float_dtype())
+    tmp = torch.ceil(torch.abs(number))
+    tmp = torch.where(torch.remainder(tmp, 2) == 0, tmp, tmp + 1)
+    return torch.where(number < 0, -tmp, tmp)
 
 
 @dispatcher.register_for("DECIMAL")
@@ -417,14 +457,37 @@ def BASE(value, base, places=DEFAULT):
     return result
 
 
+def _factorial_table(step):
+    """ Every factorial (double factorial when step is 2) that still fits in a double """
+    products = [1] * step  # 0! and 1!! are both 1
+    while True:
+        n = len(products)
+        product = max(n, 1) * products[n - step]
+        try:
+            float(product)
+        except OverflowError:
+            return torch.tensor([float(p) for p in products], dtype=torch.double)
+        products.append(product)
+
+
+FACTORIALS = _factorial_table(1)  # up to 170!
+DOUBLE_FACTORIALS = _factorial_table(2)
+
+
+def _lookup_factorial(table, number):
+    number = torch.trunc(torch.as_tensor(number, dtype=utils.float_dtype()))
+    invalid = (number < 0) | (number >= len(table)) | torch.isnan(number)
+    index = torch.where(invalid, 0, number).long()
+    # the table is in float64, results take the dtype of the precision policy
+    return utils.mask_errors(table[index].to(utils.float_dtype()), invalid, error.NUM)
+
+
 @dispatcher.register_for("FACT")
 def FACT(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    if number < 0:
-        return error.NUM
-    return math.factorial(int(number))
+    return _lookup_factorial(FACTORIALS, number)
 
 
 @dispatcher.register_for("FACTDOUBLE")
@@ -432,12 +495,7 @@ def FACTDOUBLE(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
-    if number < 0:
-        return error.NUM
-    number = int(number)
-    if number in (0, 1):
-        return 1
-    return reduce(operator.mul, range(number, 1, -2))
+    return _lookup_factorial(DOUBLE_FACTORIALS, number)
 
 
 @dispatcher.register_for("ROMAN")
@@ -521,12 +579,24 @@ def ARABIC(text):
     )
 
 
-@dispatcher.register_for("RAND")
+def _uniform():
+    """ A uniform draw per row from the sampler of the running formula, a single one outside formulas """
+    context = current_context()
+    if context is None or context.sampler is None:
+        return random.random()
+    return context.sampler.uniform()
+
+
+@dispatcher.register_for("RAND", volatile=True)
 def RAND():
-    return random.random()
+    values = _uniform()
+    if isinstance(values, torch.Tensor):
+        # drawn as doubles so every precision policy draws the same numbers
+        return values.to(utils.float_dtype())
+    return values
 
 
-@dispatcher.register_for("RANDBETWEEN")
+@dispatcher.register_for("RANDBETWEEN", volatile=True)
 def RANDBETWEEN(bottom, top):
     bottom = utils.parse_number(bottom)
     top = utils.parse_number(top)
@@ -534,4 +604,10 @@ def RANDBETWEEN(bottom, top):
     if utils.any_is_error((bottom, top)):
         return error.VALUE
 
-    return random.randint(int(bottom), int(top))
+    bottom = torch.ceil(torch.as_tensor(bottom, dtype=utils.float_dtype()))
+    top = torch.floor(torch.as_tensor(top, dtype=utils.float_dtype()))
+    values = bottom + torch.floor(torch.as_tensor(_uniform(), dtype=utils.float_dtype()) * (top - bottom + 1))
+    values = utils.mask_errors(values, bottom > top, error.NUM)
+    if isinstance(values, torch.Tensor) and values.ndim == 0:
+        return int(values)
+    return values
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import datetime
+import numpy as np
 import torch
 from . import error
 from ..helper.number import to_number
-from .utils import OPERATOR_DICT, serialize_date, parse_date, date_1900
+from .utils import OPERATOR_DICT, serialize_date, parse_date, date_1900, is_text_array, parse_text_array
+from .utils import is_column, to_text, number_to_text, text_column, restore_errors, row_error_codes, code_errors
+from ..backends import current_backend
+from ..context import current_context
+from ..dictionary import DictionaryArray
 from .._compat import number_types, string_types
 
 
@@ -78,13 +83,13 @@ def __eq__(self, other):
         return self.value == other
     
     def __ne__(self, other):
-        return torch.logical_not(self.__eq__(other))
+        return current_backend().logical_not(self.__eq__(other))
 
     def __ge__(self, other):
-        return torch.logical_or(self.__gt__(other), self.__eq__(other))
+        return current_backend().logical_or(self.__gt__(other), self.__eq__(other))
 
     def __le__(self, other):
-        return torch.logical_or(self.__lt__(other), self.__eq__(other))
+        return current_backend().logical_or(self.__lt__(other), self.__eq__(other))
 
 
 class ExcelArrayOps(object):
@@ -141,6 +146,8 @@ def __rtruediv__(self, value):
 
 
 def value_and_type(value):
+    if is_text_array(value):
+        return (current_backend().from_tensor(parse_text_array(value)), number_types)
     if isinstance(value, number_types):
         return (value, number_types)
     if isinstance(value, datetime.datetime):
@@ -406,7 +413,27 @@ def value_and_type(value):
 }
 
 
-def evaluate_arithmetic(op, lval, rval):
+# the torch functions of the arithmetic operators buffer arenas write the results of
+ARENA_OPERATORS = {
+    '+': torch.add,
+    '-': torch.sub,
+    '*': torch.mul,
+    '/': torch.div,
+}
+
+
+def _in_arena(op, lval, rval, site):
+    """
+    lval op rval written into the buffer of site in the active arena, None
+    without one or when it can't be
+    """
+    context = current_context()
+    if context is None or context.arena is None or op not in ARENA_OPERATORS:
+        return None
+    return context.arena.binary(ARENA_OPERATORS[op], lval, rval, site)
+
+
+def evaluate_arithmetic(op, lval, rval, site=None):
     if isinstance(lval, error.XLError):
         return lval
     if isinstance(rval, error.XLError):
@@ -433,13 +460,49 @@ def evaluate_arithmetic(op, lval, rval):
         rval = rconv(rval)
 
     try:
-        result = OPERATOR_DICT[op](lval, rval)
         if 'result' in conversions[ltype][rtype]:
-            result = conversions[ltype][rtype]['result'](result)
-        return result
+            return conversions[ltype][rtype]['result'](OPERATOR_DICT[op](lval, rval))
+        result = _in_arena(op, lval, rval, site)
+        return OPERATOR_DICT[op](lval, rval) if result is None else result
     except ZeroDivisionError:
         return error.DIV_ZERO
 
 
 def evaluate_logic(op, lval, rval):
     return OPERATOR_DICT[op](ExcelComparator(lval), rval)
+
+
+def _concatenation_operand(value):
+    """ The text of a & operand, the rows holding an error and the errors themselves """
+    if not is_column(value):
+        return to_text(value), None, None
+    value = current_backend().to_tensor(value)
+    if isinstance(value, torch.Tensor) and value.is_floating_point():
+        # NaN is the per-row error of numeric columns
+        codes = row_error_codes(value)
+        errors = (codes != 0).numpy()
+        if errors.any():
+            return number_to_text(value), errors, code_errors(codes)
+    text, errors = text_column(value)
+    return text, errors, value
+
+
+def evaluate_concatenation(lval, rval):
+    """ The & operator, columns are concatenated row by row """
+    if isinstance(lval, error.XLError):
+        return lval
+    if isinstance(rval, error.XLError):
+        return rval
+    if not (is_column(lval) or is_column(rval)):
+        return to_text(lval) + to_text(rval)
+    # a dictionary encoded column joined to a single value stays encoded
+    if isinstance(lval, DictionaryArray) and not is_column(rval):
+        return lval.map(lambda dictionary: evaluate_concatenation(dictionary, rval))
+    if isinstance(rval, DictionaryArray) and not is_column(lval):
+        return rval.map(lambda dictionary: evaluate_concatenation(lval, dictionary))
+    left, left_errors, left_original = _concatenation_operand(lval)
+    right, right_errors, right_original = _concatenation_operand(rval)
+    result = np.char.add(left, right)
+    # an error on either side wins over the concatenated text, the left one first
+    result = restore_errors(result, right_original, right_errors)
+    return restore_errors(result, left_original, left_errors)
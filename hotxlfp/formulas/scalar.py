@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Pure python versions of elementwise functions for calls whose arguments are all
+plain numbers, like a formula evaluated on a single row while a cell is edited.
+They skip creating tensors and give the same results as the tensor versions,
+NaN outside a function's domain and infinities where it overflows, as python
+floats instead of 0-d tensors.
+"""
+from __future__ import division
+import math
+import sys
+from . import dispatcher
+from . import error
+from .utils import scalar_power as power
+from .mathtrig import DOUBLE_FACTORIALS, FACTORIALS, ROUNDING_ULPS
+
+EPSILON = sys.float_info.epsilon
+
+
+def is_number(value):
+    """ Whether value is a python number, bools included, that a scalar function takes """
+    return isinstance(value, (int, float))
+
+
+def _nan_outside_domain(fn, number):
+    try:
+        return fn(number)
+    except ValueError:
+        return math.nan
+
+
+def divide(a, b):
+    """ a / b like floating point division, dividing by zero is infinite or NaN """
+    if b == 0:
+        if a == 0 or math.isnan(a):
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1, b)
+    return a / b
+
+
+def _log(number):
+    if number > 0:
+        return math.log(number)
+    return -math.inf if number == 0 else math.nan
+
+
+def _sqrt(number):
+    return math.nan if number < 0 else math.sqrt(number)
+
+
+def _exp(number):
+    try:
+        return math.exp(number)
+    except OverflowError:
+        return math.inf
+
+
+def _rounder(fn):
+    """ A math rounding function that leaves infinities and NaN as they are """
+    return lambda number: float(fn(number)) if math.isfinite(number) else number
+
+
+_floor = _rounder(math.floor)
+_ceil = _rounder(math.ceil)
+_trunc = _rounder(math.trunc)
+
+
+@dispatcher.register_scalar_for("ABS")
+def ABS(number):
+    return abs(float(number))
+
+
+@dispatcher.register_scalar_for("ACOS")
+def ACOS(number):
+    return _nan_outside_domain(math.acos, number)
+
+
+@dispatcher.register_scalar_for("ACOSH")
+def ACOSH(number):
+    return _log(number + _sqrt(number * number - 1))
+
+
+@dispatcher.register_scalar_for("ACOT")
+def ACOT(number):
+    return math.atan(divide(1, number))
+
+
+@dispatcher.register_scalar_for("ACOTH")
+def ACOTH(number):
+    return 0.5 * _log(divide(number + 1, number) - 1)
+
+
+@dispatcher.register_scalar_for("SIN")
+def SIN(number):
+    return _nan_outside_domain(math.sin, number)
+
+
+@dispatcher.register_scalar_for("SINH")
+def SINH(number):
+    try:
+        return math.sinh(number)
+    except OverflowError:
+        return math.copysign(math.inf, number)
+
+
+@dispatcher.register_scalar_for("ASIN")
+def ASIN(number):
+    return _nan_outside_domain(math.asin, number)
+
+
+@dispatcher.register_scalar_for("ASINH")
+def ASINH(number):
+    return math.asinh(number)
+
+
+@dispatcher.register_scalar_for("COS")
+def COS(number):
+    return _nan_outside_domain(math.cos, number)
+
+
+@dispatcher.register_scalar_for("COSH")
+def COSH(number):
+    try:
+        return math.cosh(number)
+    except OverflowError:
+        return math.inf
+
+
+@dispatcher.register_scalar_for("COT")
+def COT(number):
+    return divide(COS(number), SIN(number))
+
+
+@dispatcher.register_scalar_for("TAN")
+def TAN(number):
+    return _nan_outside_domain(math.tan, number)
+
+
+@dispatcher.register_scalar_for("TANH")
+def TANH(number):
+    return math.tanh(number)
+
+
+@dispatcher.register_scalar_for("ATAN")
+def ATAN(number):
+    return math.atan(number)
+
+
+@dispatcher.register_scalar_for("ATANH")
+def ATANH(number):
+    if abs(number) == 1:
+        return math.copysign(math.inf, number)
+    return _nan_outside_domain(math.atanh, number)
+
+
+@dispatcher.register_scalar_for("SQRT")
+def SQRT(number):
+    return _sqrt(number)
+
+
+@dispatcher.register_scalar_for("EXP")
+def EXP(number):
+    return _exp(number)
+
+
+@dispatcher.register_scalar_for("LN")
+def LN(number):
+    return _log(number)
+
+
+@dispatcher.register_scalar_for("LOG")
+def LOG(number, base=None):
+    if base is not None:
+        return divide(_log(number), _log(base))
+    return _log(number)
+
+
+@dispatcher.register_scalar_for("LOG10")
+def LOG10(number):
+    return LOG(number, 10)
+
+
+@dispatcher.register_scalar_for("PI")
+def PI():
+    return math.pi
+
+
+def _round_to_digits(number, digits, rounder, nudge):
+    number = float(number)
+    digits = _trunc(float(digits))
+    factor = power(10.0, abs(digits))
+    magnitude = abs(number)
+    scaled = magnitude * factor if digits >= 0 else divide(magnitude, factor)
+    rounded = rounder(scaled * (1 + nudge * ROUNDING_ULPS * EPSILON))
+    rounded = divide(rounded, factor) if digits >= 0 else rounded * factor
+    return -rounded if number < 0 else rounded
+
+
+@dispatcher.register_scalar_for("ROUND")
+def ROUND(number, digits):
+    return _round_to_digits(number, digits, lambda scaled: _floor(scaled + 0.5), 1)
+
+
+@dispatcher.register_scalar_for("ROUNDUP")
+def ROUNDUP(number, digits):
+    return _round_to_digits(number, digits, _ceil, -1)
+
+
+@dispatcher.register_scalar_for("ROUNDDOWN")
+def ROUNDDOWN(number, digits):
+    return _round_to_digits(number, digits, _floor, 1)
+
+
+@dispatcher.register_scalar_for("QUOTIENT")
+def QUOTIENT(numerator, denominator):
+    if denominator == 0:
+        return error.DIV_ZERO
+    return _trunc(float(numerator) / denominator)
+
+
+@dispatcher.register_scalar_for("MOD")
+def MOD(numerator, denominator):
+    if denominator == 0:
+        return error.DIV_ZERO
+    # like excel, the result takes the sign of the divisor
+    return float(numerator) % denominator
+
+
+def _odd_or_even(number, remainder):
+    tmp = _ceil(abs(float(number)))
+    tmp = tmp if tmp % 2 == remainder else tmp + 1
+    return -tmp if number < 0 else tmp
+
+
+@dispatcher.register_scalar_for("ODD")
+def ODD(number):
+    return _odd_or_even(number, 1)
+
+
+@dispatcher.register_scalar_for("EVEN")
+def EVEN(number):
+    return _odd_or_even(number, 0)
+
+
+def _lookup_factorial(table, number):
+    number = _trunc(float(number))
+    if math.isnan(number) or number < 0 or number >= len(table):
+        return error.NUM
+    return table[int(number)]
+
+
+FACTORIAL_LIST = FACTORIALS.tolist()
+DOUBLE_FACTORIAL_LIST = DOUBLE_FACTORIALS.tolist()
+
+
+@dispatcher.register_scalar_for("FACT")
+def FACT(number):
+    return _lookup_factorial(FACTORIAL_LIST, number)
+
+
+@dispatcher.register_scalar_for("FACTDOUBLE")
+def FACTDOUBLE(number):
+    return _lookup_factorial(DOUBLE_FACTORIAL_LIST, number)
+
+
+@dispatcher.register_scalar_for("IF")
+def IF(test, then, otherwise):
+    return float(then) if test else float(otherwise)
+
+
+def _extreme(values, pick):
+    values = [float(value) for value in values]
+    if any(math.isnan(value) for value in values):
+        return math.nan
+    return pick(values)
+
+
+@dispatcher.register_scalar_for("MAX")
+def MAX(*args):
+    return _extreme(args, max)
+
+
+@dispatcher.register_scalar_for("MIN")
+def MIN(*args):
+    return _extreme(args, min)
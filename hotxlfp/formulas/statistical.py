@@ -36,7 +36,7 @@ def broadcast_args(args):
 
 @dispatcher.register_for('AVERAGE')
 def AVERAGE(*args):
-    return torch.mean(torch.tensor(torch.stack(broadcast_args(args), dim=0), dtype=torch.double), dim=0)
+    return torch.mean(torch.stack(broadcast_args(args), dim=0).to(utils.float_dtype()), dim=0)
 
 
 @dispatcher.register_for('AVEDEV')
@@ -51,23 +51,40 @@ def AVERAGEA(*args):
     return statistics.mean(utils.inumbers(args, try_parse=True, text_is_zero=True))
 
 
-@dispatcher.register_for('AVERAGEIF')
+def _masked_average(mask, values):
+    if isinstance(mask, error.XLError):
+        return mask
+    values = utils.numeric_range(values)
+    if len(values) != len(mask):
+        return error.VALUE
+    count = mask.sum()
+    if count == 0:
+        return error.DIV_ZERO
+    return torch.where(mask, values, 0).sum() / count
+
+
+def _masked_extreme(mask, values, reduce, fill):
+    if isinstance(mask, error.XLError):
+        return mask
+    values = utils.numeric_range(values)
+    if len(values) != len(mask):
+        return error.VALUE
+    if not mask.any():
+        return torch.tensor(0, dtype=utils.float_dtype())
+    return reduce(torch.where(mask, values, fill))
+
+
+@dispatcher.register_for('AVERAGEIF', reduces_rows=True)
 def AVERAGEIF(args, criteria, average_range=None):
-    average_range = average_range or args
-    args = utils.flatten(args)
-    average_range = utils.iparse_number_array(utils.flatten(average_range))
-    if isinstance(average_range, error.XLError):
-        return average_range
-    average_range = list(average_range)
-    average_count = 0
-    result = 0
-    predicate = utils.parse_criteria(criteria)
+    return _masked_average(
+        utils.criteria_mask(args, criteria),
+        args if average_range is None else average_range,
+    )
+
 
-    for i, arg_i in enumerate(args):
-        if (predicate(args[i])):
-            result += average_range[i]
-            average_count += 1
-    return result / average_count
+@dispatcher.register_for('AVERAGEIFS', reduces_rows=True)
+def AVERAGEIFS(average_range, *args):
+    return _masked_average(utils.fused_criteria_mask(args), average_range)
 
 
 @dispatcher.register_for('COUNT')
@@ -85,16 +102,32 @@ def COUNTBLANK(*args):
     return sum(1 for a in utils.iflatten(args) if (a is None or a == ''))
 
 
-@dispatcher.register_for('COUNTIF')
+@dispatcher.register_for('COUNTIF', reduces_rows=True)
 def COUNTIF(args, criteria):
-    predicate = utils.parse_criteria(criteria)
-    return sum(1 for a in utils.iflatten(args) if predicate(a))
+    mask = utils.criteria_mask(args, criteria)
+    if isinstance(mask, error.XLError):
+        return mask
+    return mask.sum()
+
+
+@dispatcher.register_for('COUNTIFS', reduces_rows=True)
+def COUNTIFS(*args):
+    mask = utils.fused_criteria_mask(args)
+    if isinstance(mask, error.XLError):
+        return mask
+    return mask.sum()
 
 
 @dispatcher.register_for('MAX')
 def MAX(*args):
-    tensors = [torch.tensor(val, dtype=torch.double) for val in broadcast_args(args)]
-    return torch.max(torch.tensor(torch.stack(tensors, dim=0), dtype=torch.double), dim=0).values
+    values = broadcast_args(args)
+    dtype = utils.number_dtype(*values)
+    return torch.max(torch.stack([torch.as_tensor(val, dtype=dtype) for val in values], dim=0), dim=0).values
+
+
+@dispatcher.register_for('MAXIFS', reduces_rows=True)
+def MAXIFS(max_range, *args):
+    return _masked_extreme(utils.fused_criteria_mask(args), max_range, torch.max, float('-inf'))
 
 
 @dispatcher.register_for('MAXA')
@@ -109,8 +142,14 @@ def MEDIAN(*args):
 
 @dispatcher.register_for('MIN')
 def MIN(*args):
-    tensors = [torch.tensor(val, dtype=torch.double) for val in broadcast_args(args)]
-    return torch.min(torch.tensor(torch.stack(tensors, dim=0), dtype=torch.double), dim=0).values
+    values = broadcast_args(args)
+    dtype = utils.number_dtype(*values)
+    return torch.min(torch.stack([torch.as_tensor(val, dtype=dtype) for val in values], dim=0), dim=0).values
+
+
+@dispatcher.register_for('MINIFS', reduces_rows=True)
+def MINIFS(min_range, *args):
+    return _masked_extreme(utils.fused_criteria_mask(args), min_range, torch.min, float('inf'))
 
 
 @dispatcher.register_for('MINA')
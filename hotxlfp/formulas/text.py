@@ -12,7 +12,29 @@
 from . import utils
 from .utils import DEFAULT
 from ..helper.number import to_number
+from ..dictionary import DictionaryArray
 from .._compat import string_types
+import numpy as np
+import torch
+
+
+# CHAR(n) for every n excel accepts, index 0 is never returned
+CHARACTERS = np.array([chr(i) for i in range(256)])
+# translation table CLEAN uses to drop the non printable characters
+NON_PRINTABLE = {i: None for i in range(32)}
+
+
+def _map_text(text, scalar_fn, column_fn):
+    """ Applies scalar_fn to a single text or column_fn to a whole text column """
+    if isinstance(text, error.XLError):
+        return text
+    if isinstance(text, DictionaryArray):
+        # once per distinct value, text results stay encoded
+        return text.map(column_fn)
+    if utils.is_column(text):
+        column, errors = utils.text_column(text)
+        return utils.restore_errors(column_fn(column), text, errors)
+    return scalar_fn(utils.to_text(text))
 
 
 @dispatcher.register_for('CHAR')
@@ -20,72 +42,101 @@ def CHAR(number):
     number = utils.parse_number(number)
     if isinstance(number, error.XLError):
         return number
+    if utils.is_column(number):
+        number = torch.as_tensor(number)
+        invalid = (number < 1) | (number >= len(CHARACTERS)) | torch.isnan(number.to(torch.double))
+        codes = torch.where(invalid, 0, number).long().numpy()
+        return utils.mask_errors(CHARACTERS[codes], invalid.numpy(), error.VALUE)
     return chr(number)
 
 
 @dispatcher.register_for('CODE')
 def CODE(char):
+    if isinstance(char, error.XLError):
+        return char
+    if isinstance(char, DictionaryArray):
+        return char.map(CODE)
+    if utils.is_column(char):
+        column, errors = utils.text_column(char)
+        # the code point of the first character, empty strings give 0
+        codes = np.ascontiguousarray(column, dtype='U1').view(np.uint32).reshape(column.shape)
+        codes = torch.from_numpy(codes.astype(np.float64))
+        return utils.restore_errors(utils.mask_errors(codes, codes == 0, error.VALUE), char, errors)
     return ord(char)
 
 
 @dispatcher.register_for('CLEAN')
 def CLEAN(text):
-    if isinstance(text, error.XLError):
-        return text
-    if text is None:
-        text = ''
-    if not isinstance(text, string_types):
-        text = str(text)
-    return ''.join(c for c in text if ord(c) > 31)
+    return _map_text(
+        text,
+        lambda text: ''.join(c for c in text if ord(c) > 31),
+        lambda column: np.char.translate(column, NON_PRINTABLE),
+    )
+
+
+def _text_parts(args):
+    """ The flattened arguments of CONCATENATE and TEXTJOIN, as text columns when any of them is a column """
+    parts = utils.flatten(args)
+    if not any(utils.is_column(part) for part in parts):
+        return parts, False
+    return [utils.text_column(part)[0] if utils.is_column(part) else utils.to_text(part) for part in parts], True
+
+
+def _encoded_part(parts):
+    """ The position of the only column among parts when it is dictionary encoded, otherwise None """
+    columns = [i for i, part in enumerate(parts) if utils.is_column(part)]
+    if len(columns) == 1 and isinstance(parts[columns[0]], DictionaryArray):
+        return columns[0]
+    return None
 
 
 @dispatcher.register_for('CONCAT', 'CONCATENATE')
 def CONCATENATE(*args):
-    return ''.join(utils.iflatten(args))
+    parts = utils.flatten(args)
+    i = _encoded_part(parts)
+    if i is not None:
+        return parts[i].map(lambda dictionary: CONCATENATE(*(parts[:i] + [dictionary] + parts[i + 1:])))
+    parts, columnar = _text_parts(args)
+    if columnar:
+        return reduce(np.char.add, parts)
+    return ''.join(utils.to_text(part) for part in parts)
 
 
 @dispatcher.register_for('LEN')
 def LEN(text):
-    if isinstance(text, error.XLError):
-        return text
-    if text is None:
-        return 0
-    if not isinstance(text, string_types):
-        text = str(text)
-    return len(text)
+    return _map_text(
+        text,
+        len,
+        lambda column: torch.from_numpy(np.char.str_len(column).astype(np.float64)),
+    )
 
 
 @dispatcher.register_for('LOWER')
 def LOWER(text):
-    if isinstance(text, error.XLError):
-        return text
-    if text is None:
-        text = ''
-    if not isinstance(text, string_types):
-        text = str(text)
-    return text.lower()
+    return _map_text(text, lambda text: text.lower(), np.char.lower)
 
 
 @dispatcher.register_for('UPPER')
 def UPPER(text):
-    if isinstance(text, error.XLError):
-        return text
-    if text is None:
-        text = ''
-    if not isinstance(text, string_types):
-        text = str(text)
-    return text.upper()
+    return _map_text(text, lambda text: text.upper(), np.char.upper)
 
 
 @dispatcher.register_for('PROPER')
 def PROPER(text):
-    if isinstance(text, error.XLError):
-        return text
-    if text is None:
-        text = ''
-    if not isinstance(text, string_types):
-        text = str(text)
-    return text.title()
+    return _map_text(text, lambda text: text.title(), np.char.title)
+
+
+def _substitute(text, old_text, new_text, instance_num):
+    if instance_num is DEFAULT:
+        return text.replace(old_text, new_text)
+    len_old = len(old_text)
+    ocurrences = 0
+    for i in range(len(text) - len_old + 1):
+        if text[i:i + len_old] == old_text:
+            ocurrences += 1
+            if ocurrences == instance_num:
+                return text[0:i] + new_text + text[i + len_old:]
+    return text
 
 
 @dispatcher.register_for('SUBSTITUTE')
@@ -96,27 +147,48 @@ def SUBSTITUTE(text, old_text, new_text, instance_num=DEFAULT):
             return instance_num
         if instance_num <= 0:
             return error.VALUE
-    if not text or not old_text or not new_text:
-        return text
-    if instance_num is DEFAULT:
-        return text.replace(old_text, new_text)
-    else:
-        len_old = len(old_text)
-        ocurrences = 0
-        for i in range(len(text) - len_old + 1):
-            if text[i:i + len_old] == old_text:
-                ocurrences += 1
-                if ocurrences == instance_num:
-                    return text[0:i] + new_text + text[i + len_old:]
+    if utils.is_column(text):
+        if not old_text:
+            return text
+        old_text = utils.to_text(old_text)
+        new_text = utils.to_text(new_text)
+        if instance_num is DEFAULT:
+            return _map_text(text, None, lambda column: np.char.replace(column, old_text, new_text))
+        return _map_text(
+            text,
+            None,
+            lambda column: utils.map_distinct(lambda t: _substitute(t, old_text, new_text, instance_num), column),
+        )
+    if not text or not old_text:
         return text
+    return _substitute(text, old_text, utils.to_text(new_text), instance_num)
 
 
 @dispatcher.register_for('TEXTJOIN')
 def TEXTJOIN(delimiter, ignore_empty, *args):
     if not isinstance(delimiter, string_types):
         return error.VALUE
+    if isinstance(ignore_empty, torch.Tensor):
+        ignore_empty = bool(ignore_empty.any())
+    parts = utils.flatten(args)
+    i = _encoded_part(parts)
+    if i is not None:
+        return parts[i].map(
+            lambda dictionary: TEXTJOIN(delimiter, ignore_empty, *(parts[:i] + [dictionary] + parts[i + 1:]))
+        )
+    parts, columnar = _text_parts(args)
+    if columnar:
+        result = parts[0]
+        for part in parts[1:]:
+            if ignore_empty:
+                # only put the delimiter between two non empty texts of the row
+                separator = np.where((np.char.str_len(result) > 0) & (np.char.str_len(part) > 0), delimiter, '')
+                result = np.char.add(np.char.add(result, separator), part)
+            else:
+                result = np.char.add(np.char.add(result, delimiter), part)
+        return result
     if ignore_empty:
-        gen = (words for words in utils.iflatten(args) if words is not None)
+        gen = (words for words in parts if words is not None)
     else:
-        gen = (words if words is not None else '' for words in utils.iflatten(args))
-    return delimiter.join(gen)
+        gen = (words if words is not None else '' for words in parts)
+    return delimiter.join(utils.to_text(words) for words in gen)
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import re
-import fnmatch
+import collections
+import functools
+import math
 import itertools
 from .._compat import number_types, string_types
 from ..helper.number import to_number
+from ..backends import current_backend
+from ..context import current_context, current_precision, float_dtype, number_dtype
+from ..dictionary import DictionaryArray
 import operator
 from . import error
 import datetime
 import torch
+import numpy as np
 import time
 from dateutil.parser import parse as to_date
 
@@ -18,17 +24,84 @@
     "+": operator.add,
     "-": operator.sub,
     "*": operator.mul,
-    "/": operator.truediv,
+    "/": lambda a, b: divide(a, b),
     ">": operator.gt,
     "<": operator.lt,
     "<>": operator.ne,
     "=": operator.eq,
     ">=": operator.ge,
     "<=": operator.le,
-    "^": lambda a, b: torch.float_power(torch.tensor(a), torch.tensor(b)),
+    "^": lambda a, b: power(a, b),
 }
 
-REGEX_CRITERIA = re.compile(r'(?P<op>[\<\>\=]*)(?P<val>[\w\d\s\.\*\?]+)', re.UNICODE)
+
+
+def divide(a, b):
+    """ a / b, with a precision policy integer and logical columns are divided in its floating point dtype """
+    if current_precision() is not None:
+        backend = current_backend()
+        if backend.is_array(a) and not backend.is_floating(a):
+            a = backend.astype(a, float_dtype())
+        if backend.is_array(b) and not backend.is_floating(b):
+            b = backend.astype(b, float_dtype())
+    return a / b
+
+
+def scalar_power(base, exponent):
+    """ base ** exponent like floating point pow, an overflow is infinite and a complex result NaN """
+    base, exponent = float(base), float(exponent)
+    try:
+        return math.pow(base, exponent)
+    except OverflowError:
+        odd = exponent.is_integer() and exponent % 2 == 1
+        return -math.inf if base < 0 and odd else math.inf
+    except ValueError:
+        # zero to a negative power is infinite
+        return math.inf if base == 0 else math.nan
+
+
+def power(base, exponent):
+    """ excel's ^, in integers when the precision policy keeps them and no exponent is negative """
+    if isinstance(base, (int, float)) and isinstance(exponent, (int, float)) and current_precision() is None:
+        # plain numbers, like a single row, don't need tensors
+        return scalar_power(base, exponent)
+    base = as_tensor(base)
+    exponent = as_tensor(exponent)
+    dtype = number_dtype(base, exponent)
+    if dtype != torch.int64 or bool((exponent < 0).any()):
+        dtype = float_dtype()
+    return current_backend().power(base, exponent, dtype)
+
+
+DATE_CACHE_SIZE = 65536
+DATE_SAMPLE_SIZE = 64
+# Formats tried, in order, when inferring the format of a column of date strings.
+# Month first comes before day first just like dateutil.
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%d/%m/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d-%b-%Y',
+    '%d %b %Y',
+    '%d %B %Y',
+    '%b %d, %Y',
+    '%B %d, %Y',
+    '%Y%m%d',
+)
+
+REGEX_CRITERIA = re.compile(r'^(?P<op><>|<=|>=|<|>|=)?(?P<val>.*)$', re.UNICODE | re.DOTALL)
+REGEX_WILDCARD = re.compile(r'(~[*?~]|[*?])')
+WILDCARDS = {'*': '.*', '?': '.'}
+CRITERIA_CACHE_SIZE = 1024
 
 
 def iflatten(iterable):
@@ -88,27 +161,415 @@ def iparse_number_array(arr):
     return iparse_number_array_aux(arr)
 
 
+def wildcard_to_regex(pattern):
+    """ Translates an excel wildcard pattern, where ~ escapes * and ?, to a compiled regex """
+    def translate(piece, is_wildcard):
+        if not is_wildcard:
+            return re.escape(piece)
+        return WILDCARDS.get(piece) or re.escape(piece[1])
+    # splitting on a capturing group alternates literal text and wildcards
+    pieces = REGEX_WILDCARD.split(pattern)
+    regex = ''.join(translate(piece, i % 2 == 1) for i, piece in enumerate(pieces))
+    return re.compile(regex, re.IGNORECASE | re.DOTALL | re.UNICODE)
+
+
+class Criteria(object):
+    """
+    A COUNTIF style criteria compiled once, it can test a single value or build a
+    boolean mask over a whole column at once.
+    """
+
+    def __init__(self, criteria):
+        # "=" and "<>" alone only tell empty cells apart, an empty criteria also matches empty text
+        self.blank_only = False
+        if isinstance(criteria, string_types):
+            match = REGEX_CRITERIA.match(criteria)
+            self.op = match.group('op') or '='
+            value = to_number(match.group('val'))
+            self.blank_only = match.group('op') in ('=', '<>') and value == ''
+            if isinstance(value, string_types) and value.upper() in ('TRUE', 'FALSE'):
+                value = value.upper() == 'TRUE'
+        else:
+            self.op = '='
+            value = to_number(criteria)
+        self.value = value
+        # TRUE and FALSE only match logical cells
+        self.is_logical = isinstance(value, bool)
+        self.is_number = isinstance(value, number_types) and not self.is_logical
+        self.pattern = None
+        if not (self.is_number or self.is_logical):
+            value = '' if value is None else str(value)
+            self.value = value.lower()
+            if self.op in ('=', '<>') and REGEX_WILDCARD.search(value):
+                self.pattern = wildcard_to_regex(value)
+
+    def _match_text(self, text):
+        if self.pattern is not None:
+            result = self.pattern.fullmatch(text) is not None
+            return result if self.op == '=' else not result
+        return OPERATOR_DICT[self.op](text.lower(), self.value)
+
+    def __call__(self, value):
+        if self.blank_only:
+            return (value is None) == (self.op == '=')
+        if isinstance(value, bool):
+            if self.is_logical:
+                return bool(OPERATOR_DICT[self.op](value, self.value))
+            return self.op == '<>'
+        if self.is_logical:
+            return self.op == '<>'
+        if value is None or isinstance(value, error.XLError):
+            if value is None and not self.is_number:
+                return self._match_text('')
+            return self.op == '<>'
+        if isinstance(value, number_types):
+            if self.is_number:
+                return bool(OPERATOR_DICT[self.op](value, self.value))
+            return self.op == '<>'
+        if isinstance(value, string_types):
+            if self.is_number:
+                return self.op == '<>'
+            return self._match_text(value)
+        return False
+
+    def _text_mask(self, values):
+        if self.is_number or self.is_logical or self.blank_only:
+            # text is never a number, logical or empty cell
+            return np.full(values.shape, self.op == '<>')
+        if self.pattern is None:
+            return OPERATOR_DICT[self.op](np.char.lower(values), self.value)
+        # The regex only runs once for each distinct value
+        distinct, inverse = np.unique(values, return_inverse=True)
+        matched = np.fromiter((self._match_text(text) for text in distinct), dtype=bool, count=len(distinct))
+        return matched[inverse.reshape(values.shape)]
+
+    def mask(self, values):
+        """ A boolean tensor telling which elements of values meet the criteria """
+        if isinstance(values, DictionaryArray):
+            return values.map(self.mask)
+        if isinstance(values, torch.Tensor):
+            logical = values.dtype == torch.bool
+            if self.is_logical and logical:
+                return OPERATOR_DICT[self.op](values, self.value)
+            if not self.is_number or logical:
+                return torch.full(values.shape, self.op == '<>', dtype=torch.bool)
+            return OPERATOR_DICT[self.op](values, self.value)
+        if isinstance(values, np.ndarray):
+            if values.dtype.kind in 'US':
+                return torch.from_numpy(np.ascontiguousarray(self._text_mask(values)))
+            if values.dtype.kind in 'biuf':
+                return self.mask(torch.from_numpy(values))
+            # object arrays hold the cells themselves, blanks among them
+            values = values.tolist()
+        return torch.tensor([self(value) for value in iflatten(values)], dtype=torch.bool)
+
+
+@functools.lru_cache(maxsize=CRITERIA_CACHE_SIZE)
+def _compile_criteria(criteria):
+    return Criteria(criteria)
+
+
 def parse_criteria(criteria):
-    match = REGEX_CRITERIA.match(criteria)
-    op = match.group('op')
-    val = match.group('val')
-    if op:
-        val = to_number(val)
-        op = OPERATOR_DICT[op]
-        return lambda a: op(a, val)
-    else:
-        if any(c in val for c in ('?', '*')):
-            # Then use fnmatch
-            return lambda a: fnmatch.fnmatch(val, a)
+    if isinstance(criteria, torch.Tensor):
+        # literals arrive broadcast to the size of the batch
+        values = criteria.unique()
+        if len(values) != 1:
+            return error.VALUE
+        criteria = values.item()
+    if isinstance(criteria, error.XLError):
+        return criteria
+    return _compile_criteria(criteria)
+
+
+def criteria_range(values):
+    """ Flattens a range argument to a column a criteria mask can be computed on """
+    if isinstance(values, (torch.Tensor, np.ndarray, DictionaryArray)):
+        return values.reshape(-1)
+    values = flatten(values)
+    if values and all(isinstance(v, number_types) and not isinstance(v, bool) for v in values):
+        return torch.as_tensor(values)
+    return values
+
+
+def criteria_mask(values, criteria):
+    """
+    Mask of the elements of values that meet criteria. Formulas evaluated in the
+    same context that test the same range with the same criteria share the mask.
+    """
+    predicate = parse_criteria(criteria)
+    if isinstance(predicate, error.XLError):
+        return predicate
+    compute = lambda: predicate.mask(criteria_range(values))
+    context = current_context()
+    if context is None:
+        return compute()
+    return context.cached(('criteria', id(values), id(predicate)), (values, predicate), compute)
+
+
+def fused_criteria_mask(ranges_and_criteria):
+    """ ANDs the masks of every range, criteria pair as used by COUNTIFS and the like """
+    if not ranges_and_criteria or len(ranges_and_criteria) % 2:
+        return error.VALUE
+    mask = None
+    for values, criteria in zip(ranges_and_criteria[::2], ranges_and_criteria[1::2]):
+        criteria_values = criteria_mask(values, criteria)
+        if isinstance(criteria_values, error.XLError):
+            return criteria_values
+        if mask is None:
+            mask = criteria_values
+        elif mask.shape != criteria_values.shape:
+            return error.VALUE
         else:
-            return lambda a: a == to_number(val)
+            mask = mask & criteria_values
+    return mask
+
+
+def numeric_range(values):
+    """ Flattens a range argument to a double column where anything that isn't a number counts as 0 """
+    if isinstance(values, torch.Tensor):
+        return values.reshape(-1).to(float_dtype())
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        return torch.from_numpy(values).reshape(-1).to(float_dtype())
+    return torch.tensor([
+        v if isinstance(v, number_types) and not isinstance(v, bool) else 0
+        for v in iflatten(values.tolist() if isinstance(values, np.ndarray) else values)
+    ], dtype=float_dtype())
 
 
 def any_is_error(iterable):
     return any(isinstance(el, error.XLError) for el in iterable)
 
 
+# the numbers ERROR.TYPE gives the excel errors, the rows of numeric columns keep their error by it
+ERROR_CODES = {
+    error.NULL: 1,
+    error.DIV_ZERO: 2,
+    error.VALUE: 3,
+    error.REF: 4,
+    error.NAME: 5,
+    error.NUM: 6,
+    error.NOT_AVAILABLE: 7,
+    error.DATA: 8,
+}
+
+
+def error_code(err):
+    """ The ERROR.TYPE number of an excel error, errors without one are #VALUE! """
+    return ERROR_CODES.get(err, ERROR_CODES[error.VALUE])
+
+
+def mask_errors(values, mask, err):
+    """
+    Sends the rows selected by mask down the per-row error path, they become NaN
+    or, in text columns, the excel error itself. When the whole result is in
+    error the excel error is returned instead.
+    """
+    if mask.ndim == 0:
+        return err if mask else values
+    if isinstance(values, np.ndarray):
+        mask = np.asarray(mask)
+        if not mask.any():
+            return values
+        values = values.astype(object)
+        values[mask] = err
+        return values
+    if current_context() is None:
+        return torch.where(mask, torch.full_like(values, float('nan')), values)
+    mask = torch.as_tensor(mask)
+    return mask_error_codes(values, torch.where(mask, error_code(err), row_error_codes(values)))
+
+
+def fill_rows(values, mask, fallback):
+    """
+    The column values with fallback, a single value or a column, on the rows
+    selected by the bool tensor mask. The other rows keep their errors.
+    """
+    if mask.ndim == 0:
+        return fallback if mask else values
+    if not mask.any():
+        return values
+    if isinstance(fallback, error.XLError):
+        return mask_errors(values, mask if isinstance(values, torch.Tensor) else mask.numpy(), fallback)
+    if isinstance(values, torch.Tensor) and not (isinstance(fallback, string_types) or is_text_array(fallback)):
+        filled = torch.where(mask, as_tensor(fallback, float_dtype()), values)
+        fallback_codes = row_error_codes(fallback) if isinstance(fallback, torch.Tensor) else 0
+        return mask_error_codes(filled, torch.where(mask, fallback_codes, row_error_codes(values)))
+    if is_text_array(values) and isinstance(fallback, string_types):
+        return np.where(mask.numpy(), fallback, np.asarray(values))
+    if isinstance(fallback, torch.Tensor):
+        fallback = fallback.numpy()
+    if isinstance(values, torch.Tensor):
+        codes = row_error_codes(values)
+        values = np.where(codes.numpy() != 0, code_errors(codes), values.numpy().astype(object))
+    return np.where(mask.numpy(), np.asarray(fallback, dtype=object), np.asarray(values, dtype=object))
+
+
+def mask_error_codes(values, codes):
+    """
+    The numeric column values with NaN on the rows whose ERROR.TYPE code isn't
+    0, the active evaluation context keeps the codes for row_error_codes.
+    """
+    result = torch.where(codes != 0, torch.full_like(values, float('nan')), values)
+    context = current_context()
+    if context is not None:
+        # anchored to the result, an id only names the same column while it is alive
+        context.row_errors[id(result)] = (result, codes)
+    return result
+
+
+def row_error_codes(values):
+    """
+    The ERROR.TYPE code of each row of a numeric column, 0 on the rows that
+    aren't in error. NaN rows whose code wasn't kept by mask_errors, like those
+    of arithmetic on a column in error, are #VALUE!.
+    """
+    context = current_context()
+    entry = None if context is None else context.row_errors.get(id(values))
+    if entry is not None and entry[0] is values:
+        return entry[1]
+    if not values.is_floating_point():
+        return torch.zeros(values.shape, dtype=torch.int8)
+    return torch.isnan(values).to(torch.int8) * ERROR_CODES[error.VALUE]
+
+
+def code_errors(codes):
+    """ An object array of the excel error of each ERROR.TYPE code, None for 0 """
+    errors = {code: err for err, code in ERROR_CODES.items()}
+    return np.frompyfunc(errors.get, 1, 1)(codes.numpy()).astype(object)
+
+
+def object_error_codes(values):
+    """ The ERROR.TYPE code of each element of an object array, 0 for the ones that aren't an excel error """
+    codes = np.frompyfunc(lambda value: error_code(value) if isinstance(value, error.XLError) else 0, 1, 1)(values)
+    return torch.from_numpy(np.asarray(codes, dtype=np.int8))
+
+
+def as_tensor(value, dtype=None):
+    """
+    value as a tensor. Tensors and numeric numpy arrays are used as they are,
+    without a copy unless they have to change dtype, and python numbers take
+    the dtype of the precision policy.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        value = torch.from_numpy(value)
+    if isinstance(value, torch.Tensor):
+        return value if dtype is None else value.to(dtype)
+    if dtype is None and isinstance(value, (int, float)) and not isinstance(value, bool):
+        dtype = number_dtype(value)
+    return torch.as_tensor(value, dtype=dtype)
+
+
+def is_column(value):
+    """ Tensors and arrays with at least one dimension hold a value per row """
+    return isinstance(value, (torch.Tensor, np.ndarray, DictionaryArray)) and value.ndim > 0
+
+
+def format_number(number):
+    """ excel's general format for a number converted to text """
+    if isinstance(number, bool):
+        return 'TRUE' if number else 'FALSE'
+    number = float(number)
+    if number.is_integer() and abs(number) < 1e15:
+        return str(int(number))
+    return '%.15g' % number
+
+
+def to_text(value):
+    """ The text excel shows for a single value """
+    if value is None:
+        return ''
+    if isinstance(value, string_types):
+        return value
+    if isinstance(value, (bool, int, float)) or (isinstance(value, torch.Tensor) and value.ndim == 0):
+        return format_number(value.item() if isinstance(value, torch.Tensor) else value)
+    if isinstance(value, datetime.datetime):
+        return format_number(serialize_date(value))
+    return str(value)
+
+
+def number_to_text(numbers):
+    """ Vectorized format_number """
+    if isinstance(numbers, torch.Tensor):
+        numbers = numbers.numpy()
+    if numbers.dtype.kind == 'b':
+        return np.where(numbers, 'TRUE', 'FALSE')
+    numbers = numbers.astype(np.float64, copy=False)
+    integral = np.isfinite(numbers) & (numbers == np.round(numbers)) & (np.abs(numbers) < 1e15)
+    text = np.empty(numbers.shape, dtype='U24')
+    text[integral] = numbers[integral].astype(np.int64).astype('U')
+    if not integral.all():
+        text[~integral] = np.char.mod('%.15g', numbers[~integral])
+    return text
+
+
+def text_column(values):
+    """
+    The text column of values and a mask of the rows that hold an excel error
+    (None when no row does), those rows become empty strings in the column.
+    """
+    if isinstance(values, DictionaryArray):
+        return values.decode().astype('U', copy=False), None
+    if is_text_array(values):
+        return values.astype('U', copy=False), None
+    if isinstance(values, torch.Tensor) or (isinstance(values, np.ndarray) and values.dtype.kind in 'biuf'):
+        return number_to_text(values), None
+    values = np.asarray(values, dtype=object)
+    errors = np.frompyfunc(lambda value: isinstance(value, error.XLError), 1, 1)(values).astype(bool)
+    text = np.frompyfunc(lambda value: '' if isinstance(value, error.XLError) else to_text(value), 1, 1)(values)
+    return text.astype('U'), (errors if errors.any() else None)
+
+
+def restore_errors(values, original, errors):
+    """ Puts back into values the per-row errors text_column took out of original """
+    if errors is None:
+        return values
+    if isinstance(values, torch.Tensor):
+        # numeric results keep the numeric per-row error path
+        codes = object_error_codes(np.asarray(original, dtype=object))
+        return mask_error_codes(values.to(float_dtype()), torch.where(codes != 0, codes, row_error_codes(values)))
+    values = np.asarray(values).astype(object)
+    values[errors] = np.asarray(original, dtype=object)[errors]
+    return values
+
+
+def map_distinct(fn, values, otypes='U'):
+    """ Applies fn to each distinct value of an array only once and gathers the results back """
+    distinct, inverse = np.unique(values, return_inverse=True)
+    results = np.array([fn(value) for value in distinct], dtype=otypes)
+    return results[inverse.reshape(values.shape)]
+
+
+class LRUCache(object):
+    """ A mapping that forgets the least recently used keys once it holds more than maxsize """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+
+date_cache = LRUCache(DATE_CACHE_SIZE)
 date_1900 = datetime.datetime(1900, 1, 1)
+# days from 1970-01-01 back to 1900-01-01, excel's serial number 1
+SERIAL_EPOCH_OFFSET = 25568
 epoch = datetime.datetime(1970, 1, 1)
 
 
@@ -132,11 +593,169 @@ def parse_date(date):
             return epoch + datetime.timedelta(seconds=(epoch_seconds(date_1900) + (d - 1) * 86400))
         return epoch + datetime.timedelta(seconds=(epoch_seconds(date_1900) + (d - 2) * 86400))
     if isinstance(date, string_types):
+        return parse_date_string(date)
+    return error.VALUE
+
+
+def parse_date_string(string):
+    """ dateutil's parse with the results, errors included, kept in date_cache """
+    date = date_cache.get(string)
+    if date is None:
+        try:
+            date = to_date(string).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            date = error.VALUE
+        date_cache[string] = date
+    return date
+
+
+def infer_date_format(strings):
+    """ The format of DATE_FORMATS most of strings parse with or None when no format parses half of them """
+    best_format, best_count = None, len(strings) / 2
+    for date_format in DATE_FORMATS:
+        count = 0
+        for string in strings:
+            try:
+                datetime.datetime.strptime(string, date_format)
+                count += 1
+            except ValueError:
+                pass
+        if count > best_count:
+            best_format, best_count = date_format, count
+            if count == len(strings):
+                break
+    return best_format
+
+
+def _parse_date_strings(strings, date_format):
+    if date_format is not None and date_format.startswith('%Y-%m-%d'):
+        # numpy parses iso dates in bulk, an empty string is NaT
         try:
-            return to_date(date)
+            return strings.astype('datetime64[s]')
         except ValueError:
             pass
-    return error.VALUE
+    dates = np.empty(len(strings), dtype='datetime64[s]')
+    for i, string in enumerate(strings):
+        date = date_cache.get(string)
+        if date is None and date_format is not None:
+            try:
+                date = datetime.datetime.strptime(string, date_format)
+                date_cache[string] = date
+            except ValueError:
+                pass
+        if date is None:
+            # only the outliers pay for dateutil
+            date = parse_date_string(string)
+        dates[i] = np.datetime64('NaT') if isinstance(date, error.XLError) else date
+    return dates
+
+
+def datetime64_to_serial(dates):
+    """ Vectorized serialize_date, NaT becomes NaN """
+    seconds = dates.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    days = seconds / 86400
+    serial = days + SERIAL_EPOCH_OFFSET + np.where(days <= -25508, 0, 1)
+    serial[days == -SERIAL_EPOCH_OFFSET + 1] = 0
+    serial[np.isnat(dates)] = np.nan
+    return serial
+
+
+def is_text_array(value):
+    return isinstance(value, (np.ndarray, DictionaryArray)) and value.dtype.kind in 'US'
+
+
+def parse_date_array(strings):
+    """
+    Serial numbers of an array of date strings, NaN where a string isn't a date.
+    The format of the column is inferred from a sample so most strings take a
+    fixed format path and every distinct string is only parsed once.
+    """
+    if isinstance(strings, DictionaryArray):
+        return strings.map(parse_date_array)
+    strings = np.asarray(strings, dtype='U')
+    distinct, inverse = np.unique(strings, return_inverse=True)
+    sample = [string for string in distinct[:DATE_SAMPLE_SIZE] if string]
+    serials = datetime64_to_serial(_parse_date_strings(distinct, infer_date_format(sample)))
+    return torch.from_numpy(serials[inverse.reshape(strings.shape)])
+
+
+def parse_text_array(strings):
+    """ The numbers an array of strings spell, dates become serial numbers and anything else NaN """
+    if isinstance(strings, DictionaryArray):
+        return strings.map(parse_text_array)
+    strings = np.asarray(strings, dtype='U')
+    try:
+        return torch.from_numpy(strings.astype(np.float64))
+    except ValueError:
+        pass
+    distinct, inverse = np.unique(strings, return_inverse=True)
+    numbers = np.full(len(distinct), np.nan)
+    is_text = np.ones(len(distinct), dtype=bool)
+    for i, string in enumerate(distinct):
+        number = to_number(string)
+        if isinstance(number, (int, float)):
+            numbers[i] = number
+            is_text[i] = False
+    if is_text.any():
+        numbers[is_text] = parse_date_array(distinct[is_text]).numpy()
+    return torch.from_numpy(numbers[inverse.reshape(strings.shape)])
+
+
+def parse_serial(value):
+    """ The excel serial number of value as a tensor, tensors are taken to be serial numbers already """
+    if isinstance(value, torch.Tensor):
+        return value
+    if isinstance(value, error.XLError):
+        return value
+    if is_text_array(value):
+        return parse_date_array(value)
+    number = to_number(value)
+    if isinstance(number, number_types) and not isinstance(number, datetime.datetime):
+        return torch.as_tensor(number, dtype=torch.double)
+    serial = serialize_date(value)
+    if isinstance(serial, error.XLError):
+        return serial
+    return torch.tensor(serial, dtype=torch.double)
+
+
+def _split_serial(serial):
+    """ Whole days since 1970-01-01 and seconds into the day of excel serial numbers """
+    serial = torch.as_tensor(serial, dtype=torch.double)
+    invalid = (serial < 0) | ~torch.isfinite(serial)
+    seconds = torch.round(torch.where(invalid, 0, serial) * 86400).long()
+    day = torch.div(seconds, 86400, rounding_mode='floor')
+    # same 1900 leap year bug handling as parse_date: serial 0 is 1900-01-01 and
+    # there is no day for the 29th of february 1900 so every later serial skips one
+    day = day - SERIAL_EPOCH_OFFSET - 1 + (day <= 60).long() + (day == 0).long()
+    return day, seconds % 86400, invalid
+
+
+def serial_to_civil(serial):
+    """
+    Year, month and day tensors of excel serial numbers plus a mask of the invalid ones.
+    It's Howard Hinnant's civil_from_days done with integer tensor operations.
+    """
+    days, _, invalid = _split_serial(serial)
+    z = days + 719468
+    era = torch.div(z, 146097, rounding_mode='floor')
+    day_of_era = z - era * 146097
+    year_of_era = torch.div(
+        day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096,
+        365,
+        rounding_mode='floor',
+    )
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153  # march is 0
+    day = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    month = torch.where(shifted_month < 10, shifted_month + 3, shifted_month - 9)
+    year = year_of_era + era * 400 + (month <= 2).long()
+    return year, month, day, invalid
+
+
+def serial_to_time(serial):
+    """ Hour, minute and second tensors of excel serial numbers plus a mask of the invalid ones """
+    _, seconds, invalid = _split_serial(serial)
+    return seconds // 3600, (seconds // 60) % 60, seconds % 60, invalid
 
 
 def serialize_date(date):
@@ -6,7 +6,9 @@
 from . import lexer
 from ..helper.number import to_number
 from .._compat import PY2, number_types, string_types
-from ..formulas import error, operators
+from ..arena import BufferSite, plan_buffers
+from ..context import current_context
+from ..formulas import error, operators, is_volatile
 import math
 import os
 
@@ -38,6 +40,11 @@ def __init__(self, debug=False, call_function=None, call_variable=None,
         self.call_range_value = call_range_value
         self.throw_error = throw_error
         self.names = {}
+        # whether the closures of the expressions parsed share the values of equal subexpressions, see node
+        self.share_subexpressions = False
+        # names of the variables and functions the last parsed expression refers to
+        self.variables = set()
+        self.functions = set()
         try:
             modname = os.path.split(os.path.splitext(__file__)[0])[1] + \
                 "_" + self.__class__.__name__
@@ -48,13 +55,39 @@ def __init__(self, debug=False, call_function=None, call_variable=None,
 
         # Build the lexer and parser
         lex.lex(module=lexer, debug=self.debug)
-        yacc.yacc(module=self,
-                  debug=self.debug,
-                  debugfile=self.debugfile,
-                  tabmodule=self.tabmodule)
+        self.yacc = yacc.yacc(module=self,
+                              debug=self.debug,
+                              debugfile=self.debugfile,
+                              tabmodule=self.tabmodule)
+
+    def node(self, p, fn, volatile=False, site=None, holds_parts=False):
+        """
+        fn, the closure of the rule p was reduced by, keyed by the structure of its
+        expression, which is built from the keys of its parts. Expressions with the
+        same key are the same expression and, when subexpressions are shared, are
+        only evaluated once by a FormulaSet unless they call a volatile function.
+        The parts, the site of an operator or function call and whether the value
+        holds the values of the parts, like a list of arguments, are kept for
+        arena.plan_buffers.
+        """
+        if not callable(fn):
+            return fn
+        parts = [p[i] for i in range(1, len(p))]
+        fn.key = (p.slice[0].type,) + tuple(_key(part) for part in parts)
+        fn.volatile = volatile or any(getattr(part, 'volatile', False) for part in parts)
+        fn.parts = parts
+        fn.site = site
+        fn.holds_parts = holds_parts
+        if not self.share_subexpressions or fn.volatile:
+            return fn
+        return _shared(fn)
 
     def parse(self, input):
-        return yacc.parse(input)  # add debug=True for testing
+        self.variables = set()
+        self.functions = set()
+        result = self.yacc.parse(input)  # add debug=True for testing
+        plan_buffers(result)
+        return result
 
     def run(self):
         while 1:
@@ -67,6 +100,33 @@ def run(self):
         print(self.parse(s))
 
 
+def _key(part):
+    """ The key of a part of a rule, closures have the key of their expression and tokens are their text """
+    if isinstance(part, list):
+        return tuple(_key(item) for item in part)
+    return getattr(part, 'key', part)
+
+
+def _shared(fn):
+    """ fn evaluated once per key while the active evaluation context shares subexpressions """
+    def node(args):
+        context = current_context()
+        values = None if context is None else context.shared
+        if values is None:
+            return fn(args)
+        if fn.key not in values:
+            values[fn.key] = fn(args)
+        return values[fn.key]
+    node.key = fn.key
+    node.volatile = fn.volatile
+    node.parts = fn.parts
+    node.site = fn.site
+    node.holds_parts = fn.holds_parts
+    # read by other expressions too, see arena.plan_buffers
+    node.shared = True
+    return node
+
+
 class FormulaParser(Parser):
 
     def p_expressions(self, p):
@@ -94,11 +154,15 @@ def p_expression_arithmetic_operator(self, p):
                   | expression CARET expression_paren
                   | expression CARET expression
         """
+        site = None
         if p[2] == '&':
-            p[0] = lambda args, p1=p[1], p3=p[3]: str(p1(args)) + str(p3(args))
+            p[0] = lambda args, p1=p[1], p3=p[3]: \
+                operators.evaluate_concatenation(p1(args), p3(args))
         else:
-            p[0] = lambda args, p1=p[1], p2=p[2], p3=p[3]: \
-                operators.evaluate_arithmetic(p2, p1(args), p3(args))
+            site = BufferSite('operator')
+            p[0] = lambda args, p1=p[1], p2=p[2], p3=p[3], site=site: \
+                operators.evaluate_arithmetic(p2, p1(args), p3(args), site)
+        p[0] = self.node(p, p[0], site=site)
 
     def p_expression_implicit_multiplication(self, p):
         """
@@ -108,7 +172,7 @@ def p_expression_implicit_multiplication(self, p):
         """
         p1 = p[1]
         p2 = p[2]
-        p[0] = lambda args: p1(args) * p2(args)
+        p[0] = self.node(p, lambda args: p1(args) * p2(args))
 
     def p_expression_logical_operator(self, p):
         """
@@ -121,12 +185,13 @@ def p_expression_logical_operator(self, p):
         """
         p[0] = lambda args, p1=p[1], p2=p[2], p3=p[3]: \
             operators.evaluate_logic(p2, p1(args), p3(args))
+        p[0] = self.node(p, p[0])
 
 
     def p_expression_uminus(self, p):
         'expression : MINUS expression %prec UMINUS'
         p2 = p[2]
-        p[0] = lambda args: -p2(args)
+        p[0] = self.node(p, lambda args: -p2(args))
 
     def p_expression_decimal_number(self, p):
         """
@@ -147,6 +212,7 @@ def p_expression_decimal_number(self, p):
                 p[0] = lambda args, p1=p[1]: to_number(p1, args)
         elif p[2] == '^':
             p[0] = lambda args, p1=p[1], p3=p[3]: to_number(p1, args)**to_number(p3, args)
+        p[0] = self.node(p, p[0])
 
     def p_expression_number(self, p):
         """
@@ -163,18 +229,22 @@ def p_expression_number(self, p):
             p[0] = lambda args, p1=p[1], p3=p[3]: p1(args) * (10 ** p3(args))
         if len(p) == 5:  # expression_decimal_number SCIENTIFIC_NOTATION_E MINUS expression_decimal_number
             p[0] = lambda args, p1=p[1], p4=p[4]: p1(args) * (10 ** -p4(args))
+        if len(p) > 2:
+            p[0] = self.node(p, p[0])
 
     def p_expression_string(self, p):
         """
         expression : STRING
         """
-        p[0] = lambda args, p1=p[1]: p1[1:-1]
+        p[0] = self.node(p, lambda args, p1=p[1]: p1[1:-1])
 
     def p_expression_function(self, p):
         """
         expression : FUNCTION LPAREN RPAREN
         """
-        p[0] = lambda args, p1=p[1]: self.call_function(p1)
+        self.functions.add(p[1])
+        site = BufferSite('call')
+        p[0] = self.node(p, lambda args, p1=p[1], site=site: self.call_function(p1, site=site), is_volatile(p[1]), site)
 
     def p_expression_wargs(self, p):
         """
@@ -182,13 +252,21 @@ def p_expression_wargs(self, p):
                    | FUNCTION LPAREN expseqsemicolon RPAREN
                    | FUNCTION LPAREN expseqbackslash RPAREN
         """
-        p[0] = lambda args, p1=p[1], p3=p[3]: self.call_function(p1, p3(args))
+        self.functions.add(p[1])
+        site = BufferSite('call')
+        p[0] = self.node(
+            p, lambda args, p1=p[1], p3=p[3], site=site: self.call_function(p1, p3(args), site), is_volatile(p[1]), site
+        )
 
     def p_expression_3args(self, p):
         """
         expression : FUNCTION_3ARGS LPAREN expression COMMA expression COMMA expression RPAREN
         """
-        p[0] = lambda args, p1=p[1], p3=p[3], p5=p[5], p7=p[7]: self.call_function(p1, [p3(args), p5(args), p7(args)])
+        self.functions.add(p[1])
+        site = BufferSite('call')
+        p[0] = lambda args, p1=p[1], p3=p[3], p5=p[5], p7=p[7], site=site: \
+            self.call_function(p1, [p3(args), p5(args), p7(args)], site)
+        p[0] = self.node(p, p[0], is_volatile(p[1]), site)
 
     # TODO: This function is not migrated yet
     def p_expression_array(self, p):
@@ -235,6 +313,7 @@ def p_expseq_semicolon(self, p):
                     p[0] = lambda args, p1=p[1], p3=p[3]: [p1(args)] + [p3(args)]
                 else:
                     p[0] = lambda args, p1=p[1], p3=p[3]: p1(args) + [p3(args)]
+        p[0] = self.node(p, p[0], holds_parts=True)
 
     def p_expseq_comma(self, p):
         """
@@ -260,6 +339,7 @@ def p_expseq_comma(self, p):
                 p[0] = lambda args, p1=p[1], p4=p[4]: p1(args) + [None, p4(args)]
             else:
                 p[0] = lambda args, p1=p[1], p3=p[3]: p1(args) + [p3(args)]
+        p[0] = self.node(p, p[0], holds_parts=True)
 
 
     # TODO: This function is not migrated yet
@@ -315,7 +395,8 @@ def p_expression_varseq(self, p):
         """
         expression : variable_sequence
         """
-        p[0] = lambda vars, name=p[1][0]: self.call_variable(name, vars)
+        self.variables.add(p[1][0])
+        p[0] = self.node(p, lambda vars, name=p[1][0]: self.call_variable(name, vars))
 
     def p_variable(self, p):
         """
@@ -355,4 +436,5 @@ def p_cell(self, p):
              | MIXED_CELL COLON RELATIVE_CELL
              | MIXED_CELL COLON MIXED_CELL
         """
-        p[0] = lambda args, p1=p[1]: self.call_variable(p1, args)
+        self.variables.add(p[1])
+        p[0] = self.node(p, lambda args, p1=p[1]: self.call_variable(p1, args))
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
-import torch
-
 from .._compat import number_types, string_types
+from ..backends import current_backend
+from ..context import current_precision, float_dtype
 
 def to_number_wrapper(number):
     if isinstance(number, number_types):
@@ -22,8 +22,12 @@ def to_number(number, args = None):
     number = to_number_wrapper(number)
     if args is not None:
         args_list = list(args.values())
-        if not (isinstance(number, torch.Tensor)) and len(args_list) > 0 and isinstance(args_list[0], torch.Tensor):
-            return torch.ones_like(args_list[0]) * number
+        backend = current_backend()
+        if not backend.is_array(number) and len(args_list) > 0 and backend.is_array(args_list[0]):
+            if current_precision() is not None and isinstance(number, float) and not backend.is_floating(args_list[0]):
+                # fractions broadcast over integer columns take the floating point dtype of the precision policy
+                return backend.broadcast(number, args_list[0], float_dtype())
+            return backend.broadcast(number, args_list[0])
     return number
 
 
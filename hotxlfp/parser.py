@@ -2,6 +2,9 @@
 from .tinyemitter import Emitter
 from . import formulas
 from .formulas import error as formulaserror
+from .formula import Formula, FormulaSet
+from .backends import check_backend, current_backend
+from .context import check_precision, current_context
 from .grammarparser.parser import FormulaParser
 from .helper.cell import extract_label, to_label, Cell
 import traceback
@@ -9,8 +12,12 @@
 
 class Parser(Emitter):
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, precision=None, backend=None):
         super(Parser, self).__init__()
+        # the precision policy of the formulas parsed, see context.PRECISIONS
+        self.precision = check_precision(precision)
+        # the array backend the formulas parsed compute with, see backends.BACKENDS
+        self.backend = check_backend(backend)
         self.variables = {'TRUE': True, 'FALSE': False, 'NULL': None}
         self.functions = {}
         self.debug = debug
@@ -29,6 +36,10 @@ def parse(self, expression):
                 result = ''
             else:
                 result = self.parser.parse(expression)
+                if callable(result):
+                    functions = self.parser.functions
+                    row_wise = not any(name in self.functions or not formulas.is_row_wise(name) for name in functions)
+                    result = Formula(expression, result, self.parser.variables, functions, row_wise, self.precision, self.backend)
         except Exception as e:
             if self.debug:
                 traceback.print_exc()
@@ -39,6 +50,23 @@ def parse(self, expression):
             result = None
         return {'result': result, 'error': error}
 
+    def parse_set(self, expressions):
+        """
+        Parses a dict of names to expressions into a FormulaSet that evaluates them
+        together. The error is a dict of the error of each expression that failed
+        to parse, None when they all parsed.
+        """
+        self.parser.share_subexpressions = True
+        try:
+            parsed = {name: self.parse(expression) for name, expression in expressions.items()}
+        finally:
+            self.parser.share_subexpressions = False
+        errors = {name: p['error'] for name, p in parsed.items() if p['error'] is not None}
+        if errors:
+            return {'result': None, 'error': errors}
+        formulas = {name: p['result'] for name, p in parsed.items()}
+        return {'result': FormulaSet(formulas, self.precision, self.backend), 'error': None}
+
     def set_function(self, name, f):
         self.functions[name] = f
         return self
@@ -46,7 +74,7 @@ def set_function(self, name, f):
     def get_function(self, name):
         return self.functions[name]
 
-    def call_function(self, name, args=None):
+    def call_function(self, name, args=None, site=None):
         if args is None:
             args = []
 
@@ -56,15 +84,43 @@ def call_function(self, name, args=None):
             fn = formulas.get_for(name)
         if fn is None:
             raise formulaserror.NAME
-        result['value'] = fn(*args)
+        context = current_context()
+        arena = None if context is None else context.arena
+        if arena is not None and (name in self.functions or self._e['callFunction']):
+            # custom functions and listeners may hold on to the arguments, their buffers can't be reused
+            arena.escape(args)
+        if context is not None and context.reducer is not None and formulas.reduces_rows(name) and name not in self.functions:
+            backend = current_backend()
+            result['value'] = backend.from_tensor(context.reducer.reduce(name, backend.to_tensor(args)))
+        elif name not in self.functions and self._takes_scalars(name, args, context):
+            result['value'] = formulas.get_scalar_for(name)(*args)
+        elif name not in self.functions:
+            # the formula library computes with torch whatever the backend
+            backend = current_backend()
+            result['value'] = backend.from_tensor(fn(*backend.to_tensor(args)))
+        else:
+            result['value'] = fn(*args)
 
         def valsetter(new_value):
             if new_value is not None:
                 result['value'] = new_value
 
         self.emit('callFunction', name, args, valsetter)
+        if arena is not None:
+            arena.returned(args, result['value'], site)
         return result['value']
 
+    @staticmethod
+    def _takes_scalars(name, args, context):
+        """
+        Whether the call runs the pure python version of the function, for arguments
+        that are all python numbers. Precision policies fix the dtypes of results
+        and keep the tensor versions.
+        """
+        if context is not None and context.precision is not None:
+            return False
+        return formulas.get_scalar_for(name) is not None and all(formulas.scalar.is_number(arg) for arg in args)
+
     def set_variable(self, name, v):
         self.variables[name] = v
         return self
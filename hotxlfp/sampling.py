@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Per-row random numbers for the volatile functions. Rows draw from generators
+seeded per block of rows, so what a row gets only depends on the seed, the
+position of the row in the whole dataset and which draw of the formula it is.
+Evaluating a dataset in chunks gives the same values as evaluating it at once:
+
+    formula(chunk, seed=42, row_offset=start)
+
+Simulations draw a number per scenario and row, scenario 0 draws what a plain
+evaluation would.
+"""
+import random
+import numpy as np
+import torch
+
+# rows drawn from the same generator
+BLOCK_SIZE = 4096
+
+
+def _block_seed(seed, draw, block):
+    """ A seed for the generator of a block of rows of a draw """
+    state = np.random.SeedSequence([seed, draw, block]).generate_state(2)
+    return (int(state[0]) << 31) ^ int(state[1])
+
+
+class RowSampler(object):
+    """
+    Draws random numbers for rows, rows is None when the formula has no columns
+    and each draw is then a single number. With scenarios each draw has a number
+    per scenario and row, flattened scenario by scenario. A seed of None picks a
+    random one.
+    """
+
+    def __init__(self, seed=None, rows=None, row_offset=0, scenarios=None):
+        self.seed = random.getrandbits(63) if seed is None else int(seed)
+        self.rows = rows
+        self.row_offset = int(row_offset)
+        self.scenarios = scenarios
+        self.draws = 0
+
+    def uniform(self):
+        """ A uniform double in [0, 1) for every row, each call is a new independent draw """
+        draw = self.draws
+        self.draws += 1
+        rows = 1 if self.rows is None else self.rows
+        scenarios = 1 if self.scenarios is None else self.scenarios
+        if not rows or not scenarios:
+            return torch.zeros(0, dtype=torch.double)
+        first = self.row_offset // BLOCK_SIZE
+        last = (self.row_offset + rows - 1) // BLOCK_SIZE
+        values = torch.cat([
+            torch.rand(
+                (scenarios, BLOCK_SIZE),
+                dtype=torch.double,
+                generator=torch.Generator().manual_seed(_block_seed(self.seed, draw, block)),
+            )
+            for block in range(first, last + 1)
+        ], -1)
+        start = self.row_offset - first * BLOCK_SIZE
+        values = values[:, start:start + rows]
+        if self.scenarios is not None:
+            return values.reshape(-1)
+        return values[0, 0].item() if self.rows is None else values[0]
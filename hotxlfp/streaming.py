@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental reducers for the functions that combine the rows of whole ranges,
+so a formula can be streamed over its rows a chunk at a time. Each call of such
+a function reduces its chunk to a partial result, partials of the same call in
+successive chunks are combined and the call returns the aggregate of every row
+seen so far:
+
+    for total in formula.stream(chunks):
+        ...
+"""
+import torch
+from .formulas import error, get_for, utils
+
+
+def _add(a, b):
+    if isinstance(a, tuple):
+        return tuple(_add(x, y) for x, y in zip(a, b))
+    return a + b
+
+
+def _call(name, *args):
+    return get_for(name)(*args)
+
+
+def _average_finish(partial):
+    total, count = partial
+    return error.DIV_ZERO if count == 0 else total / count
+
+
+def _extreme_combine(reduce):
+    def combine(a, b):
+        # chunks without a matching row don't take part
+        if a[1] == 0:
+            return b
+        if b[1] == 0:
+            return a
+        return reduce(torch.as_tensor(a[0]), torch.as_tensor(b[0])), a[1] + b[1]
+    return combine
+
+
+def _extreme_finish(partial):
+    return torch.tensor(0, dtype=utils.float_dtype()) if partial[1] == 0 else partial[0]
+
+
+def _identity(partial):
+    return partial
+
+
+# for each function that reduces rows, how a chunk is reduced to a partial result
+# given its arguments, how two partials combine and how a partial is finished
+REDUCERS = {
+    'SUMIF': (lambda *args: _call('SUMIF', *args), _add, _identity),
+    'SUMIFS': (lambda *args: _call('SUMIFS', *args), _add, _identity),
+    'COUNTIF': (lambda *args: _call('COUNTIF', *args), _add, _identity),
+    'COUNTIFS': (lambda *args: _call('COUNTIFS', *args), _add, _identity),
+    'AVERAGEIF': (
+        lambda values, criteria, average_range=None: (
+            _call('SUMIF', values, criteria, average_range), _call('COUNTIF', values, criteria)
+        ),
+        _add,
+        _average_finish,
+    ),
+    'AVERAGEIFS': (
+        lambda average_range, *args: (_call('SUMIFS', average_range, *args), _call('COUNTIFS', *args)),
+        _add,
+        _average_finish,
+    ),
+    'MAXIFS': (
+        lambda max_range, *args: (_call('MAXIFS', max_range, *args), _call('COUNTIFS', *args)),
+        _extreme_combine(torch.maximum),
+        _extreme_finish,
+    ),
+    'MINIFS': (
+        lambda min_range, *args: (_call('MINIFS', min_range, *args), _call('COUNTIFS', *args)),
+        _extreme_combine(torch.minimum),
+        _extreme_finish,
+    ),
+}
+
+
+def _error_in(partial):
+    values = partial if isinstance(partial, tuple) else (partial,)
+    for value in values:
+        if isinstance(value, error.XLError):
+            return value
+    return None
+
+
+class ChunkReducer(object):
+    """
+    The running partial results of the calls of functions that reduce rows while
+    a formula streams. Calls are told apart by their order within a chunk, which
+    is the same in every chunk of a formula.
+    """
+
+    def __init__(self):
+        self.partials = {}
+        self.calls = 0
+
+    def start_chunk(self):
+        self.calls = 0
+
+    def reduce(self, name, args):
+        """ The aggregate of the rows of every chunk so far for a call of name with the args of this chunk """
+        if name not in REDUCERS:
+            raise ValueError('%s can only be evaluated with all of its rows at once' % name)
+        partial_fn, combine, finish = REDUCERS[name]
+        key = self.calls
+        self.calls += 1
+        partial = partial_fn(*args)
+        previous = self.partials.get(key)
+        if previous is not None:
+            # an excel error in any chunk is the result of the call
+            err = _error_in(previous) or _error_in(partial)
+            partial = err if err is not None else combine(previous, partial)
+        self.partials[key] = partial
+        if isinstance(partial, error.XLError):
+            return partial
+        return finish(partial)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of formulas evaluated on a single row, with python numbers that take the
+pure python versions of functions and with the same values as 0-d tensors.
+Run from root directory
+python -m "scripts.benchmark_scalar"
+"""
+import timeit
+import torch
+from hotxlfp import Parser
+
+FORMULAS = [
+    'SIN(A)',
+    'ABS(A - B)',
+    'A ^ 2 + B ^ 0.5',
+    'IF(A > B, SQRT(A), LN(B))',
+    'ROUND(A * B, 2)',
+    'MAX(A, B, 3) - MIN(A, B)',
+    'MOD(EXP(A), B) + COS(B) * TAN(A)',
+]
+ARGS = {'A': 1.5, 'B': 2.25}
+NUMBER = 20000
+
+
+def latency(formula, args):
+    """ The mean time of a call of formula in microseconds """
+    return timeit.timeit(lambda: formula(args), number=NUMBER) / NUMBER * 1e6
+
+
+def main():
+    parser = Parser()
+    tensors = {name: torch.tensor(value, dtype=torch.double) for name, value in ARGS.items()}
+    print('%-36s %12s %12s %8s' % ('formula', 'tensors us', 'scalars us', 'speedup'))
+    for expression in FORMULAS:
+        formula = parser.parse(expression)['result']
+        with_tensors = latency(formula, tensors)
+        with_scalars = latency(formula, ARGS)
+        print('%-36s %12.2f %12.2f %7.1fx' % (expression, with_tensors, with_scalars, with_tensors / with_scalars))
+
+
+if __name__ == '__main__':
+    main()
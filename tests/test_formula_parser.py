@@ -1,8 +1,12 @@
 import unittest
+import math
+import warnings
+from unittest import mock
 
 from hotxlfp import error
 import torch
-from hotxlfp import Parser
+from hotxlfp import Parser, BufferArena, EvaluationContext, DictionaryArray, columns
+from hotxlfp.formulas import lookupandreference, utils
 from math import pi
 import numpy as np
 
@@ -90,6 +94,142 @@ def test_logical(self):
         result = func({"A": 100})
         self.assertEqual(result, True)
 
+    def test_logical_functions(self):
+        p = Parser(debug=True)
+        variables = {
+            "A": torch.tensor([0.0, 2, 3, float("nan")], dtype=torch.double),
+            "B": torch.tensor([1.0, 1, 5, 1], dtype=torch.double),
+        }
+        evaluate = lambda expression: p.parse(expression)["result"](variables)
+        self.assertEqual(evaluate("AND(A > 1, B < 2)").tolist(), [False, True, False, False])
+        self.assertEqual(evaluate("OR(A > 1, B > 2)").tolist(), [False, True, True, False])
+        self.assertEqual(evaluate("XOR(A > 1, B < 2, TRUE())").tolist(), [False, True, False, False])
+        self.assertEqual(evaluate("NOT(A > 1)").tolist(), [True, False, False, True])
+        # NaN rows stay in error
+        result = evaluate("AND(A, B)")
+        self.assertEqual(result[:3].tolist(), [0, 1, 1])
+        self.assertTrue(torch.isnan(result[3]))
+        # ranges are reduced across, leaving their text out
+        self.assertEqual(p.parse('AND({1, "x", 1})')["result"]({}), True)
+        self.assertEqual(p.parse("OR({0, 0}, {0, 1})")["result"]({}), True)
+        self.assertEqual(evaluate("AND({1, 1}, A > 1)").tolist(), [False, True, True, False])
+        self.assertEqual(p.parse('AND("x")')["result"]({}), error.VALUE)
+
+    def test_information_functions(self):
+        p = Parser(debug=True)
+        variables = {
+            "A": torch.tensor([0.0, 2, 3, float("nan")], dtype=torch.double),
+            "S": np.array(["a", "4", "", "x"]),
+            "O": np.array([1.0, "t", error.NOT_AVAILABLE, None], dtype=object),
+        }
+        evaluate = lambda expression: p.parse(expression)["result"](variables)
+        self.assertEqual(evaluate("ISNUMBER(A)").tolist(), [True, True, True, False])
+        self.assertEqual(evaluate("ISERROR(A)").tolist(), [False, False, False, True])
+        self.assertEqual(evaluate("ISTEXT(S)").tolist(), [True, True, True, True])
+        self.assertEqual(evaluate("ISNUMBER(O)").tolist(), [True, False, False, False])
+        self.assertEqual(evaluate("ISTEXT(O)").tolist(), [False, True, False, False])
+        self.assertEqual(evaluate("ISBLANK(O)").tolist(), [False, False, False, True])
+        self.assertEqual(evaluate("ISNA(O)").tolist(), [False, False, True, False])
+        self.assertEqual(evaluate("ISERR(O)").tolist(), [False, False, False, False])
+        self.assertEqual(evaluate("N(O)")[[0, 1, 3]].tolist(), [1, 0, 0])
+        self.assertEqual(evaluate("IF(ISERROR(A), -1, A)").tolist(), [0, 2, 3, -1])
+        odd = evaluate("ISODD(A)")
+        self.assertEqual(odd[:3].tolist(), [0, 0, 1])
+        self.assertTrue(torch.isnan(odd[3]))
+        self.assertEqual(evaluate("ISEVEN(S)")[1].item(), 1)
+        self.assertEqual(evaluate("ERROR.TYPE(O)")[2].item(), 7)
+        self.assertEqual(p.parse("ISERROR(1/0)")["result"]({}), True)
+        # numeric columns keep the error of each row, a lookup miss is #N/A
+        self.assertEqual(evaluate("ISNA(N(O))").tolist(), [False, False, True, False])
+        self.assertEqual(evaluate("ISNA(MATCH(A, {0, 3}, 0))").tolist(), [False, True, False, True])
+        self.assertEqual(evaluate("ISERR(MATCH(A, {0, 3}, 0))").tolist(), [False, False, False, False])
+        self.assertEqual(evaluate("ISERR(QUOTIENT(1, A))").tolist(), [True, False, False, True])
+        codes = evaluate("ERROR.TYPE(MATCH(A, {0, 3}, 0))")
+        self.assertTrue(torch.isnan(codes[[0, 2]]).all())
+        self.assertEqual(codes[[1, 3]].tolist(), [7, 7])
+        self.assertEqual(evaluate("ERROR.TYPE(QUOTIENT(1, A))")[[0, 3]].tolist(), [2, 3])
+        for expression in ["ERROR.TYPE(ISODD(MATCH(A, {0, 3}, 0)))", "ERROR.TYPE(ISEVEN(MATCH(A, {0, 3}, 0)))"]:
+            self.assertEqual(evaluate(expression)[[1, 3]].tolist(), [7, 7], expression)
+        self.assertEqual(evaluate('MATCH(A, {0, 3}, 0) & ""')[1], error.NOT_AVAILABLE)
+
+    def test_lookups(self):
+        p = Parser(debug=True)
+        evaluate = lambda expression, variables={}: p.parse(expression)["result"](variables)
+        self.assertEqual(evaluate("MATCH(39,{25,38,40,41},1)"), 2)
+        self.assertEqual(evaluate("MATCH(39,{25,38,40,41},-1)"), 3)
+        self.assertEqual(evaluate('MATCH("F?O",{"eee","aaa","foa","foo"},0)'), 4)
+        self.assertEqual(evaluate("MATCH(2,{1,2,2,3},1)"), 3)
+        self.assertEqual(evaluate("MATCH(0,{1,2},1)"), error.NOT_AVAILABLE)
+
+        table = {"T": [[1, "a"], [2, "b"], [3, "c"]], "H": [["a", "b"], [1, 2]]}
+        self.assertEqual(evaluate("VLOOKUP(2,T,2,FALSE())", table), "b")
+        self.assertEqual(evaluate("VLOOKUP(2.5,T,2)", table), "b")
+        self.assertEqual(evaluate("VLOOKUP(2,T,3)", table), error.REF)
+        self.assertEqual(evaluate('HLOOKUP("B",H,2,FALSE())', table), 2)
+        self.assertEqual(evaluate('XLOOKUP(5,{1,2},{"x","y"},"none")'), "none")
+        self.assertEqual(evaluate('XLOOKUP(2,{1,2,2},{"x","y","z"},"none",0,-1)'), "z")
+
+        keys = torch.arange(1000, dtype=torch.double) * 3
+        prices = torch.rand(1000, dtype=torch.double)
+        variables = {
+            "K": torch.tensor([9.0, 10, 2997, -3], dtype=torch.double),
+            "T": torch.stack([keys, prices], 1),
+            "L": keys,
+            "P": prices,
+        }
+        with EvaluationContext():
+            result = evaluate("VLOOKUP(K,T,2,FALSE())", variables)
+        self.assertEqual(result[[0, 2]].tolist(), [prices[3].item(), prices[999].item()])
+        self.assertTrue(torch.isnan(result[[1, 3]]).all())
+        self.assertEqual(evaluate("XLOOKUP(K,L,P,-1)", variables)[[1, 3]].tolist(), [-1, -1])
+        self.assertEqual(evaluate("XLOOKUP(K,L,P,,-1)", variables)[1].item(), prices[3].item())
+        # lookups search whole ranges, their rows aren't deduplicated
+        self.assertFalse(p.parse("VLOOKUP(K,T,2,FALSE())")["result"].row_wise)
+        positions = evaluate("MATCH(K,L,0)", variables)
+        self.assertEqual(positions[[0, 2]].tolist(), [4, 1000])
+        # a miss is #N/A on its row, IFNA and IFERROR catch it row by row
+        found = evaluate("IFNA(VLOOKUP(K,T,2,FALSE()),-1)", variables)
+        self.assertEqual(found.tolist(), [prices[3].item(), -1, prices[999].item(), -1])
+        self.assertEqual(evaluate("ISNA(MATCH(K,L,0))", variables).tolist(), [False, True, False, True])
+        self.assertEqual(evaluate("IFERROR(MATCH(K,L,0),0)", variables).tolist(), [4, 0, 1000, 0])
+        self.assertTrue(torch.isnan(evaluate("IFNA(QUOTIENT(1,K-9),-1)", variables)[0]))
+        # the index of a tensor range is built once and rebuilt when the tensor changes
+        index = lookupandreference._lookup_index(keys)
+        self.assertIs(lookupandreference._lookup_index(keys), index)
+        keys[0] = -1
+        self.assertIsNot(lookupandreference._lookup_index(keys), index)
+        self.assertEqual(evaluate("MATCH(-1,L,0)", variables).tolist(), [1, 1, 1, 1])
+
+        regions = {"S": np.array(["b", "a", "zz"])}
+        self.assertEqual(evaluate('XLOOKUP(S,{"A","b"},{"x","y"},"?")', regions).tolist(), ["y", "x", "?"])
+        self.assertEqual(evaluate('IFNA(VLOOKUP(S,{"a","x";"b","y"},2,FALSE()),"?")', regions).tolist(), ["y", "x", "?"])
+
+    def test_selectors(self):
+        p = Parser(debug=True)
+        variables = {
+            "T": torch.tensor([1.0, 2, 3, 0, 2.5]),
+            "A": torch.tensor([10.0, 20, 30, 40, 50], dtype=torch.double),
+            "S": np.array(["a", "b", "c", "d", "e"]),
+            "M": torch.arange(12, dtype=torch.double).reshape(4, 3),
+            "R": torch.tensor([1.0, 4, 5, 2, 2]),
+            "C": torch.tensor([1.0, 3, 1, 0, 2]),
+        }
+        evaluate = lambda expression: p.parse(expression)["result"](variables)
+        result = evaluate("CHOOSE(T, 0.5, 0.25, A)")
+        self.assertEqual(result[[0, 1, 2, 4]].tolist(), [0.5, 0.25, 30, 0.25])
+        self.assertTrue(torch.isnan(result[3]))
+        self.assertEqual(evaluate('CHOOSE(T, "x", S, "z")').tolist(), ["x", "b", "z", error.VALUE, "e"])
+        self.assertEqual(evaluate("CHOOSE(2, A, T)").tolist(), variables["T"].tolist())
+        result = evaluate("INDEX(M, R, C)")
+        self.assertEqual(result[[0, 1, 4]].tolist(), [0, 11, 4])
+        self.assertTrue(torch.isnan(result[[2, 3]]).all())
+        self.assertEqual(evaluate("INDEX(S, R)").tolist(), ["a", "d", "e", "b", "b"])
+        self.assertEqual(evaluate("INDEX(M, 2, 3)"), 5)
+        result = evaluate("INDEX({7,8,9}, R)")
+        self.assertEqual(result[[0, 3]].tolist(), [7, 8])
+        self.assertTrue(torch.isnan(result[[1, 2]]).all())
+        self.assertEqual(evaluate("INDEX({A,T}, 1, C)")[[0, 2, 4]].tolist(), [10, 30, 2.5])
+
     def test_variable_name(self):
         p = Parser(debug=True)
         func = p.parse("a1")["result"]
@@ -474,6 +614,484 @@ def test_scientific_notation(self):
         _test_equation(equation="0.2E2", variables={"a1": [1.1]}, answer=20)
         _test_equation(equation="-2E-1", variables={"a1": [1.1]}, answer=-0.2)
 
+    def test_rounding(self):
+        _test_equation(
+            equation="ROUND(a1, 2)",
+            variables={"a1": [1.234, -1.235, 0.125, 2]},
+            answer=[1.23, -1.24, 0.13, 2],
+        )
+        _test_equation(
+            equation="ROUND(a1, a2)",
+            variables={"a1": [1234.5678, 1234.5678, 2.5], "a2": [-2, 0, 0]},
+            answer=[1200, 1235, 3],
+        )
+        _test_equation(
+            equation="ROUNDUP(a1, 1)",
+            variables={"a1": [3.14159, -3.14159, 0]},
+            answer=[3.2, -3.2, 0],
+        )
+        _test_equation(
+            equation="ROUNDDOWN(a1, 1)",
+            variables={"a1": [3.19, -3.19, 0]},
+            answer=[3.1, -3.1, 0],
+        )
+        _test_equation(
+            equation="MOD(a1, a2)",
+            variables={"a1": [3, -3, 3, -3], "a2": [2, 2, -2, -2]},
+            answer=[1, 1, -1, -1],
+        )
+        _test_equation(
+            equation="QUOTIENT(a1, a2)",
+            variables={"a1": [5, -5, 4.5], "a2": [2, 2, 3]},
+            answer=[2, -2, 1],
+        )
+        _test_equation(
+            equation="ODD(a1)", variables={"a1": [1.5, 3, 2, -1, -2, 0]}, answer=[3, 3, 3, -1, -3, 1]
+        )
+        _test_equation(
+            equation="EVEN(a1)", variables={"a1": [1.5, 3, 2, -1, -2.5, 0]}, answer=[2, 4, 2, -2, -4, 0]
+        )
+        _test_equation(equation="FACT(a1)", variables={"a1": [0, 1, 5, 5.9]}, answer=[1, 1, 120, 120])
+        _test_equation(equation="FACTDOUBLE(a1)", variables={"a1": [0, 1, 6, 7]}, answer=[1, 1, 48, 105])
+
+    def test_rounding_edge_cases(self):
+        p = Parser(debug=True)
+        result = p.parse("ROUND(a1, 2)")["result"](
+            {"a1": torch.tensor([2.675, 1.005, -2.675], dtype=torch.double)}
+        )
+        self.assertEqual(result.tolist(), [2.68, 1.01, -2.68])
+        result = p.parse("MOD(a1, a2)")["result"](
+            {"a1": torch.tensor([5, 5]), "a2": torch.tensor([3, 0])}
+        )
+        self.assertEqual(result[0], 2)
+        self.assertTrue(torch.isnan(result[1]))
+        result = p.parse("FACT(a1)")["result"]({"a1": torch.tensor([3, -1, 171])})
+        self.assertEqual(result[0], 6)
+        self.assertTrue(torch.isnan(result[1:]).all())
+        self.assertEqual(p.parse("MOD(5, 0)")["result"]({}), error.DIV_ZERO)
+        self.assertEqual(p.parse("QUOTIENT(5, 0)")["result"]({}), error.DIV_ZERO)
+        self.assertEqual(p.parse("FACT(-1)")["result"]({}), error.NUM)
+
+    def test_criteria(self):
+        p = Parser(debug=True)
+        values = torch.tensor([1.0, 5, 7, 10, 3])
+        names = np.array(["apple", "Apricot", "banana", "apple pie", "a*b"])
+        variables = {"A": values, "S": names}
+        self.assertEqual(p.parse('COUNTIF(A, ">4")')["result"](variables), 3)
+        self.assertEqual(p.parse("COUNTIF(A, 5)")["result"](variables), 1)
+        self.assertEqual(p.parse('SUMIF(A, "<=5")')["result"](variables), 9)
+        self.assertEqual(p.parse('AVERAGEIF(A, ">5")')["result"](variables), 8.5)
+        self.assertEqual(p.parse('AVERAGEIF(A, ">100")')["result"](variables), error.DIV_ZERO)
+        self.assertEqual(p.parse('COUNTIF(S, "ap*")')["result"](variables), 3)
+        self.assertEqual(p.parse('COUNTIF(S, "?pple")')["result"](variables), 1)
+        self.assertEqual(p.parse('COUNTIF(S, "a~*b")')["result"](variables), 1)
+        self.assertEqual(p.parse('COUNTIF(S, "<>apple")')["result"](variables), 4)
+        self.assertEqual(p.parse('SUMIF(S, "APPLE*", A)')["result"](variables), 11)
+        self.assertEqual(p.parse('COUNTIF({1,2,"x",3}, ">1")')["result"]({}), 2)
+        logicals = {"L": torch.tensor([True, False, True]), "T": True}
+        self.assertEqual(p.parse('COUNTIF(L, "TRUE")')["result"](logicals), 2)
+        self.assertEqual(p.parse('COUNTIF(L, "<>TRUE")')["result"](logicals), 1)
+        self.assertEqual(p.parse("COUNTIF(L, T)")["result"](logicals), 2)
+        self.assertEqual(p.parse("COUNTIF(L, 1)")["result"](logicals), 0)
+        self.assertEqual(p.parse("COUNTIF(A, T)")["result"]({"A": values, "T": True}), 0)
+        cells = {"C": np.array([True, None, "", 1, "x"], dtype=object)}
+        self.assertEqual(p.parse('COUNTIF(C, "=")')["result"](cells), 1)
+        self.assertEqual(p.parse('COUNTIF(C, "")')["result"](cells), 2)
+        self.assertEqual(p.parse('COUNTIF(C, "<>")')["result"](cells), 4)
+        self.assertEqual(p.parse('COUNTIF(C, "TRUE")')["result"](cells), 1)
+
+    def test_multiple_criteria(self):
+        p = Parser(debug=True)
+        variables = {
+            "A": torch.tensor([1.0, 5, 7, 10, 3]),
+            "B": torch.tensor([2.0, 4, 6, 8, 10]),
+            "S": np.array(["apple", "Apricot", "banana", "apple pie", "cherry"]),
+        }
+        self.assertEqual(p.parse('COUNTIFS(A, ">2", S, "a*")')["result"](variables), 2)
+        self.assertEqual(p.parse('SUMIFS(B, A, ">2", S, "a*")')["result"](variables), 12)
+        self.assertEqual(p.parse('AVERAGEIFS(B, A, ">=5", A, "<10")')["result"](variables), 5)
+        self.assertEqual(p.parse('MAXIFS(B, S, "<>banana")')["result"](variables), 10)
+        self.assertEqual(p.parse('MINIFS(B, A, ">4")')["result"](variables), 4)
+        self.assertEqual(p.parse('MAXIFS(B, A, ">100")')["result"](variables), 0)
+        self.assertEqual(p.parse('AVERAGEIFS(B, A, ">100")')["result"](variables), error.DIV_ZERO)
+        self.assertEqual(p.parse('COUNTIFS(A, ">2", S)')["result"](variables), error.VALUE)
+
+    def test_criteria_masks_are_shared(self):
+        p = Parser(debug=True)
+        variables = {
+            "A": torch.tensor([1.0, 5, 7, 10, 3]),
+            "S": np.array(["apple", "Apricot", "banana", "apple pie", "cherry"]),
+        }
+        count = p.parse('COUNTIFS(A, ">2", S, "a*")')["result"]
+        total = p.parse('SUMIFS(A, A, ">2", S, "a*")')["result"]
+        with EvaluationContext() as context:
+            self.assertEqual(count(variables), 2)
+            self.assertEqual(total(variables), 15)
+        self.assertEqual(len(context.cache), 2)
+
+    def test_date_parts(self):
+        serials = [1, 59, 60, 61, 43831.75, 45000]
+        _test_equation(equation="YEAR(a1)", variables={"a1": serials}, answer=[1900, 1900, 1900, 1900, 2020, 2023])
+        _test_equation(equation="MONTH(a1)", variables={"a1": serials}, answer=[1, 2, 3, 3, 1, 3])
+        _test_equation(equation="DAY(a1)", variables={"a1": serials}, answer=[1, 28, 1, 1, 1, 15])
+        _test_equation(equation="HOUR(a1)", variables={"a1": serials}, answer=[0, 0, 0, 0, 18, 0])
+        times = [0.2513, 0.5, 0.999]
+        _test_equation(equation="HOUR(a1)", variables={"a1": times}, answer=[6, 12, 23])
+        _test_equation(equation="MINUTE(a1)", variables={"a1": times}, answer=[1, 0, 58])
+        _test_equation(equation="SECOND(a1)", variables={"a1": times}, answer=[52, 0, 34])
+
+        p = Parser(debug=True)
+        self.assertEqual(p.parse("YEAR(DATE(2020, 5, 17))")["result"]({}), 2020)
+        self.assertEqual(p.parse('MONTH("2021-03-04")')["result"]({}), 3)
+        self.assertEqual(p.parse("YEAR(-1)")["result"]({}), error.NUM)
+        result = p.parse("DAY(a1)")["result"]({"a1": torch.tensor([-1.0, 31])})
+        self.assertTrue(torch.isnan(result[0]))
+        self.assertEqual(result[1], 31)
+
+    def test_date_strings(self):
+        p = Parser(debug=True)
+        dates = np.array(["03/04/2021", "12/31/2020", "", "March 5, 2021", "junk"])
+        result = p.parse("DATEVALUE(A)")["result"]({"A": dates})
+        self.assertEqual(result[[0, 1, 3]].tolist(), [44259, 44196, 44260])
+        self.assertTrue(torch.isnan(result[[2, 4]]).all())
+        result = p.parse("YEAR(A)")["result"]({"A": np.array(["2021-03-04", "1900-01-01", "1900-03-01"])})
+        self.assertEqual(result.tolist(), [2021, 1900, 1900])
+        result = p.parse("A + 1")["result"]({"A": np.array(["1.5", "2021-03-04"])})
+        self.assertEqual(result.tolist(), [2.5, 44260])
+
+        cache = utils.LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+    def test_deduplicated_rows(self):
+        p = Parser(debug=True)
+        rows = 20000
+        variables = {
+            "A": torch.arange(rows, dtype=torch.double) % 7,
+            "R": np.array(["north", "south", "east", "west"])[np.arange(rows) % 4],
+        }
+        formula = p.parse('IF(A > 3, A * 2, 0) & "-" & LOWER(R)')["result"]
+        self.assertEqual(formula.variables, {"A", "R"})
+        self.assertTrue(formula.row_wise)
+        evaluated = []
+        fn = formula.fn
+        formula.fn = lambda args: evaluated.append(len(args["A"])) or fn(args)
+        expected = formula(variables, deduplicate=False)
+        self.assertEqual(formula(variables).tolist(), expected.tolist())
+        self.assertEqual(formula(variables, deduplicate=True).tolist(), expected.tolist())
+        self.assertEqual(evaluated, [rows, 28, 28])
+        # a sample with too many distinct rows evaluates them all
+        variables["A"] = torch.arange(rows, dtype=torch.double)
+        formula(variables)
+        self.assertEqual(evaluated[-1], rows)
+        # functions that combine rows can't be deduplicated
+        self.assertFalse(p.parse('COUNTIF(A, ">3") + A')["result"].row_wise)
+        self.assertFalse(p.parse("RAND() + A")["result"].row_wise)
+
+    def test_financial(self):
+        p = Parser(debug=True)
+        self.assertAlmostEqual(p.parse("PV(0.08/12, 12*20, 500,,0)")["result"]({}).item(), -59777.15, places=2)
+        self.assertEqual(p.parse("PV(0, 12*20, 500)")["result"]({}).item(), -120000)
+        variables = {
+            "R": torch.tensor([0.05, 0.0, 0.1]),
+            "C": torch.tensor([[-1000.0, 300, 400, 500], [-100, 50, 50, 0], [100, 10, 10, 10]]),
+        }
+        payments = p.parse("PMT(R, 10, 1000)")["result"](variables)
+        self.assertEqual([round(v, 4) for v in payments.tolist()], [-129.5046, -100.0, -162.7454])
+        self.assertEqual(
+            [round(v, 4) for v in p.parse("FV(R, 10, PMT(R, 10, 1000), 1000)")["result"](variables).tolist()], [0.0, 0.0, 0.0]
+        )
+        self.assertEqual(
+            [round(v, 4) for v in p.parse("PV(R, 10, PMT(R, 10, 1000))")["result"](variables).tolist()], [1000.0] * 3
+        )
+        self.assertEqual(
+            [round(v, 4) for v in p.parse("NPER(R, PMT(R, 10, 1000), 1000)")["result"](variables).tolist()], [10.0] * 3
+        )
+        # the solver finds every row's rate back
+        rates = p.parse("RATE(10, PMT(R, 10, 1000), 1000)")["result"](variables)
+        self.assertEqual([round(v, 8) for v in rates.tolist()], [0.05, 0.0, 0.1])
+        npv = p.parse("NPV(0.1, {-1000,300,400,500})")["result"]({})
+        self.assertAlmostEqual(npv.item(), -19.1244, places=4)
+        irr = p.parse("IRR(C)")["result"](variables)
+        self.assertAlmostEqual(irr[0].item(), 0.0890, places=4)
+        self.assertAlmostEqual(irr[1].item(), 0.0)
+        # flows that never change sign have no rate of return
+        self.assertTrue(torch.isnan(irr[2]))
+        self.assertEqual(p.parse("NPER(0.1, -100, 1000)")["result"]({}), error.NUM)
+        self.assertEqual(p.parse("NPV(-1, 100)")["result"]({}), error.DIV_ZERO)
+
+    def test_base_conversions(self):
+        p = Parser(debug=True)
+        self.assertEqual(p.parse('HEX2DEC("FFFFFFFF5B")')["result"]({}), -165)
+        self.assertEqual(p.parse("DEC2BIN(-512)")["result"]({}), "1000000000")
+        self.assertEqual(p.parse("DEC2BIN(512)")["result"]({}), error.NUM)
+        self.assertEqual(p.parse('HEX2OCT("FFFFFFFF00")')["result"]({}), "7777777400")
+        self.assertEqual(p.parse("DEC2OCT(58, 3)")["result"]({}), "072")
+        variables = {
+            "H": np.array(["a5", "FFFFFFFF5B", "zz", "12345678901"]),
+            "D": torch.tensor([100.0, -54, float("nan"), 2.0**40]),
+            "E": DictionaryArray.encode(np.array(["1F", "X", "1F", "1F"])),
+        }
+        decimals = p.parse("HEX2DEC(H)")["result"](variables)
+        self.assertEqual(decimals[:2].tolist(), [165, -165])
+        self.assertTrue(torch.isnan(decimals[2:]).all())
+        self.assertEqual(
+            p.parse("DEC2HEX(D, 4)")["result"](variables).tolist(), ["0064", "FFFFFFFFCA", error.VALUE, error.NUM]
+        )
+        self.assertEqual(p.parse("HEX2BIN(E)")["result"](variables).tolist(), ["11111", error.VALUE, "11111", "11111"])
+
+    def test_seeded_random(self):
+        p = Parser(debug=True)
+        rows = 40000
+        variables = {"A": torch.arange(rows, dtype=torch.double)}
+        formula = p.parse("RAND() + A * 0")["result"]
+        values = formula(variables, seed=7)
+        self.assertEqual(values.shape, (rows,))
+        self.assertTrue(((values >= 0) & (values < 1)).all())
+        self.assertGreater(len(torch.unique(values)), rows * 0.99)
+        self.assertTrue(torch.equal(values, formula(variables, seed=7)))
+        self.assertFalse(torch.equal(values, formula(variables, seed=8)))
+        # chunks of the dataset draw what its rows draw at once
+        chunks = [
+            formula({"A": variables["A"][start:start + 15000]}, seed=7, row_offset=start) for start in range(0, rows, 15000)
+        ]
+        self.assertTrue(torch.equal(values, torch.cat(chunks)))
+        # every call of a formula is an independent draw
+        self.assertFalse((p.parse("RAND() - RAND() + A * 0")["result"](variables, seed=7) == 0).any())
+        dice = p.parse("RANDBETWEEN(1, 6) + A * 0")["result"](variables, seed=7)
+        self.assertEqual(sorted(torch.unique(dice).tolist()), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(p.parse("RANDBETWEEN(6, 1)")["result"]({}), error.NUM)
+
+    def test_simulation(self):
+        p = Parser(debug=True)
+        scenarios, rows = 64, 10000
+        variables = {
+            "P": torch.arange(rows, dtype=torch.double),
+            # a shock per scenario and row
+            "S": torch.linspace(-1, 1, scenarios).unsqueeze(1).expand(scenarios, rows),
+        }
+        formula = p.parse("P * (1 + S) + RAND()")["result"]
+        simulation = formula.simulate(variables, scenarios, quantiles=(0, 0.5, 1), seed=3)
+        self.assertEqual(simulation["mean"].shape, (rows,))
+        self.assertEqual(simulation["quantiles"].shape, (3, rows))
+        self.assertTrue(torch.allclose(simulation["mean"], variables["P"] + 0.5, atol=0.2))
+        self.assertTrue((simulation["quantiles"][0] < 1).all())
+        self.assertTrue((simulation["quantiles"][2] >= 2 * variables["P"]).all())
+        # chunks of rows reduce to what the whole batch does
+        chunked = formula.simulate(variables, scenarios, quantiles=(0, 0.5, 1), seed=3, max_cells=scenarios)
+        self.assertTrue(torch.equal(simulation["mean"], chunked["mean"]))
+        self.assertTrue(torch.equal(simulation["quantiles"], chunked["quantiles"]))
+        with self.assertRaises(ValueError):
+            formula.simulate(variables, scenarios + 1)
+
+    def test_precision_policy(self):
+        variables = {"A": torch.tensor([1, 2, 3]), "B": torch.tensor([1.5, 2.5, 3.5], dtype=torch.double)}
+        expressions = [
+            "IF(A > 1, A, 0)", "MAX(A, 2)", "A ^ 2", "A / 2", "A + 1.5", "AVERAGE(A, B)", "ROUND(B, 0)", "PMT(0.05, 10, B)",
+            "FACT(A)", "FACTDOUBLE(A)",
+        ]
+
+        def dtypes(parser, **kwargs):
+            return [parser.parse(expression)["result"](variables, **kwargs).dtype for expression in expressions]
+
+        self.assertEqual(dtypes(Parser(precision="float64")), [torch.double] * len(expressions))
+        self.assertEqual(dtypes(Parser(precision="float32")), [torch.float32] * len(expressions))
+        # integers stay integers where excel gives whole numbers
+        self.assertEqual(
+            dtypes(Parser(precision="int64")), [torch.int64] * 3 + [torch.double] * (len(expressions) - 3)
+        )
+        # a call or the active context picks the policy of a parser without one
+        self.assertEqual(dtypes(Parser(), precision="float32"), [torch.float32] * len(expressions))
+        with EvaluationContext(precision="float32"):
+            self.assertEqual(dtypes(Parser()), [torch.float32] * len(expressions))
+        self.assertEqual(
+            Parser(precision="float32").parse("ROUND(B, 0)")["result"](variables).tolist(), [2.0, 3.0, 4.0]
+        )
+        with self.assertRaises(ValueError):
+            Parser(precision="float16")
+
+    def test_tensors_are_not_copied(self):
+        p = Parser(debug=True)
+        values = torch.linspace(1, 2, 1000, dtype=torch.double)
+        self.assertIs(utils.as_tensor(values), values)
+        array = np.arange(5.0)
+        self.assertEqual(utils.as_tensor(array).data_ptr(), array.ctypes.data)
+        tensor = torch.tensor
+
+        def no_copies(data, *args, **kwargs):
+            if isinstance(data, torch.Tensor):
+                raise AssertionError("copied a tensor")
+            return tensor(data, *args, **kwargs)
+
+        expressions = [
+            "ABS(A)", "SQRT(A)", "ACOSH(A)", "COT(A)", "LOG(A, 2)", "ATAN2(A, A)", "CEILING(A, 1)",
+            "A ^ 2", "MAX(A, 1)", "MIN(A, 1)", "AVERAGE(A, 1)", "IF(A > 1.5, A, 0)",
+        ]
+        with mock.patch("torch.tensor", no_copies), warnings.catch_warnings():
+            warnings.simplefilter("error")
+            for expression in expressions:
+                parsed = p.parse(expression)
+                self.assertIsNone(parsed["error"], expression)
+                self.assertEqual(parsed["result"]({"A": values}).shape, values.shape)
+
+    def test_column_ingestion(self):
+        p = Parser(debug=True)
+        numbers = np.arange(5.0)
+        data = {
+            "A": numbers,
+            "D": np.array(["2024-01-01", "2024-01-02", "NaT", "2024-01-04", "2024-01-05"], dtype="datetime64[D]"),
+            "T": np.array(["x", None, "z", float("nan"), "w"], dtype=object),
+        }
+        args = columns.to_args(data)
+        # numeric arrays share their memory with the tensors
+        self.assertEqual(args["A"].data_ptr(), numbers.ctypes.data)
+        result = p.parse("A + D")["result"].evaluate(data)
+        self.assertEqual(result[[0, 1, 3, 4]].tolist(), [45292.0, 45294.0, 45298.0, 45300.0])
+        self.assertTrue(torch.isnan(result[2]))
+        # missing text is blank
+        self.assertEqual(p.parse('UPPER(T) & "."')["result"].evaluate(data).tolist(), ["X.", ".", "Z.", ".", "W."])
+
+    @unittest.skipUnless(columns.pandas, "pandas is not installed")
+    def test_pandas_ingestion(self):
+        pandas = columns.pandas
+        frame = pandas.DataFrame({
+            "A": [1.0, 2.0, 3.0],
+            "N": pandas.array([1, None, 3], dtype="Int64"),
+            "C": pandas.Categorical(["x", None, "x"]),
+        })
+        args = columns.to_args(frame)
+        self.assertEqual(args["A"].data_ptr(), frame["A"].to_numpy().ctypes.data)
+        self.assertIsInstance(args["C"], DictionaryArray)
+        result = Parser(debug=True).parse("A + N")["result"].evaluate(frame)
+        self.assertEqual(result[[0, 2]].tolist(), [2.0, 6.0])
+        self.assertTrue(torch.isnan(result[1]))
+        self.assertEqual(Parser(debug=True).parse('C & "."')["result"].evaluate(frame).tolist(), ["x.", ".", "x."])
+        # nullable columns without missing rows keep their dtype
+        complete = columns.to_column(pandas.Series([1, 2, 3], dtype="Int64"))
+        self.assertEqual((complete.dtype, complete.tolist()), (torch.int64, [1, 2, 3]))
+        flags = columns.to_column(pandas.Series([True, None, False], dtype="boolean"))
+        self.assertEqual(flags[[0, 2]].tolist(), [1.0, 0.0])
+        self.assertTrue(torch.isnan(flags[1]))
+
+    @unittest.skipUnless(columns.pyarrow, "pyarrow is not installed")
+    def test_arrow_ingestion(self):
+        pyarrow = columns.pyarrow
+        table = pyarrow.table({
+            "A": pyarrow.array([1.0, 2.0, 3.0]),
+            "N": pyarrow.array([1, None, 3]),
+            "T": pyarrow.array(["x", None, "z"]),
+        })
+        result = Parser(debug=True).parse("A + N")["result"].evaluate(table)
+        self.assertEqual(result[[0, 2]].tolist(), [2.0, 6.0])
+        self.assertTrue(torch.isnan(result[1]))
+        self.assertEqual(Parser(debug=True).parse('T & "."')["result"].evaluate(table).tolist(), ["x.", ".", "z."])
+
+    def test_streaming(self):
+        p = Parser(debug=True)
+        values = torch.arange(10, dtype=torch.double) - 3
+        chunks = [{"A": values[start:start + 4]} for start in range(0, 10, 4)]
+        doubled = list(p.parse("A * 2")["result"].stream(chunks))
+        self.assertEqual([len(chunk) for chunk in doubled], [4, 4, 2])
+        self.assertTrue(torch.equal(torch.cat(doubled), values * 2))
+        # rows are numbered across chunks
+        rand = p.parse("RAND() + A * 0")["result"]
+        self.assertTrue(torch.equal(torch.cat(list(rand.stream(chunks, seed=5))), rand({"A": values}, seed=5)))
+        # a reused buffer holds each chunk until the next one
+        buffers = {chunk.data_ptr() for chunk in p.parse("A * 2")["result"].stream(chunks, reuse=True)}
+        self.assertEqual(len(buffers), 1)
+        for expression in [
+            'SUMIF(A, ">0")', 'SUMIFS(A, A, ">0", A, "<5")', 'COUNTIF(A, ">0") + 1', 'COUNTIFS(A, ">0", A, "<5")',
+            'AVERAGEIF(A, ">0")', 'AVERAGEIFS(A, A, ">0", A, "<5")', 'MAXIFS(A, A, "<0")', 'MINIFS(A, A, ">100")',
+        ]:
+            formula = p.parse(expression)["result"]
+            streamed = list(formula.stream(chunks))
+            self.assertEqual(len(streamed), 1)
+            expected = formula({"A": values})
+            self.assertEqual(float(streamed[0]), float(expected.reshape(-1)[0]), expression)
+        with self.assertRaises(ValueError):
+            list(p.parse('A - SUMIF(A, ">0")')["result"].stream(chunks))
+        # lookups give a result per row of each chunk, searching the whole table
+        table = {"T": torch.stack([values, values * 10], 1)}
+        keys = torch.tensor([2.0, 6, 1, 2, -3, 100, 0])
+        lookup = p.parse("VLOOKUP(K, T, 2, FALSE())")["result"]
+        streamed = list(lookup.stream([{"K": keys[start:start + 3]} for start in range(0, 7, 3)], ranges=table))
+        self.assertEqual([len(chunk) for chunk in streamed], [3, 3, 1])
+        self.assertTrue(torch.equal(torch.cat(streamed).nan_to_num(-1), lookup(dict(table, K=keys)).nan_to_num(-1)))
+        # COUNT counts its arguments on each row, it doesn't combine chunks
+        self.assertEqual(list(p.parse("COUNT(A)")["result"].stream(chunks)), [1, 1, 1])
+
+    def test_scalar_fast_path(self):
+        p = Parser(debug=True)
+        args = {"A": 1.5, "B": 2}
+        tensors = {name: torch.tensor(value, dtype=torch.double) for name, value in args.items()}
+        for expression in [
+            "SIN(A) + ABS(B) ^ 2", "IF(A > 1, A, B)", "ROUND(1.005, 2)", "ROUNDUP(A * 100, -1)", "MAX(A, B, -1)",
+            "MIN(A, B)", "SQRT(-A)", "LN(0)", "ATANH(1)", "EXP(1000)", "MOD(-5, B)", "ODD(A)", "EVEN(-A)", "FACT(A * 3)",
+            "(-8) ^ (1 / 3)", "0 ^ -1", "2 ^ 1024", "ACOT(0)", "COT(A)", "LOG(8, B)", "PI()",
+        ]:
+            formula = p.parse(expression)["result"]
+            result = formula(args)
+            self.assertIsInstance(result, float, expression)
+            expected = float(formula(tensors))
+            self.assertTrue(result == expected or (math.isnan(result) and math.isnan(expected)), expression)
+        self.assertEqual(p.parse("QUOTIENT(A, 0)")["result"](args), error.DIV_ZERO)
+        self.assertEqual(p.parse("FACT(-1)")["result"](args), error.NUM)
+        # precision policies keep the dtypes of the tensor versions
+        self.assertEqual(p.parse("SIN(A)")["result"](args, precision="float32").dtype, torch.float32)
+
+    def test_backends(self):
+        self.assertEqual(Parser(backend="torch").parse("A + 1")["result"]({"A": torch.tensor([1.0])}).tolist(), [2.0])
+        with self.assertRaises(ValueError):
+            Parser(backend="numpy")
+
+    def test_formula_set(self):
+        p = Parser(debug=True)
+        calls = []
+        p.on("callFunction", lambda name, args, setter: calls.append(name))
+        p.on("callVariable", lambda name, setter: calls.append(name))
+        expressions = {"root": "SQRT(A + B) * 2", "sum": "SQRT(A+B) + (A + B)", "noise": "RAND() - RAND()", "ratio": "A / B"}
+        formulas = p.parse_set(expressions)["result"]
+        args = {"A": torch.arange(6, dtype=torch.double), "B": torch.tensor([1.0, 2.0, 1.0, 2.0, 1.0, 2.0])}
+        results = formulas(args, seed=3)
+        # variables and subexpressions in common are evaluated once, volatile ones every time
+        self.assertEqual(sorted(calls), ["A", "B", "RAND", "RAND", "SQRT"])
+        self.assertEqual(set(results), set(expressions))
+        for name in ["root", "sum", "ratio"]:
+            self.assertTrue(torch.equal(results[name], p.parse(expressions[name])["result"](args)), name)
+        self.assertFalse(bool((results["noise"] == 0).all()))
+        deduplicated = formulas(args, deduplicate=True, seed=3)
+        self.assertTrue(torch.equal(deduplicated["sum"], results["sum"]))
+        self.assertEqual(p.parse_set({"ok": "A", "broken": "1+"})["error"], {"broken": "#ERROR!"})
+
+    def test_buffer_arena(self):
+        p = Parser(debug=True)
+        batches = [{name: torch.rand(100, dtype=torch.double) for name in "ABC"} for _ in range(3)]
+        formula = p.parse("(A + B) * C - A / (B + 2) + SUM(A * 2)")["result"]
+        expected = [formula(args) for args in batches]
+        with BufferArena() as arena:
+            results = [formula(batches[0])]
+            allocations = arena.allocations
+            results += [formula(args) for args in batches[1:]]
+        for result, value in zip(results, expected):
+            self.assertTrue(torch.equal(result, value))
+        # the plan keeps the argument of SUM in a buffer of its own, only the result is allocated again
+        self.assertEqual(arena.allocations, allocations + 1 * 2)
+        self.assertEqual(arena.peak_bytes, 2 * 100 * 8)
+        self.assertEqual(len({result.data_ptr() for result in results}), 3)
+        # CHOOSE returns the buffer of an argument other than the first, which the result is written over
+        formula = p.parse("CHOOSE(2, A * 2, B * 3) + A")["result"]
+        expected = [formula(args) for args in batches]
+        with BufferArena() as arena:
+            results = [formula(args) for args in batches]
+        for result, value in zip(results, expected):
+            self.assertTrue(torch.equal(result, value))
+        with BufferArena() as arena:
+            self.assertTrue(torch.equal(p.parse("1 + 2 * A")["result"]({"A": torch.arange(3)}), torch.tensor([1, 3, 5])))
+            self.assertEqual(arena.allocations, 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import unittest
 import math
-from hotxlfp import Parser, error
+import numpy as np
+import torch
+from hotxlfp import Parser, DictionaryArray, error
 
 
 class TestText(unittest.TestCase):
@@ -168,3 +170,66 @@ def test_textjoin(self):
         ret = p.parse('TEXTJOIN(1, FALSE, {"1",,"2","3"})')
         self.assertEqual(ret['result']({"FALSE":0}), error.VALUE)
         self.assertEqual(ret['error'], None)
+
+    def test_text_columns(self):
+        p = Parser(debug=True)
+        texts = np.array(['apple pie', 'Banana\t', '', 'kiwi'])
+        variables = {'S': texts, 'A': torch.tensor([65., 66, 0, 300]), 'TRUE': 1}
+        self.assertEqual(p.parse('LEN(S)')['result'](variables).tolist(), [9, 7, 0, 4])
+        self.assertEqual(p.parse('UPPER(S)')['result'](variables).tolist(), ['APPLE PIE', 'BANANA\t', '', 'KIWI'])
+        self.assertEqual(p.parse('LOWER(S)')['result'](variables).tolist(), ['apple pie', 'banana\t', '', 'kiwi'])
+        self.assertEqual(p.parse('PROPER(S)')['result'](variables).tolist(), ['Apple Pie', 'Banana\t', '', 'Kiwi'])
+        self.assertEqual(p.parse('CLEAN(S)')['result'](variables).tolist(), ['apple pie', 'Banana', '', 'kiwi'])
+        self.assertEqual(
+            p.parse('SUBSTITUTE(S, "p", "P", 2)')['result'](variables).tolist(),
+            ['apPle pie', 'Banana\t', '', 'kiwi'],
+        )
+        # removing text gives the same rows as removing it from each text alone
+        removed = p.parse('SUBSTITUTE(S, "a", "")')['result'](variables).tolist()
+        self.assertEqual(removed, ['pple pie', 'Bnn\t', '', 'kiwi'])
+        self.assertEqual(removed, [p.parse('SUBSTITUTE(T, "a", "")')['result']({'T': text}) for text in texts.tolist()])
+        self.assertEqual(
+            p.parse('CONCATENATE(S, "-", A)')['result'](variables).tolist(),
+            ['apple pie-65', 'Banana\t-66', '-0', 'kiwi-300'],
+        )
+        self.assertEqual(
+            p.parse('TEXTJOIN("/", TRUE, S, "x")')['result'](variables).tolist(),
+            ['apple pie/x', 'Banana\t/x', 'x', 'kiwi/x'],
+        )
+        self.assertEqual(p.parse('CHAR(A)')['result'](variables).tolist(), ['A', 'B', error.VALUE, error.VALUE])
+        codes = p.parse('CODE(S)')['result'](variables)
+        self.assertEqual(codes[[0, 1, 3]].tolist(), [97, 66, 107])
+        self.assertTrue(torch.isnan(codes[2]))
+        lengths = p.parse('LEN(CHAR(A))')['result'](variables)
+        self.assertEqual(lengths[:2].tolist(), [1, 1])
+        self.assertTrue(torch.isnan(lengths[2:]).all())
+
+    def test_concatenation_columns(self):
+        p = Parser(debug=True)
+        variables = {
+            'S': np.array(['north', 'south', 'east']),
+            'N': torch.tensor([1.5, 2.0, float('nan')], dtype=torch.double),
+        }
+        self.assertEqual(p.parse('S&"-"&N')['result'](variables).tolist(), ['north-1.5', 'south-2', error.VALUE])
+        self.assertEqual(p.parse('"#"&S')['result'](variables).tolist(), ['#north', '#south', '#east'])
+        self.assertEqual(p.parse('S&S')['result'](variables).tolist(), ['northnorth', 'southsouth', 'easteast'])
+        self.assertEqual(p.parse('UPPER(S&"!")')['result'](variables).tolist(), ['NORTH!', 'SOUTH!', 'EAST!'])
+        self.assertEqual(p.parse('"a"&(1/0)')['result']({}), error.DIV_ZERO)
+        self.assertEqual(p.parse('"a"&1.50')['result']({}), 'a1.5')
+        self.assertEqual(p.parse('"a"&DATE(2020,1,1)')['result']({}), 'a43831')
+
+    def test_dictionary_encoded_columns(self):
+        p = Parser(debug=True)
+        regions = DictionaryArray.encode(np.array(['north', 'south', 'north', 'east']))
+        variables = {'S': regions, 'N': torch.tensor([1., 2, 3, 4], dtype=torch.double)}
+        upper = p.parse('UPPER(S)&"!"')['result'](variables)
+        self.assertIsInstance(upper, DictionaryArray)
+        self.assertIs(upper.codes, regions.codes)
+        self.assertEqual(upper.tolist(), ['NORTH!', 'SOUTH!', 'NORTH!', 'EAST!'])
+        self.assertIsInstance(p.parse('CONCATENATE("<", S, ">")')['result'](variables), DictionaryArray)
+        self.assertEqual(p.parse('LEN(S)')['result'](variables).tolist(), [5, 5, 5, 4])
+        self.assertEqual(p.parse('COUNTIF(S, "n*")')['result'](variables), 2)
+        self.assertEqual(p.parse('SUMIF(S, "north", N)')['result'](variables), 4)
+        # anything that isn't a string operation gets the plain column
+        self.assertEqual(p.parse('S&N')['result'](variables).tolist(), ['north1', 'south2', 'north3', 'east4'])
+        self.assertEqual(np.asarray(regions).tolist(), ['north', 'south', 'north', 'east'])